@@ -0,0 +1,66 @@
+from timeit import timeit
+from uuid import uuid4
+from fastapi_cruddy_framework import (
+    JsonCodec,
+    MsgpackCodec,
+    PickleCodec,
+    PubSubCodec,
+    SocketMessage,
+    ROOM_EVENT,
+)
+
+# Every node decodes every message on the channel, so per-message cost is multiplied
+# by the fan-out rate, not by the number of sockets a message is delivered to.
+FANOUT_RATES = [1_000, 10_000, 50_000]
+ITERATIONS = 20_000
+
+
+def sample_message() -> SocketMessage:
+    return SocketMessage(
+        route=ROOM_EVENT,
+        target=f"group:{uuid4()}",
+        type="record_updated",
+        sender=f"{uuid4()}",
+        data={
+            "id": f"{uuid4()}",
+            "name": "Prancing Pony Regulars",
+            "members": 42,
+            "tags": ["bree", "inn", "ale"],
+            "active": True,
+            "score": 0.875,
+            "updated_at": "2024-05-01T12:00:00+00:00",
+        },
+    )
+
+
+def available_codecs() -> dict[str, PubSubCodec]:
+    codecs: dict[str, PubSubCodec] = {"json": JsonCodec(), "pickle": PickleCodec()}
+    try:
+        codecs["msgpack"] = MsgpackCodec()
+    except ImportError:
+        print("msgpack is not installed, skipping MsgpackCodec")
+    return codecs
+
+
+def main():
+    message = sample_message()
+    codecs = available_codecs()
+    print(
+        f"{'codec':<10}{'bytes':>8}{'encode us':>12}{'decode us':>12}"
+        + "".join(f"{f'cpu @ {rate}/s':>18}" for rate in FANOUT_RATES)
+    )
+    for name, codec in codecs.items():
+        payload = codec.encode(message)
+        assert codec.decode(payload) == message
+        encode = timeit(lambda: codec.encode(message), number=ITERATIONS) / ITERATIONS
+        decode = timeit(lambda: codec.decode(payload), number=ITERATIONS) / ITERATIONS
+        print(
+            f"{name:<10}{len(payload):>8}{encode * 1e6:>12.2f}{decode * 1e6:>12.2f}"
+            + "".join(
+                f"{f'{(encode + decode) * rate:.1%}':>18}" for rate in FANOUT_RATES
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,4 +5,6 @@ from examples.fastapi_cruddy_sqlite.policies.verify_session import verify_sessio
 graphql_controller = GraphQLController(
     dependencies=[verify_session],
     root_query=Query,
+    # connection fields nest two extra levels (edges -> node) below a record
+    max_depth=5,
 )
@@ -11,6 +11,7 @@ from examples.fastapi_cruddy_sqlite.middleware import RequestLogger
 from examples.fastapi_cruddy_sqlite.adapters import sqlite
 from examples.fastapi_cruddy_sqlite.services.websocket_1 import websocket_manager_1
 from examples.fastapi_cruddy_sqlite.services.websocket_2 import websocket_manager_2
+from examples.fastapi_cruddy_sqlite.services.cache import cruddy_cache
 from starlette_session import SessionMiddleware
 from datetime import timedelta
 
@@ -30,6 +31,8 @@ async def bootstrap(application: FastAPI):
     # This .startup() function will spawn a listener loop that watches redis pub/sub channels.
     await websocket_manager_1.startup()
     await websocket_manager_2.startup()
+    # The repository cache listens for invalidations from other workers the same way.
+    await cruddy_cache.startup()
     application.include_router(application_router)
     logger.info(f"{general.PROJECT_NAME}, {general.API_VERSION}: Bootstrap complete")
     # You can do any init hooks below
@@ -38,6 +41,7 @@ async def bootstrap(application: FastAPI):
 async def shutdown():
     await websocket_manager_1.dispose()
     await websocket_manager_2.dispose()
+    await cruddy_cache.dispose()
 
 
 @asynccontextmanager
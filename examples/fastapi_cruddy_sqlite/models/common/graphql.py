@@ -1,4 +1,7 @@
-from fastapi_cruddy_framework import generate_gql_loader_and_type
+from fastapi_cruddy_framework import (
+    generate_gql_loader_and_type,
+    generate_gql_connection_type,
+)
 
 COMMENT_CLASS_LOADER, COMMENT_LIST_TYPE = generate_gql_loader_and_type(
     "CommentQL", "examples.fastapi_cruddy_sqlite.models.comment"
@@ -27,3 +30,9 @@ SUBTYPE_CLASS_LOADER, SUBTYPE_LIST_TYPE = generate_gql_loader_and_type(
 REFERENCE_CLASS_LOADER, REFERENCE_LIST_TYPE = generate_gql_loader_and_type(
     "ReferenceQL", "examples.fastapi_cruddy_sqlite.models.reference"
 )
+USER_CONNECTION_TYPE = generate_gql_connection_type(
+    "UserQL", "examples.fastapi_cruddy_sqlite.models.user"
+)
+POST_CONNECTION_TYPE = generate_gql_connection_type(
+    "PostQL", "examples.fastapi_cruddy_sqlite.models.post"
+)
@@ -11,6 +11,7 @@ from examples.fastapi_cruddy_sqlite.models.common.graphql import (
     SECTION_CLASS_LOADER,
     USER_LIST_TYPE,
     USER_CLASS_LOADER,
+    USER_CONNECTION_TYPE,
     TYPE_LIST_TYPE,
     TYPE_CLASS_LOADER,
     SUBTYPE_LIST_TYPE,
@@ -27,6 +28,12 @@ class Query:
         graphql_type=USER_LIST_TYPE,
         class_loader=USER_CLASS_LOADER,
     )
+    # Exposes "users_connection", a cursor-paged alternative to "users"
+    user_connection = graphql_resolver.generate_connection_resolver(
+        type_name="user",
+        graphql_type=USER_CONNECTION_TYPE,
+        class_loader=USER_CLASS_LOADER,
+    )
     post = graphql_resolver.generate_resolver(
         type_name="post",
         graphql_type=POST_LIST_TYPE,
@@ -18,6 +18,7 @@ from examples.fastapi_cruddy_sqlite.models.common.graphql import (
     GROUP_CLASS_LOADER,
     POST_LIST_TYPE,
     POST_CLASS_LOADER,
+    POST_CONNECTION_TYPE,
 )
 from examples.fastapi_cruddy_sqlite.utils.schema_example import schema_example
 
@@ -157,6 +158,13 @@ class UserQL:
         route_generator=lambda x: f"users/{getattr(x, 'id')}/posts",
         class_loader=POST_CLASS_LOADER,
     )
+    # Cursor-paged variant of "posts", exposed as "posts_connection"
+    posts_connection = graphql_resolver.generate_connection_resolver(
+        type_name="post",
+        graphql_type=POST_CONNECTION_TYPE,
+        route_generator=lambda x: f"users/{getattr(x, 'id')}/posts",
+        class_loader=POST_CLASS_LOADER,
+    )
     groups = graphql_resolver.generate_resolver(
         type_name="group",
         graphql_type=GROUP_LIST_TYPE,
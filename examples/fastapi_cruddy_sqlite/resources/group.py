@@ -1,5 +1,7 @@
-from fastapi_cruddy_framework import Resource, UUID
+from fastapi_cruddy_framework import Resource, CachePolicy, SingleFlight, UUID
 from examples.fastapi_cruddy_sqlite.adapters import sqlite
+from examples.fastapi_cruddy_sqlite.services.cache import cruddy_cache
+from examples.fastapi_cruddy_sqlite.services.live_queries import live_queries
 from examples.fastapi_cruddy_sqlite.models.group import (
     Group,
     GroupCreate,
@@ -18,4 +20,7 @@ resource = Resource(
     resource_model=Group,
     policies_universal=[verify_session],
     default_limit=general.DEFAULT_LIMIT,
+    cache_policy=CachePolicy(ttl=30, max_entries=500, cache=cruddy_cache),
+    single_flight=SingleFlight(max_wait=5),
+    live_queries=live_queries,
 )
@@ -3,6 +3,7 @@ import examples.fastapi_cruddy_sqlite
 from fastapi import APIRouter, WebSocket
 from fastapi_cruddy_framework import (
     uuid7,
+    CruddyAdmissionRejectedException,
     CreateRouterFromResources,
     CruddyResourceRegistry,
     dependency_list,
@@ -49,30 +50,35 @@ async def websocket_connector1(websocket: WebSocket):
     # The manager will default to a uuid4
     override_socket_id = str(uuid7())
     # You can pass in a default message to auto-broadcast when the socket disconnects
-    async with websocket_manager_1.connect(
-        websocket,
-        override_socket_id=override_socket_id,
-        disconnect_message_type="socket_disconnect",
-        disconnect_message_data={
-            "socket_id": f"{override_socket_id}",
-            "message": f"Websocket client {override_socket_id} disconnected",
-        },
-    ) as socket_id:
-        logger.info("Socket %s connected", socket_id)
-        await websocket_manager_1.broadcast(
-            type="socket_connect", data={"socket_id": socket_id}
-        )
-        # The context manager will return the id of the socket, which could have been auto-generated
-        # or overriden when .connect() was called. If code steps into this async context, it means
-        # your socket is now fully connected, and has been added to the connected_sockets tracker.
-        #
-        # Any code written here will execute immediately AFTER accepting the socket connection, but
-        # BEFORE the socket manager starts listening indefinitely for messages from the new client.
-        # You can use this space to do additional setup, log information, or mutate the socket state.
-    # Any code after the async context WILL NOT EXECUTE until the socket disconnects, whether that is
-    # a voluntary disconnect, or a force disconnect. The websocket_manager has several methods to
-    # force-kill sockets by id, room, or a custom identity function. You can do this in controller
-    # functions, etc.
+    try:
+        async with websocket_manager_1.connect(
+            websocket,
+            override_socket_id=override_socket_id,
+            disconnect_message_type="socket_disconnect",
+            disconnect_message_data={
+                "socket_id": f"{override_socket_id}",
+                "message": f"Websocket client {override_socket_id} disconnected",
+            },
+        ) as socket_id:
+            logger.info("Socket %s connected", socket_id)
+            await websocket_manager_1.broadcast(
+                type="socket_connect", data={"socket_id": socket_id}
+            )
+            # The context manager will return the id of the socket, which could have been auto-generated
+            # or overriden when .connect() was called. If code steps into this async context, it means
+            # your socket is now fully connected, and has been added to the connected_sockets tracker.
+            #
+            # Any code written here will execute immediately AFTER accepting the socket connection, but
+            # BEFORE the socket manager starts listening indefinitely for messages from the new client.
+            # You can use this space to do additional setup, log information, or mutate the socket state.
+        # Any code after the async context WILL NOT EXECUTE until the socket disconnects, whether that is
+        # a voluntary disconnect, or a force disconnect. The websocket_manager has several methods to
+        # force-kill sockets by id, room, or a custom identity function. You can do this in controller
+        # functions, etc.
+    except CruddyAdmissionRejectedException as e:
+        # A manager created with admission=AdmissionControl(...) turns sockets away during a
+        # reconnect storm. The socket is already closed with a retry hint, so just log it.
+        logger.info("Socket rejected, retry after %s seconds", e.retry_after)
 
 
 # The ws2 endpoint exists to test out the "custom" identity function of the websocket manager
@@ -81,18 +87,21 @@ async def websocket_connector2(websocket: WebSocket):
     # There is still a socket id associated with all sockets, even in custom mode
     override_socket_id = str(uuid7())
     client_id = get_client_identity(websocket)
-    async with websocket_manager_2.connect(
-        websocket,
-        override_socket_id=override_socket_id,
-        disconnect_message_type="socket_disconnect",
-        disconnect_message_data={
-            "socket_id": f"{override_socket_id}",
-            "client_id": f"{client_id}",
-            "message": f"Websocket client {override_socket_id} disconnected",
-        },
-    ) as socket_id:
-        logger.info("Socket %s connected", socket_id)
-        await websocket_manager_2.broadcast(
-            type="socket_connect",
-            data={"socket_id": socket_id, "client_id": f"{client_id}"},
-        )
+    try:
+        async with websocket_manager_2.connect(
+            websocket,
+            override_socket_id=override_socket_id,
+            disconnect_message_type="socket_disconnect",
+            disconnect_message_data={
+                "socket_id": f"{override_socket_id}",
+                "client_id": f"{client_id}",
+                "message": f"Websocket client {override_socket_id} disconnected",
+            },
+        ) as socket_id:
+            logger.info("Socket %s connected", socket_id)
+            await websocket_manager_2.broadcast(
+                type="socket_connect",
+                data={"socket_id": socket_id, "client_id": f"{client_id}"},
+            )
+    except CruddyAdmissionRejectedException as e:
+        logger.info("Socket rejected, retry after %s seconds", e.retry_after)
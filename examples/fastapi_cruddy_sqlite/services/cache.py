@@ -0,0 +1,7 @@
+from fastapi_cruddy_framework import CruddyCache
+from examples.fastapi_cruddy_sqlite.config import adapters
+
+# One shared cache backend per application. Each Resource opts in with a CachePolicy.
+# Writes on any worker are broadcast on the "cruddy_cache" channel so every worker
+# evicts its in-process entries.
+cruddy_cache = CruddyCache(redis_mode=adapters.REDIS_MODE, redis_channel="cruddy_cache")
@@ -0,0 +1,21 @@
+from typing import Any
+from fastapi import WebSocket
+from fastapi_cruddy_framework import LiveQueryHub
+from examples.fastapi_cruddy_sqlite.services.websocket_1 import websocket_manager_1
+from examples.fastapi_cruddy_sqlite.utils.session import get_client_identity
+
+# Only these resources may be watched from /ws1. Each must also opt in with
+# live_queries=live_queries on its Resource.
+WATCHABLE_RESOURCES = {"Group"}
+
+
+# Pushed rows skip session_setup / row-level security, so the hub denies every
+# subscription this hook doesn't approve. A real application would check the
+# socket's user against the resource and where filter here.
+async def authorize_live_query(websocket: WebSocket, resource: str, where: Any) -> bool:
+    return (
+        get_client_identity(websocket) is not None and resource in WATCHABLE_RESOURCES
+    )
+
+
+live_queries = LiveQueryHub(websocket_manager_1, authorize=authorize_live_query)
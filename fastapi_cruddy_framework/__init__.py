@@ -25,6 +25,12 @@ from .schemas import (
     CONTROL_EVENT,
     ROOM_EVENT,
     CLIENT_EVENT,
+    CACHE_EVENT,
+    MULTICAST_EVENT,
+    HEARTBEAT_EVENT,
+    REPLAY_EVENT,
+    LIVE_QUERY_EVENT,
+    DRAIN_EVENT,
     KILL_SOCKET_BY_ID,
     KILL_SOCKET_BY_CLIENT,
     KILL_ROOM_BY_ID,
@@ -61,12 +67,42 @@ from .schemas import (
     uuid7,
     UUID,
 )
-from .pubsub import PubSub
-from .websocket_manager import WebsocketConnectionManager
+from .presence import PresenceRegistry
+from .replay import ReplayLog, MemoryReplayLog, RedisReplayLog
+from .live_query import LiveQueryHub, LiveSubscription, compile_where
+from .work_queue import StreamWorkQueue, WorkItem
+from .pubsub import (
+    PubSub,
+    InProcessBroker,
+    PubSubCodec,
+    JsonCodec,
+    MsgpackCodec,
+    PickleCodec,
+)
+from .cache import (
+    CruddyCache,
+    CachePolicy,
+    RepositoryCache,
+    SingleFlight,
+    CacheCodec,
+    JsonCacheCodec,
+    PickleCacheCodec,
+)
+from .websocket_manager import (
+    WebsocketConnectionManager,
+    CoalescePolicy,
+    InboundDispatcher,
+    TimerWheel,
+    AdmissionControl,
+    DrainPolicy,
+    OutboundFrame,
+)
 from .controller import (
     Actions,
     CruddyController,
     ControllerConfigurator,
+    CruddyConditionalRoute,
+    conditional_get,
     OPENAPI_WHERE_OVERRIDE,
 )
 from .repository import AbstractRepository
@@ -81,9 +117,13 @@ from .graphql import (
     GraphQLController,
     GraphQLRequestCache,
     GraphQLResolverService,
+    CruddyConnection,
+    CruddyEdge,
+    CruddyPageInfo,
     create_module_resolver,
     graphql_where_synthesizer,
     generate_gql_loader_and_type,
+    generate_gql_connection_type,
     GQL_WHERE_REPLACEMENT_CHARACTER,
 )
 from .resource import Resource, ResourceRegistry, CruddyResourceRegistry
@@ -100,11 +140,17 @@ from .util import (
     json_serial,
     to_json_string,
     to_json_object,
+    encode_cursor,
+    decode_cursor,
     get_state,
     set_state,
     dependency_list,
 )
-from .exceptions import CruddyNoMatchingRowException
+from .exceptions import (
+    CruddyNoMatchingRowException,
+    CruddyInvalidCursorException,
+    CruddyAdmissionRejectedException,
+)
 from .security import CruddyHTTPBearer
 from .test_helpers import BrowserTestClient
 from async_asgi_testclient import TestClient
@@ -0,0 +1,427 @@
+from __future__ import annotations
+from typing import Any, Literal
+from asyncio import (
+    CancelledError,
+    Future,
+    TimeoutError as _TimeoutError,
+    get_running_loop,
+    shield,
+    wait_for,
+)
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from datetime import date, datetime, time
+from decimal import Decimal
+from hashlib import blake2b
+from json import dumps, loads
+from logging import getLogger
+from pickle import dumps as pickle_dumps, loads as pickle_loads, HIGHEST_PROTOCOL
+from time import monotonic
+from uuid import UUID, uuid4
+from fastapi import Request
+from sqlalchemy.engine import Row
+from sqlalchemy.engine.result import result_tuple
+from .adapters import RedisAdapter
+from .pubsub import PubSub, PubSubCodec
+from .schemas import SocketMessage, CACHE_EVENT
+from .util import json_serial
+
+logger = getLogger(__name__)
+CACHE_INVALIDATE = "invalidate"
+
+
+# -------------------------------------------------------------------------------------------
+# SHARED ENTRY ENCODINGS
+# -------------------------------------------------------------------------------------------
+class CacheCodec:
+    # Turns cached values (row mappings, row lists) into the bytes stored in redis
+    def encode(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCacheCodec(CacheCodec):
+    # The default. Values JSON lacks (rows, tuples, datetimes, UUIDs, decimals, bytes)
+    # are written as one key "$tag" objects, so they are read back as the same types.
+    # Decoding only ever produces plain data, whoever wrote the entry.
+    def encode(self, value: Any) -> bytes:
+        return dumps(_tag(value), separators=(",", ":"), default=json_serial).encode(
+            "utf-8"
+        )
+
+    def decode(self, payload: bytes) -> Any:
+        return loads(payload, object_hook=_untag)
+
+
+class PickleCacheCodec(CacheCodec):
+    # Entries are unpickled when read, so anyone able to write to the redis can run
+    # code in your workers. Only use it on a redis that nothing untrusted can reach.
+    def encode(self, value: Any) -> bytes:
+        return pickle_dumps(value, protocol=HIGHEST_PROTOCOL)
+
+    def decode(self, payload: bytes) -> Any:
+        return pickle_loads(payload)
+
+
+_UNTAG: dict[str, Callable[[Any], Any]] = {
+    "$row": lambda value: result_tuple(value[0])(value[1]),
+    "$tuple": tuple,
+    "$dict": lambda value: {key: item for key, item in value},
+    "$datetime": datetime.fromisoformat,
+    "$date": date.fromisoformat,
+    "$time": time.fromisoformat,
+    "$uuid": UUID,
+    "$decimal": Decimal,
+    "$bytes": b64decode,
+}
+
+
+def _tag(value: Any) -> Any:
+    if isinstance(value, Row):
+        return {"$row": [list(value._fields), [_tag(item) for item in value]]}
+    if isinstance(value, tuple):
+        return {"$tuple": [_tag(item) for item in value]}
+    if isinstance(value, list):
+        return [_tag(item) for item in value]
+    if isinstance(value, dict):
+        # Keys JSON can't hold, or that could pass for a tag, keep their items as pairs
+        if any(not isinstance(key, str) or key in _UNTAG for key in value):
+            return {"$dict": [[_tag(key), _tag(item)] for key, item in value.items()]}
+        return {key: _tag(item) for key, item in value.items()}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, time):
+        return {"$time": value.isoformat()}
+    if isinstance(value, UUID):
+        return {"$uuid": value.hex}
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, bytes):
+        return {"$bytes": b64encode(value).decode("ascii")}
+    return value
+
+
+def _untag(value: dict) -> Any:
+    if len(value) == 1:
+        key, item = next(iter(value.items()))
+        untag = _UNTAG.get(key)
+        if untag is not None:
+            return untag(item)
+    return value
+
+
+# -------------------------------------------------------------------------------------------
+# SHARED CACHE BACKEND (ONE PER APPLICATION)
+# -------------------------------------------------------------------------------------------
+class CruddyCache:
+    pubsub_instance: PubSub
+    redis_adapter: RedisAdapter
+    redis_tier: bool
+    key_prefix: str
+    entry_codec: CacheCodec
+    node_id: str
+    repository_caches: dict[str, "RepositoryCache"]
+
+    def __init__(
+        self,
+        pubsub_instance: PubSub | None = None,
+        redis_mode: Literal["redis"] | Literal["memory"] = "redis",
+        redis_adapter: RedisAdapter | None = None,
+        redis_channel: str = "cruddy_cache",
+        redis_host: str = "redis",
+        redis_port: int = 6379,
+        redis_max_connections: int = 10000,
+        redis_tier: bool = True,
+        key_prefix: str = "cruddy:cache",
+        codec: PubSubCodec | None = None,
+        # How entries are stored in redis. Defaults to JsonCacheCodec().
+        entry_codec: CacheCodec | None = None,
+    ):
+        if redis_adapter is None:
+            redis_adapter = (
+                pubsub_instance.redis_client
+                if pubsub_instance is not None
+                else RedisAdapter(
+                    mode=redis_mode,
+                    redis_host=redis_host,
+                    redis_port=redis_port,
+                    redis_max_connections=redis_max_connections,
+                )
+            )
+        self.redis_adapter = redis_adapter  # type: ignore
+        self.pubsub_instance = (
+            PubSub(channel=redis_channel, redis_client=redis_adapter, codec=codec)
+            if pubsub_instance is None
+            else pubsub_instance
+        )
+        # An InProcessBroker has no redis to share entries through
+        self.redis_tier = redis_tier and redis_adapter is not None
+        self.key_prefix = key_prefix
+        self.entry_codec = JsonCacheCodec() if entry_codec is None else entry_codec
+        self.node_id = f"{uuid4()}"
+        self.repository_caches = {}
+        self.pubsub_instance.on(CACHE_EVENT, self._handle_invalidation)
+
+    async def startup(self):
+        await self.pubsub_instance.startup()
+
+    async def dispose(self):
+        await self.pubsub_instance.dispose()
+
+    def register(self, repository_cache: "RepositoryCache"):
+        self.repository_caches[repository_cache.namespace] = repository_cache
+
+    def generation_key(self, namespace: str):
+        return f"{self.key_prefix}:{namespace}:generation"
+
+    def entry_key(self, namespace: str, generation: int, key: str):
+        return f"{self.key_prefix}:{namespace}:{generation}:{key}"
+
+    # Redis entries are keyed by a per-namespace generation, so a write "drops" every
+    # shared entry with one INCR and the stale generation simply ages out via its TTL.
+    async def get_generation(self, namespace: str) -> int:
+        value = await self.redis_adapter.get_client().get(
+            self.generation_key(namespace)
+        )
+        return 0 if value is None else int(value)
+
+    async def get(self, namespace: str, generation: int, key: str) -> Any:
+        value = await self.redis_adapter.get_client().get(
+            self.entry_key(namespace, generation, key)
+        )
+        return None if value is None else self.entry_codec.decode(value)
+
+    async def set(
+        self, namespace: str, generation: int, key: str, value: Any, ttl: float
+    ):
+        await self.redis_adapter.get_client().set(
+            self.entry_key(namespace, generation, key),
+            self.entry_codec.encode(value),
+            px=max(int(ttl * 1000), 1),
+        )
+
+    async def invalidate(self, namespace: str) -> int | None:
+        generation = None
+        if self.redis_tier:
+            generation = await self.redis_adapter.get_client().incr(
+                self.generation_key(namespace)
+            )
+        await self.pubsub_instance.publish(
+            SocketMessage(
+                route=CACHE_EVENT,
+                target=namespace,
+                type=CACHE_INVALIDATE,
+                sender=self.node_id,
+                data={"generation": generation},
+            )
+        )
+        return generation
+
+    async def _handle_invalidation(self, message: SocketMessage):
+        # Our own writes already evicted locally
+        if message.sender == self.node_id or message.type != CACHE_INVALIDATE:
+            return
+        repository_cache = self.repository_caches.get(str(message.target))
+        if repository_cache is not None:
+            repository_cache.evict(generation=(message.data or {}).get("generation"))
+
+
+# -------------------------------------------------------------------------------------------
+# PER-RESOURCE CACHE POLICY
+# -------------------------------------------------------------------------------------------
+class CachePolicy:
+    ttl: float
+    max_entries: int
+    cache: CruddyCache | None
+    scope: Callable[[Request | None], Any] | None
+
+    def __init__(
+        self,
+        ttl: float = 60,
+        max_entries: int = 1000,
+        # Without a CruddyCache, entries only live in this process's LRU
+        cache: CruddyCache | None = None,
+        # Returns a value partitioning cached reads (e.g. a role or tenant id) for
+        # resources whose rows vary per principal via session_setup / row-level security
+        scope: Callable[[Request | None], Any] | None = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache = cache
+        self.scope = scope
+
+
+# -------------------------------------------------------------------------------------------
+# READ-THROUGH CACHE (ONE PER REPOSITORY)
+# -------------------------------------------------------------------------------------------
+class RepositoryCache:
+    namespace: str
+    policy: CachePolicy
+    entries: OrderedDict[str, tuple[float, Any]]
+    generation: int | None
+    epoch: int
+    hits: int
+    misses: int
+
+    def __init__(self, namespace: str, policy: CachePolicy):
+        self.namespace = namespace
+        self.policy = policy
+        self.entries = OrderedDict()
+        self.generation = None
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        if policy.cache is not None:
+            policy.cache.register(self)
+
+    def build_key(self, kind: str, params: Any, request: Request | None = None) -> str:
+        scope = None if self.policy.scope is None else self.policy.scope(request)
+        raw = dumps([kind, params, scope], sort_keys=True, default=json_serial)
+        return blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    # Cached values are shared between callers, so loaders should return data the
+    # repository copies (row mappings, row lists) rather than hook-mutable models.
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+        # An eviction while we await means our value may predate the write
+        epoch = self.epoch
+        cache = self.policy.cache
+        shared = cache is not None and cache.redis_tier
+        if shared:
+            try:
+                if self.generation is None:
+                    self.generation = await cache.get_generation(self.namespace)
+                value = await cache.get(self.namespace, self.generation, key)
+                if value is not None:
+                    self.hits += 1
+                    if epoch == self.epoch:
+                        self._store(key, value)
+                    return value
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Unable to read cache entry |%s|", e)
+        self.misses += 1
+        value = await loader()
+        if value is None or epoch != self.epoch:
+            return value
+        self._store(key, value)
+        if shared and self.generation is not None:
+            try:
+                await cache.set(
+                    self.namespace, self.generation, key, value, self.policy.ttl
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Unable to write cache entry |%s|", e)
+        return value
+
+    def _store(self, key: str, value: Any):
+        self.entries[key] = (monotonic() + self.policy.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.policy.max_entries:
+            self.entries.popitem(last=False)
+
+    def evict(self, generation: int | None = None):
+        self.epoch += 1
+        self.entries.clear()
+        if generation is not None and (
+            self.generation is None or generation > self.generation
+        ):
+            self.generation = generation
+
+    async def invalidate(self):
+        self.evict()
+        if self.policy.cache is None:
+            return
+        try:
+            self.evict(generation=await self.policy.cache.invalidate(self.namespace))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("Unable to broadcast cache invalidation |%s|", e)
+
+
+# -------------------------------------------------------------------------------------------
+# REQUEST COALESCING (ONE PER REPOSITORY)
+# -------------------------------------------------------------------------------------------
+class SingleFlight:
+    max_wait: float | None
+    scope: Callable[[Request | None], Any] | None
+    in_flight: dict[str, Future]
+    executed: int
+    coalesced: int
+    timeouts: int
+
+    def __init__(
+        self,
+        # How long a follower waits on the in-flight query before running its own
+        max_wait: float | None = 5,
+        # Same contract as CachePolicy.scope: callers only share results within a scope
+        scope: Callable[[Request | None], Any] | None = None,
+    ):
+        self.max_wait = max_wait
+        self.scope = scope
+        self.in_flight = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def build_key(self, statements: list[Any], request: Request | None = None) -> str:
+        parts = []
+        for statement in statements:
+            compiled = statement.compile()
+            parts.append([str(compiled), repr(compiled.params)])
+        scope = None if self.scope is None else self.scope(request)
+        raw = dumps([parts, scope], default=json_serial)
+        return blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "in_flight": len(self.in_flight),
+        }
+
+    # Identical concurrent reads await the first caller's query instead of issuing their own.
+    # Results are shared, so loaders should return data the repository copies.
+    async def do(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await wait_for(shield(future), self.max_wait)
+            except _TimeoutError:
+                self.timeouts += 1
+            except CancelledError:
+                # Only recover if the leader was cancelled, not this caller
+                if not future.cancelled():
+                    raise
+            return await loader()
+        future = get_running_loop().create_future()
+        # A failure nobody else awaited should not be reported as "never retrieved"
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.in_flight[key] = future
+        self.executed += 1
+        try:
+            value = await loader()
+        except CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
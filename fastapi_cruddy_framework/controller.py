@@ -2,16 +2,22 @@ from abc import ABC, abstractmethod
 from logging import getLogger
 from typing import Any, Literal, Sequence, Type, TYPE_CHECKING, cast
 from asyncio import gather
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import blake2b
 from fastapi import (
     FastAPI,
     APIRouter,
     Request,
+    Response,
     Path,
     Query,
     Depends,
     HTTPException,
     status,
 )
+from fastapi.routing import APIRoute
 from .test_helpers import TestClient, BrowserTestClient
 from sqlalchemy import Row
 from sqlalchemy.sql.schema import Column
@@ -24,6 +30,7 @@ from sqlalchemy.orm import (
 from pydantic.types import Json
 from pydantic.fields import FieldInfo
 from .inflector import pluralizer
+from .exceptions import CruddyInvalidCursorException
 from .schemas import (
     UUID,
     RelationshipConfig,
@@ -34,7 +41,16 @@ from .schemas import (
     CruddyModel,
     CruddyGenericModel,
 )
-from .util import filter_headers, possible_id_types, possible_id_values, lifecycle_types
+from .util import (
+    filter_headers,
+    possible_id_types,
+    possible_id_values,
+    lifecycle_types,
+    decode_cursor,
+    coerce_to_utc_datetime,
+    get_state,
+    set_state,
+)
 
 if TYPE_CHECKING:
     from .repository import AbstractRepository
@@ -50,6 +66,7 @@ META_NUM_RELATION_MODIFIED_KEY = "total_modified"
 META_RELATED_RECORDS_KEY = "records"
 META_FAILED_RECORDS_KEY = "invalid"
 META_VALIDATION_MESSAGES_KEY = "messages"
+LAST_MODIFIED_STATE_KEY = "cruddy_last_modified"
 OPENAPI_WHERE_OVERRIDE = {
     "parameters": [
         {
@@ -318,6 +335,24 @@ class Actions:
                 },
                 META_KEY: None,
             }
+            # A versioned record can answer If-Modified-Since with a single column lookup,
+            # unless a hook might reshape the query or the response
+            if (
+                request.headers.get("if-modified-since")
+                and not request.headers.get("if-none-match")
+                and not self.lifecycle["before_get_one"]
+                and not repository.lifecycle["before_get_one"]
+                and not self.lifecycle["after_get_one"]
+                and not repository.lifecycle["after_get_one"]
+            ):
+                version = await repository.get_version(
+                    **context_data[DATA_KEY], request=request
+                )
+                if version is not None and not_modified_since(request, version):
+                    return Response(
+                        status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers={"last-modified": format_http_date(version)},
+                    )
             # If there is a user space lifecycle hook, run it (allows context mutations)
             if self.lifecycle["before_get_one"]:
                 await self.lifecycle["before_get_one"](request, context_data)
@@ -329,6 +364,12 @@ class Actions:
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Record id {id} not found",
                 )
+            if isinstance(getattr(data, "updated_at", None), datetime):
+                set_state(
+                    request,
+                    LAST_MODIFIED_STATE_KEY,
+                    coerce_to_utc_datetime(data.updated_at),
+                )
             # Update the operating context
             context_data[DATA_KEY] = data
             # If there is a user space lifecycle hook, run it (allows context mutations)
@@ -344,6 +385,8 @@ class Actions:
             columns: list[str] = Query(None, alias="columns"),
             sort: list[str] = Query(None, alias="sort"),
             where: Json = Query(None, alias="where", include_in_schema=False),
+            after: str | None = None,
+            before: str | None = None,
         ):
             context_data = {
                 DATA_KEY: {
@@ -352,6 +395,8 @@ class Actions:
                     "columns": columns,
                     "sort": sort,
                     "where": where,
+                    "after": parse_cursor(after),
+                    "before": parse_cursor(before),
                 },
                 META_KEY: None,
             }
@@ -359,9 +404,10 @@ class Actions:
             if self.lifecycle["before_get_all"]:
                 await self.lifecycle["before_get_all"](request, context_data)
             # Find the core objects in the repository
-            result: BulkDTO = await repository.get_all(
-                **context_data[DATA_KEY], request=request
-            )
+            with invalid_cursor_is_bad_request():
+                result: BulkDTO = await repository.get_all(
+                    **context_data[DATA_KEY], request=request
+                )
             # Update the operating context
             context_data[DATA_KEY] = result.data
             context_data[META_KEY] = {
@@ -674,6 +720,106 @@ class CruddyController(ABC):
 # -------------------------------------------------------------------------------------------
 
 
+def parse_cursor(cursor: str | None):
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+# A cursor is only checked against the ordering once the repository builds the query
+@contextmanager
+def invalid_cursor_is_bad_request():
+    try:
+        yield
+    except CruddyInvalidCursorException as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)
+        ) from e
+
+
+def format_http_date(value: datetime) -> str:
+    return format_datetime(coerce_to_utc_datetime(value), usegmt=True)
+
+
+def not_modified_since(request: Request, version: datetime) -> bool:
+    header = request.headers.get("if-modified-since")
+    if not header:
+        return False
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    since = coerce_to_utc_datetime(since)
+    # HTTP dates only carry whole seconds
+    return version.replace(microsecond=0) <= since
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison function
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates
+
+
+class CruddyConditionalRoute(APIRoute):
+    # Route class for the generated GET endpoints. Successful JSON responses get a strong
+    # ETag (a hash of the serialized body) plus a Last-Modified header when the action
+    # recorded one, and matching If-None-Match / If-Modified-Since requests get a bodiless 304.
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def conditional_route_handler(request: Request) -> Response:
+            response = await handler(request)
+            if response.status_code != status.HTTP_200_OK or not hasattr(
+                response, "body"
+            ):
+                return response
+            etag = f'"{blake2b(bytes(response.body), digest_size=16).hexdigest()}"'
+            response.headers["etag"] = etag
+            last_modified: datetime | None = get_state(request, LAST_MODIFIED_STATE_KEY)
+            if last_modified is not None:
+                response.headers["last-modified"] = format_http_date(last_modified)
+            # If-Modified-Since is only consulted when If-None-Match is absent (RFC 9110)
+            if etag_matches(request, etag) or (
+                last_modified is not None
+                and not request.headers.get("if-none-match")
+                and not_modified_since(request, last_modified)
+            ):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers={
+                        k: v
+                        for k, v in response.headers.items()
+                        if k not in ("content-length", "content-type")
+                    },
+                )
+            return response
+
+        return conditional_route_handler
+
+
+def conditional_get(controller: APIRouter, path: str, **kwargs):
+    # Same as controller.get(...), but bound to CruddyConditionalRoute
+    def decorator(endpoint):
+        controller.add_api_route(
+            path,
+            endpoint,
+            methods=["GET"],
+            route_class_override=CruddyConditionalRoute,
+            **kwargs,
+        )
+        return endpoint
+
+    return decorator
+
+
 def assemble_policies(*args: (Sequence)):
     merged = []
     for policy_set in args:
@@ -705,7 +851,8 @@ def _ControllerConfigManyToOne(
     # 1. Universal policies
     # 2. Primary resource policies
     # 3. Related resource policies
-    @controller.get(
+    @conditional_get(
+        controller,
         f'/{"{id}"}/{relationship_prop}',
         description=f"Get the '{foreign_model_name}' a '{resource_model_name}' belongs to",
         response_model=config.foreign_resource.schemas["single"],
@@ -859,7 +1006,8 @@ def _ControllerConfigOneToMany(
     # 1. Universal policies
     # 2. Primary resource policies
     # 3. Related resource policies
-    @controller.get(
+    @conditional_get(
+        controller,
         f'/{"{id}"}/{relationship_prop}',
         description=f"Get all '{foreign_model_name}' belonging to a '{resource_model_name}'",
         response_model=config.foreign_resource.schemas["many"],
@@ -879,6 +1027,8 @@ def _ControllerConfigOneToMany(
         columns: list[str] = Query(None, alias="columns"),
         sort: list[str] = Query(None, alias="sort"),
         where: Json = Query(None, alias="where", include_in_schema=False),
+        after: str | None = Query(None, alias="after"),
+        before: str | None = Query(None, alias="before"),
     ):
         origin_record: CruddyModel | None = await repository.get_by_id(
             id=id, request=request
@@ -910,6 +1060,8 @@ def _ControllerConfigOneToMany(
                 "columns": columns,
                 "sort": sort,
                 "where": where,
+                "after": parse_cursor(after),
+                "before": parse_cursor(before),
             },
             META_KEY: None,
         }
@@ -944,15 +1096,16 @@ def _ControllerConfigOneToMany(
             )
 
         # Collect the bulk data transfer object from the query
-        result: BulkDTO = await config.foreign_resource.repository.get_all(
-            **context_data[DATA_KEY],
-            request=request,
-            _lifecycle_before=_repo_lifecycle_before,
-            _lifecycle_after=config.foreign_resource.repository.lifecycle[
-                "after_get_all"
-            ],
-            _use_own_hooks=False,
-        )
+        with invalid_cursor_is_bad_request():
+            result: BulkDTO = await config.foreign_resource.repository.get_all(
+                **context_data[DATA_KEY],
+                request=request,
+                _lifecycle_before=_repo_lifecycle_before,
+                _lifecycle_after=config.foreign_resource.repository.lifecycle[
+                    "after_get_all"
+                ],
+                _use_own_hooks=False,
+            )
 
         context_data[DATA_KEY] = result.data
         context_data[META_KEY] = {
@@ -998,7 +1151,8 @@ def _ControllerConfigManyToMany(
     # 1. Universal policies
     # 2. Primary resource policies
     # 3. Related resource policies
-    @controller.get(
+    @conditional_get(
+        controller,
         f'/{"{id}"}/{relationship_prop}',
         description=f"Get all '{foreign_model_name}' related to a '{resource_model_name}'",
         response_model=config.foreign_resource.schemas["many"],
@@ -1018,6 +1172,8 @@ def _ControllerConfigManyToMany(
         columns: list[str] = Query(None, alias="columns"),
         sort: list[str] = Query(None, alias="sort"),
         where: Json = Query(None, alias="where", include_in_schema=False),
+        after: str | None = Query(None, alias="after"),
+        before: str | None = Query(None, alias="before"),
     ):
         # Consider raising 404 here and in get by ID
         if await repository.get_by_id(id=id, request=request) == None:
@@ -1032,6 +1188,8 @@ def _ControllerConfigManyToMany(
                 "columns": columns,
                 "sort": sort,
                 "where": where,
+                "after": parse_cursor(after),
+                "before": parse_cursor(before),
             },
             META_KEY: None,
         }
@@ -1043,21 +1201,22 @@ def _ControllerConfigManyToMany(
             )
 
         # Collect the bulk data transfer object from the query
-        result: BulkDTO = await repository.get_all_relations(
-            id=id,
-            relation=relationship_prop,
-            relation_model=far_model,
-            relation_view=far_view,
-            **context_data[DATA_KEY],
-            request=request,
-            # the foreign resource must interact with its own lifecycle
-            _lifecycle_before=config.foreign_resource.repository.lifecycle[
-                "before_get_all"
-            ],
-            _lifecycle_after=config.foreign_resource.repository.lifecycle[
-                "after_get_all"
-            ],
-        )
+        with invalid_cursor_is_bad_request():
+            result: BulkDTO = await repository.get_all_relations(
+                id=id,
+                relation=relationship_prop,
+                relation_model=far_model,
+                relation_view=far_view,
+                **context_data[DATA_KEY],
+                request=request,
+                # the foreign resource must interact with its own lifecycle
+                _lifecycle_before=config.foreign_resource.repository.lifecycle[
+                    "before_get_all"
+                ],
+                _lifecycle_after=config.foreign_resource.repository.lifecycle[
+                    "after_get_all"
+                ],
+            )
 
         context_data[DATA_KEY] = result.data
         context_data[META_KEY] = {
@@ -1139,7 +1298,8 @@ def ControllerConfigurator(
         )(actions.delete)
 
     if not disable_get_one:
-        controller.get(
+        conditional_get(
+            controller,
             "/{id}",
             description=f"Fetch a single '{single_name}'",
             response_model=single_schema,
@@ -1149,7 +1309,8 @@ def ControllerConfigurator(
         )(actions.get_by_id)
 
     if not disable_get_many:
-        controller.get(
+        conditional_get(
+            controller,
             "",
             description=f"Fetch many '{plural_name}'",
             response_model=many_schema,
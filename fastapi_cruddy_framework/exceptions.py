@@ -1,2 +1,15 @@
 class CruddyNoMatchingRowException(Exception):
     pass
+
+
+# A keyset cursor that doesn't fit the requested ordering; controllers answer it with a 400
+class CruddyInvalidCursorException(ValueError):
+    pass
+
+
+class CruddyAdmissionRejectedException(Exception):
+    retry_after: float
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Connection rejected, retry after {retry_after} seconds")
+        self.retry_after = retry_after
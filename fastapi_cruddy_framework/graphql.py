@@ -1,4 +1,4 @@
-from typing import Any, Awaitable, Sequence, Type
+from typing import Any, Awaitable, Generic, Sequence, Type, TypeVar
 from typing_extensions import Annotated
 from collections.abc import Callable
 from enum import Enum
@@ -10,7 +10,13 @@ from asyncio import Future
 from posixpath import join
 from fastapi import status, APIRouter, Request
 from fastapi.responses import PlainTextResponse
-from strawberry import Schema, ID, field as strawberry_field, lazy as strawberry_lazy
+from strawberry import (
+    Schema,
+    ID,
+    field as strawberry_field,
+    lazy as strawberry_lazy,
+    type as strawberry_type,
+)
 from strawberry.extensions import QueryDepthLimiter
 from strawberry.fastapi import GraphQLRouter
 from strawberry.printer import print_schema
@@ -20,12 +26,36 @@ from strawberry.types import Info
 from .inflector import pluralizer
 from .schemas import UUID
 from .test_helpers import BrowserTestClient, TestClient
-from .util import dependency_list, filter_headers
+from .util import dependency_list, filter_headers, encode_cursor
 
 logger = getLogger(__name__)
 GQL_WHERE_REPLACEMENT_CHARACTER = "__"
 HTTP_200_OK = status.HTTP_200_OK
 HTTP_404_NOT_FOUND = status.HTTP_404_NOT_FOUND
+GQLNodeType = TypeVar("GQLNodeType")
+
+
+# Relay-style connection types. Strawberry names each specialization after its
+# node type, so CruddyConnection[UserQL] is exposed as "UserConnection", etc.
+@strawberry_type(name="PageInfo")
+class CruddyPageInfo:
+    has_next_page: bool = strawberry_field(name="hasNextPage")
+    has_previous_page: bool = strawberry_field(name="hasPreviousPage")
+    start_cursor: str | None = strawberry_field(name="startCursor")
+    end_cursor: str | None = strawberry_field(name="endCursor")
+
+
+@strawberry_type(name="Edge")
+class CruddyEdge(Generic[GQLNodeType]):
+    node: GQLNodeType
+    cursor: str
+
+
+@strawberry_type(name="Connection")
+class CruddyConnection(Generic[GQLNodeType]):
+    edges: list[CruddyEdge[GQLNodeType]]
+    page_info: CruddyPageInfo = strawberry_field(name="pageInfo")
+    total_count: int | None = strawberry_field(name="totalCount")
 
 
 def create_module_resolver(module_name: str, class_name: str):
@@ -43,6 +73,10 @@ def generate_gql_loader_and_type(type: Any, module_path: str):
     return class_loader, list_type
 
 
+def generate_gql_connection_type(type: Any, module_path: str):
+    return CruddyConnection[Annotated[type, strawberry_lazy(module_path)]]
+
+
 # convert all key-leading double underscores __ to the * character
 # convert all remaning double underscores __ to the . character
 def graphql_where_synthesizer(where: dict | list[dict]):
@@ -122,6 +156,33 @@ class GraphQLRequestCache:
 
         return await future
 
+    async def get_resolved_connection(
+        self,
+        cache_path: str,
+        class_loader: Callable,
+        async_resolver_fn: Callable[[], Awaitable[CruddyConnection]],
+    ):
+        # Connections are namespaced so they never collide with a plain list lookup
+        connection_path = f"connection:{cache_path}"
+        if (result := self.__internal_state.get(connection_path, None)) is not None:
+            logger.debug("CACHE HIT: %s", connection_path)
+            return await result
+        future = Future()
+        self.__internal_state[connection_path] = future
+        try:
+            logger.debug("CACHE MISS: %s", connection_path)
+            connection = await async_resolver_fn()
+            self._store_identities(
+                class_type=class_loader(),
+                objects=[edge.node for edge in connection.edges],
+            )
+            future.set_result(connection)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning(e)
+            future.set_exception(e)
+
+        return await future
+
 
 class GraphQLResolverService:
     header_blacklist: list[str] | None
@@ -150,6 +211,8 @@ class GraphQLResolverService:
         limit: int | None = None,
         page: int | None = None,
         sort: list[str] | None = None,
+        after: str | None = None,
+        before: str | None = None,
     ):
         query = []
         if where:
@@ -161,6 +224,10 @@ class GraphQLResolverService:
         if sort:
             for item in sort:
                 query.append(f"sort={item}")
+        if after is not None:
+            query.append(f"after={after}")
+        if before is not None:
+            query.append(f"before={before}")
         query_string = "&".join(query)
         return f"?{query_string}" if len(query_string) > 0 else ""
 
@@ -231,6 +298,8 @@ class GraphQLResolverService:
         sort: list[str] | None,
         limit: int | None,
         try_identity_key: str | None,
+        after: str | None = None,
+        before: str | None = None,
     ):
         cache = info.context["cache"]
         if not isinstance(cache, GraphQLRequestCache):
@@ -253,7 +322,7 @@ class GraphQLResolverService:
         if (actual_id := id) is not None:
             actual_id = UUID(hex=str(id))
         internal_route = self._generate_internal_route(name=router_path, id=actual_id)
-        mapper_path = f"{internal_route}{self._generate_query_params(where=send_where, limit=limit,page=page, sort=sort)}"
+        mapper_path = f"{internal_route}{self._generate_query_params(where=send_where, limit=limit,page=page, sort=sort, after=after, before=before)}"
         attempt_identity_key = (
             try_identity_key
             if (
@@ -301,6 +370,158 @@ class GraphQLResolverService:
 
         return resolve_it
 
+    def _create_dynamic_connection_resolver(
+        self,
+        info: Info,
+        local_client: BrowserTestClient,
+        mapper_path: str,
+        plural_type_name: str,
+        cursor_columns: list[str],
+        page_size: int,
+        is_backwards: bool,
+        after: str | None,
+        before: str | None,
+        class_loader: Callable = lambda _: type,
+    ):
+        async def resolve_it():
+            type_class = class_loader()
+            forward = self._extract_forwardable_information(info)
+            http_response = await local_client.get(
+                mapper_path,
+                **forward,
+            )
+            if http_response.status_code not in [HTTP_200_OK, HTTP_404_NOT_FOUND]:
+                raise RuntimeError(
+                    f"internal API path {mapper_path} responded with error code {http_response.status_code}"
+                )
+            item_list: list = []
+            total_count = None
+            if http_response.status_code == HTTP_200_OK:
+                virtual_response = http_response.json()
+                item_list = virtual_response[plural_type_name]
+                total_count = (virtual_response.get("meta", None) or {}).get(
+                    "records", None
+                )
+            # One extra row is always requested to detect whether another page exists
+            has_more = len(item_list) > page_size
+            if has_more:
+                item_list = item_list[1:] if is_backwards else item_list[:page_size]
+            edges = [
+                CruddyEdge(
+                    node=type_class(**item),
+                    cursor=encode_cursor(
+                        {column: item.get(column, None) for column in cursor_columns}
+                    ),
+                )
+                for item in item_list
+            ]
+            return CruddyConnection(
+                edges=edges,
+                page_info=CruddyPageInfo(
+                    has_next_page=(
+                        has_more if not is_backwards else before is not None
+                    ),
+                    has_previous_page=(has_more if is_backwards else after is not None),
+                    start_cursor=edges[0].cursor if len(edges) > 0 else None,
+                    end_cursor=edges[-1].cursor if len(edges) > 0 else None,
+                ),
+                total_count=total_count,
+            )
+
+        return resolve_it
+
+    def generate_connection_resolver(
+        self,
+        type_name: str,
+        graphql_type: type = type,
+        route_generator: Callable | None = None,
+        valid_selectors: dict[str, Callable] | None = None,
+        graphql_resolver_name_override: str | None = None,
+        class_loader: Callable = lambda _: type,
+        primary_key: str = "id",
+        default_page_size: int = 10,
+    ):
+        # Relay-style connection field (edges / node / cursor / pageInfo), named
+        # "<plural>_connection". Pages are fetched with keyset queries over the sort
+        # columns plus the primary key, so deep pages cost the same as the first.
+        # graphql_type should be built with generate_gql_connection_type.
+        uber_self = self
+        (
+            plural_type_name,
+            graphql_resolver_type,
+            valid_selectors,
+        ) = self._format_context(
+            type_name=type_name,
+            route_generator=route_generator,
+            valid_selectors=valid_selectors,
+            graphql_resolver_name_override=graphql_resolver_name_override,
+        )
+
+        async def resolver(
+            self,  # you can use self to reference the "record"
+            info: Info,
+            first: int | None = None,
+            after: str | None = None,
+            last: int | None = None,
+            before: str | None = None,
+            where: JSON | None = None,
+            sort: list[str] | None = None,
+            selector: str | None = None,
+        ):
+            if first is not None and last is not None:
+                raise ValueError("first and last cannot be combined")
+            is_backwards = last is not None
+            page_size = (last if is_backwards else first) or default_page_size
+            if page_size < 1:
+                raise ValueError("first and last must be positive integers")
+            keyset_sort = list(sort or [])
+            cursor_columns = [item.split(" ")[0] for item in keyset_sort]
+            if primary_key not in cursor_columns:
+                keyset_sort.append(f"{primary_key} asc")
+                cursor_columns.append(primary_key)
+            # An empty cursor marks the end of the set, so "last" alone pages backwards from there
+            send_before = (
+                encode_cursor({}) if is_backwards and before is None else before
+            )
+            cache, mapper_path, _ = uber_self._setup_cache_mapper(
+                record=self,
+                info=info,
+                valid_selectors=valid_selectors,
+                selector=selector,
+                id=None,
+                where=where,
+                page=None,
+                sort=keyset_sort,
+                limit=page_size + 1,
+                try_identity_key=None,
+                after=after,
+                before=send_before,
+            )
+
+            return await cache.get_resolved_connection(
+                cache_path=mapper_path,
+                class_loader=class_loader,
+                async_resolver_fn=uber_self._create_dynamic_connection_resolver(
+                    info=info,
+                    class_loader=class_loader,
+                    plural_type_name=plural_type_name,
+                    cursor_columns=cursor_columns,
+                    page_size=page_size,
+                    is_backwards=is_backwards,
+                    after=after,
+                    before=before,
+                    mapper_path=mapper_path,
+                    local_client=uber_self.get_virtual_client(info),
+                ),
+            )
+
+        # THE RESOLVER NAME IS WHAT DETERMINES THE "KEY" IN THE GRAPHQL QUERY SCHEMA!!!
+        return strawberry_field(
+            resolver=resolver,
+            name=f"{graphql_resolver_type}_connection",
+            graphql_type=graphql_type,
+        )
+
     def generate_resolver(
         self,
         type_name: str,
@@ -381,6 +602,7 @@ class GraphQLController:
     _internal_schema: Schema
     _max_results: int
     _max_depth: int
+    _max_batch_operations: int | None
     _path: str
     _auto_camel_case: bool
 
@@ -390,6 +612,7 @@ class GraphQLController:
         root_query: Type,
         max_results: int = 500,
         max_depth: int = 3,
+        max_batch_operations: int | None = 10,
         tags: list[str | Enum] | None = None,
         path: str = "/graphql",
         expose_schema: bool = True,
@@ -405,6 +628,9 @@ class GraphQLController:
         self._root_query = root_query
         self._max_results = max_results
         self._max_depth = max_depth
+        # Array-batched POST bodies execute concurrently against one context (and
+        # therefore one GraphQLRequestCache). Set to None to reject batched bodies.
+        self._max_batch_operations = max_batch_operations
         self._path = path
         self._auto_camel_case = auto_camel_case
         self.graphql_controller = GraphQLRouter(
@@ -432,6 +658,11 @@ class GraphQLController:
             config=StrawberryConfig(
                 auto_camel_case=self._auto_camel_case,
                 relay_max_results=self._max_results,
+                batching_config=(
+                    None
+                    if self._max_batch_operations is None
+                    else {"max_operations": self._max_batch_operations}
+                ),
             ),
             extensions=[
                 QueryDepthLimiter(max_depth=self._max_depth),
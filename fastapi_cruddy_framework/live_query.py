@@ -0,0 +1,385 @@
+from __future__ import annotations
+from typing import Any
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+from logging import getLogger
+from re import DOTALL, IGNORECASE, compile as compile_regex, escape
+from fastapi import WebSocket
+from .schemas import (
+    SocketMessage,
+    CLIENT_MESSAGE_EVENT,
+    DISCONNECT_EVENT,
+    LIVE_QUERY_EVENT,
+)
+from .util import parse_and_coerce_to_utc_datetime, parse_datetime, to_json_object
+from .websocket_manager import WebsocketConnectionManager
+
+logger = getLogger(__name__)
+Predicate = Callable[[dict], bool]
+LIVE_QUERY_CREATE = "create"
+LIVE_QUERY_UPDATE = "update"
+LIVE_QUERY_DELETE = "delete"
+
+
+# -------------------------------------------------------------------------------------------
+# IN-MEMORY WHERE COMPILER
+# -------------------------------------------------------------------------------------------
+# Turns a query_forge where document into a callable over JSON rows (a view model passed
+# through to_json_object), mirroring the SQL the repository would generate. Anything that
+# only the database can evaluate (column casts, full text search) raises ValueError.
+def compile_where(where: Any) -> Predicate:
+    if isinstance(where, list):
+        return _all([compile_where(part) for part in where])
+    if not isinstance(where, dict):
+        return lambda row: True
+    criteria = []
+    for key, value in where.items():
+        if key in ("*and", "*or", "*not"):
+            parts = [compile_where(part) for part in _as_list(value)]
+            if key == "*and":
+                criteria.append(_all(parts))
+            elif key == "*or":
+                criteria.append(_any(parts))
+            else:
+                criteria.append(_negate(_all(parts)))
+        else:
+            criteria.append(_compile_field(key, value))
+    return _all(criteria)
+
+
+def _compile_field(key: str, value: Any) -> Predicate:
+    if ":" in key.split(".")[0]:
+        raise ValueError(
+            f"'{key}' uses a column cast, which can't be evaluated in memory"
+        )
+    field, *path = [part for part in key.split(".") if part != ""]
+    json_path = [int(part) if part.isdigit() else part for part in path]
+
+    def lookup(row: dict) -> Any:
+        current = row.get(field)
+        for part in json_path:
+            try:
+                current = current[part]  # type: ignore
+            except (KeyError, IndexError, TypeError):
+                return None
+        return current
+
+    if not isinstance(value, dict):
+        if isinstance(value, str) and not json_path:
+            return _lookup_then(lookup, _compile_operator("*like", value))
+        return _lookup_then(lookup, _compile_operator("*eq", value))
+    if len(value) != 1:
+        raise ValueError(f"'{key}' must compare with exactly one operator")
+    operator, operand = next(iter(value.items()))
+    return _lookup_then(lookup, _compile_operator(operator, operand))
+
+
+def _compile_operator(operator: str, operand: Any) -> Callable[[Any], bool]:
+    parse = None
+    if isinstance(operand, dict) and "*datetime" in operand:
+        parse = parse_and_coerce_to_utc_datetime
+        operand = parse(operand["*datetime"])
+    elif isinstance(operand, dict) and "*datetime_naive" in operand:
+        parse = parse_datetime
+        operand = parse(operand["*datetime_naive"])
+
+    def coerce(value: Any) -> Any:
+        # Rows are JSON, so datetimes arrive as ISO strings
+        if parse is not None and isinstance(value, str):
+            return parse(value)
+        return value
+
+    if operator in ("*eq", "*is_", "*is"):
+        if operand is None:
+            return lambda value: value is None
+        return _not_null(lambda value: _equals(coerce(value), operand))
+    if operator in ("*neq", "*is_not", "*isnot"):
+        if operand is None:
+            return lambda value: value is not None
+        return _not_null(lambda value: not _equals(coerce(value), operand))
+    if operator in ("*gt", "*gte", "*lt", "*lte"):
+        compare = _COMPARISONS[operator]
+        return _not_null(lambda value: compare(coerce(value), operand))
+    if operator in ("*in_", "*not_in", "*notin_"):
+        operands = _as_list(operand)
+        matches = lambda value: any(_equals(value, item) for item in operands)
+        if operator == "*in_":
+            return _not_null(matches)
+        return _not_null(lambda value: not matches(value))
+    if operator in _LIKES:
+        negated, flags = _LIKES[operator]
+        pattern = _like_pattern(str(operand), flags)
+        matches = lambda value: pattern.fullmatch(str(value)) is not None
+        if negated:
+            return _not_null(lambda value: not matches(value))
+        return _not_null(matches)
+    if operator in _TEXT_MATCHES:
+        test, fold = _TEXT_MATCHES[operator]
+        needle = str(operand).lower() if fold else str(operand)
+
+        def text_match(value: Any) -> bool:
+            if isinstance(value, list) and operator == "*contains":
+                return any(_equals(item, operand) for item in value)
+            haystack = str(value).lower() if fold else str(value)
+            return test(haystack, needle)
+
+        return _not_null(text_match)
+    raise ValueError(f"'{operator}' can't be evaluated in memory")
+
+
+def _lookup_then(
+    lookup: Callable[[dict], Any], test: Callable[[Any], bool]
+) -> Predicate:
+    def predicate(row: dict) -> bool:
+        try:
+            return test(lookup(row))
+        except (TypeError, ValueError):
+            # SQL would error or compare NULL, either way the row isn't a match
+            return False
+
+    return predicate
+
+
+# Like SQL, comparing NULL with anything other than IS / IS NOT is never true
+def _not_null(test: Callable[[Any], bool]) -> Callable[[Any], bool]:
+    return lambda value: value is not None and test(value)
+
+
+def _equals(value: Any, operand: Any) -> bool:
+    if isinstance(value, str) and not isinstance(operand, (str, datetime)):
+        # Values the JSON encoding turned into strings
+        return value == f"{operand}"
+    return value == operand
+
+
+def _like_pattern(pattern: str, flags: int):
+    regex = "".join(
+        ".*" if char == "%" else "." if char == "_" else escape(char)
+        for char in pattern
+    )
+    return compile_regex(regex, flags | DOTALL)
+
+
+def _as_list(value: Any) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+def _all(parts: list[Predicate]) -> Predicate:
+    if len(parts) == 1:
+        return parts[0]
+    return lambda row: all(part(row) for part in parts)
+
+
+def _any(parts: list[Predicate]) -> Predicate:
+    return lambda row: any(part(row) for part in parts)
+
+
+def _negate(part: Predicate) -> Predicate:
+    return lambda row: not part(row)
+
+
+_COMPARISONS: dict[str, Callable[[Any, Any], bool]] = {
+    "*gt": lambda value, operand: value > operand,
+    "*gte": lambda value, operand: value >= operand,
+    "*lt": lambda value, operand: value < operand,
+    "*lte": lambda value, operand: value <= operand,
+}
+_LIKES: dict[str, tuple[bool, int]] = {
+    "*like": (False, 0),
+    "*ilike": (False, IGNORECASE),
+    "*notlike": (True, 0),
+    "*not_like": (True, 0),
+    "*notilike": (True, IGNORECASE),
+    "*not_ilike": (True, IGNORECASE),
+}
+_TEXT_MATCHES: dict[str, tuple[Callable[[str, str], bool], bool]] = {
+    "*contains": (lambda haystack, needle: needle in haystack, False),
+    "*icontains": (lambda haystack, needle: needle in haystack, True),
+    "*startswith": (lambda haystack, needle: haystack.startswith(needle), False),
+    "*istartswith": (lambda haystack, needle: haystack.startswith(needle), True),
+    "*endswith": (lambda haystack, needle: haystack.endswith(needle), False),
+    "*iendswith": (lambda haystack, needle: haystack.endswith(needle), True),
+}
+
+
+def _to_row(record: Any) -> dict:
+    if hasattr(record, "model_dump"):
+        record = record.model_dump()
+    return to_json_object(record)
+
+
+# -------------------------------------------------------------------------------------------
+# LIVE QUERY SUBSCRIPTIONS (ONE PER WEBSOCKET MANAGER)
+# -------------------------------------------------------------------------------------------
+class LiveSubscription:
+    websocket: WebSocket
+    id: str
+    resource: str
+    predicate: Predicate
+    # Primary keys of rows the client holds, so rows leaving the result set can be removed
+    members: set[str]
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        id: str,  # pylint: disable=redefined-builtin
+        resource: str,
+        predicate: Predicate,
+        members: set[str],
+    ):
+        self.websocket = websocket
+        self.id = id
+        self.resource = resource
+        self.predicate = predicate
+        self.members = members
+
+
+class LiveQueryHub:
+    websocket_manager: WebsocketConnectionManager
+    authorize: Callable[[WebSocket, str, Any], Awaitable[bool]]
+    max_subscriptions: int
+    subscriptions: dict[WebSocket, dict[str, LiveSubscription]]
+    by_resource: dict[str, dict[tuple[WebSocket, str], LiveSubscription]]
+    changes: int
+    pushed: int
+
+    def __init__(
+        self,
+        websocket_manager: WebsocketConnectionManager,
+        # Decides whether a socket may watch a resource with a given where. Rows are matched
+        # in memory, so session_setup / row-level security is NOT applied to pushed rows.
+        # Required, so that no subscription is ever accepted without a check.
+        authorize: Callable[[WebSocket, str, Any], Awaitable[bool]],
+        # Per socket
+        max_subscriptions: int = 50,
+    ):
+        self.websocket_manager = websocket_manager
+        self.authorize = authorize
+        self.max_subscriptions = max_subscriptions
+        self.subscriptions = {}
+        self.by_resource = {}
+        self.changes = 0
+        self.pushed = 0
+        websocket_manager.on(CLIENT_MESSAGE_EVENT, self._handle_client_message)
+        websocket_manager.on(DISCONNECT_EVENT, self.unsubscribe_all)
+        websocket_manager.pubsub_instance.on(LIVE_QUERY_EVENT, self._handle_change)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "subscriptions": sum(len(subs) for subs in self.subscriptions.values()),
+            "changes": self.changes,
+            "pushed": self.pushed,
+        }
+
+    # Called by a repository after each create / update / delete
+    async def publish_change(self, resource: str, action: str, key: Any, record: Any):
+        await self.websocket_manager.pubsub_instance.publish(
+            SocketMessage(
+                route=LIVE_QUERY_EVENT,
+                target=resource,
+                type=action,
+                data={"key": f"{key}", "record": _to_row(record)},
+            )
+        )
+
+    def subscribe(
+        self,
+        websocket: WebSocket,
+        id: str,  # pylint: disable=redefined-builtin
+        resource: str,
+        where: Any = None,
+        ids: list[Any] | None = None,
+    ) -> LiveSubscription:
+        subscriptions = self.subscriptions.setdefault(websocket, {})
+        if id not in subscriptions and len(subscriptions) >= self.max_subscriptions:
+            raise ValueError(
+                f"Sockets may hold at most {self.max_subscriptions} live queries"
+            )
+        self.unsubscribe(websocket, id)
+        subscription = LiveSubscription(
+            websocket=websocket,
+            id=id,
+            resource=resource,
+            predicate=compile_where(where),
+            members={f"{key}" for key in ids or []},
+        )
+        subscriptions[id] = subscription
+        self.by_resource.setdefault(resource, {})[(websocket, id)] = subscription
+        return subscription
+
+    def unsubscribe(
+        self, websocket: WebSocket, id: str
+    ):  # pylint: disable=redefined-builtin
+        subscription = self.subscriptions.get(websocket, {}).pop(id, None)
+        if subscription is None:
+            return
+        by_resource = self.by_resource.get(subscription.resource, {})
+        by_resource.pop((websocket, id), None)
+        if len(by_resource) == 0:
+            self.by_resource.pop(subscription.resource, None)
+
+    async def unsubscribe_all(self, websocket: WebSocket):
+        for id in list(self.subscriptions.get(websocket, {})):
+            self.unsubscribe(websocket, id)
+        self.subscriptions.pop(websocket, None)
+
+    # Clients send {"route": "live_query", "type": "subscribe", "target": <subscription id>,
+    # "data": {"resource": <model name>, "where": {...}, "ids": [<keys already shown>]}}
+    # and {"route": "live_query", "type": "unsubscribe", "target": <subscription id>}
+    async def _handle_client_message(self, websocket: WebSocket, data: Any):
+        if not isinstance(data, dict) or data.get("route") != LIVE_QUERY_EVENT:
+            return
+        if data.get("target") is None:
+            return
+        id = f"{data.get('target')}"
+        if data.get("type") == "unsubscribe":
+            self.unsubscribe(websocket, id)
+            return
+        if data.get("type") != "subscribe":
+            return
+        options = data.get("data") if isinstance(data.get("data"), dict) else {}
+        resource = f"{options.get('resource')}"
+        where = options.get("where")
+        try:
+            if not await self.authorize(websocket, resource, where):
+                raise ValueError("Not authorized to watch this resource")
+            self.subscribe(websocket, id, resource, where, options.get("ids"))
+        except ValueError as e:
+            self._send(websocket, id, "error", {"message": str(e)})
+            return
+        self._send(websocket, id, "subscribed", {"resource": resource})
+
+    async def _handle_change(self, message: SocketMessage):
+        data = message.data or {}
+        key = f"{data.get('key')}"
+        record = data.get("record")
+        if not isinstance(record, dict):
+            return
+        self.changes += 1
+        for subscription in list(
+            self.by_resource.get(f"{message.target}", {}).values()
+        ):
+            matches = subscription.predicate(record)
+            if message.type != LIVE_QUERY_DELETE and matches:
+                subscription.members.add(key)
+                self._push(subscription, "upsert", record)
+            elif key in subscription.members or (
+                message.type == LIVE_QUERY_DELETE and matches
+            ):
+                subscription.members.discard(key)
+                self._push(subscription, "remove", record)
+
+    def _push(self, subscription: LiveSubscription, type: str, record: dict):
+        self.pushed += 1
+        self._send(subscription.websocket, subscription.id, type, record)
+
+    def _send(self, websocket: WebSocket, id: str, type: str, data: Any):
+        writer = self.websocket_manager.writers.get(websocket)
+        if writer is None:
+            return
+        writer.enqueue(
+            self.websocket_manager.generate_client_frame(
+                LIVE_QUERY_EVENT, id, None, type, data
+            )
+        )
@@ -0,0 +1,252 @@
+from __future__ import annotations
+from typing import Any
+from asyncio import CancelledError, Event, Lock, Task, create_task, sleep
+from json import dumps, loads
+from logging import getLogger
+from time import time
+from uuid import uuid4
+from .adapters import RedisAdapter
+
+logger = getLogger(__name__)
+
+
+# -------------------------------------------------------------------------------------------
+# CLUSTER-WIDE PRESENCE (ONE PER NODE)
+# -------------------------------------------------------------------------------------------
+class PresenceRegistry:
+    redis_adapter: RedisAdapter
+    namespace: str
+    node_id: str
+    heartbeat_interval: float
+    node_ttl: float
+    pending: list[tuple[str, tuple]]
+    # How many local sockets hold each (key, member) entry, as socket ids may be reused
+    tracked: dict[tuple[str, str], int]
+    wakeup: Event
+    flush_lock: Lock
+    flush_task: Task | None
+    heartbeat_task: Task | None
+
+    def __init__(
+        self,
+        redis_adapter: RedisAdapter,
+        namespace: str = "cruddy:presence",
+        node_id: str | None = None,
+        # How often this node refreshes its heartbeat and reaps dead peers
+        heartbeat_interval: float = 5,
+        # A node whose heartbeat is older than this is considered dead and its entries removed
+        node_ttl: float = 15,
+    ):
+        self.redis_adapter = redis_adapter
+        self.namespace = namespace
+        self.node_id = f"{uuid4()}" if node_id is None else node_id
+        self.heartbeat_interval = heartbeat_interval
+        self.node_ttl = node_ttl
+        self.pending = []
+        self.tracked = {}
+        self.wakeup = Event()
+        self.flush_lock = Lock()
+        self.flush_task = None
+        self.heartbeat_task = None
+
+    def key(self, *parts: str) -> str:
+        return ":".join([self.namespace, *parts])
+
+    def member(self, socket_id: str) -> str:
+        return f"{self.node_id}|{socket_id}"
+
+    async def startup(self):
+        await self.heartbeat()
+        self.flush_task = create_task(self._flush_loop())
+        self.heartbeat_task = create_task(self._heartbeat_loop())
+
+    async def dispose(self):
+        for task in (self.heartbeat_task, self.flush_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except CancelledError:
+                    pass
+        self.heartbeat_task = None
+        self.flush_task = None
+        await self.flush()
+        self.tracked = {}
+        # A graceful exit doesn't wait for peers to notice the missing heartbeat
+        try:
+            await self.reap(self.node_id)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("Unable to remove presence entries |%s|", e)
+
+    # ---------------------------------------------------------------------------------------
+    # WRITES: buffered and flushed in one pipeline, so they never delay a connect
+    # ---------------------------------------------------------------------------------------
+    def socket_connected(self, socket_id: str, client_id: Any = None):
+        self._queue("hincrby", self.key("online"), self.node_id, 1)
+        # An overridden socket id may be open on several nodes at once
+        self._track(self.key("socket", socket_id), self.node_id)
+        if client_id not in (None, ""):
+            self._track(self.key("client", str(client_id)), self.node_id)
+
+    def socket_disconnected(
+        self, socket_id: str, client_id: Any = None, room_ids: list[str] | None = None
+    ):
+        self._queue("hincrby", self.key("online"), self.node_id, -1)
+        self._untrack(self.key("socket", socket_id), self.node_id)
+        if client_id not in (None, ""):
+            self._untrack(self.key("client", str(client_id)), self.node_id)
+        for room_id in room_ids or []:
+            self.room_left(room_id, socket_id)
+
+    def room_joined(self, room_id: str, socket_id: str):
+        self._track(self.key("room", room_id), self.member(socket_id))
+        self._track(self.key("room_nodes", room_id), self.node_id)
+
+    def room_left(self, room_id: str, socket_id: str):
+        self._untrack(self.key("room", room_id), self.member(socket_id))
+        self._untrack(self.key("room_nodes", room_id), self.node_id)
+
+    # Called as local membership of a room goes 0 -> 1 and back
+    def room_hosted(self, room_id: str, hosted: bool):
+        self._queue(
+            "sadd" if hosted else "srem",
+            self.key("node", self.node_id, "rooms"),
+            room_id,
+        )
+
+    # Entries are written as the first local socket holds them, and removed with the last
+    def _track(self, key: str, member: str):
+        count = self.tracked.get((key, member), 0)
+        self.tracked[(key, member)] = count + 1
+        if count == 0:
+            self._queue("sadd", key, member)
+            self._queue("sadd", self._entries_key(self.node_id), dumps([key, member]))
+
+    def _untrack(self, key: str, member: str):
+        count = self.tracked.pop((key, member), 0)
+        if count > 1:
+            self.tracked[(key, member)] = count - 1
+        elif count == 1:
+            self._queue("srem", key, member)
+            self._queue("srem", self._entries_key(self.node_id), dumps([key, member]))
+
+    def _entries_key(self, node_id: str) -> str:
+        return self.key("node", node_id, "entries")
+
+    def _queue(self, command: str, *args: Any):
+        self.pending.append((command, args))
+        self.wakeup.set()
+
+    # Serialized, so updates reach redis in the order they were made, and a query that
+    # flushes first also waits out a flush already in flight. With nothing pending or in
+    # flight, the per-message lookups skip the lock entirely.
+    async def flush(self):
+        if len(self.pending) == 0 and not self.flush_lock.locked():
+            return
+        async with self.flush_lock:
+            pending, self.pending = self.pending, []
+            if len(pending) == 0:
+                return
+            try:
+                pipe = self.redis_adapter.get_client().pipeline(transaction=False)
+                for command, args in pending:
+                    getattr(pipe, command)(*args)
+                await pipe.execute()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Unable to write presence updates |%s|", e)
+
+    async def _flush_loop(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            await self.flush()
+
+    # ---------------------------------------------------------------------------------------
+    # LIVENESS
+    # ---------------------------------------------------------------------------------------
+    async def heartbeat(self):
+        await self.redis_adapter.get_client().zadd(
+            self.key("nodes"), {self.node_id: time()}
+        )
+
+    async def reap_dead_nodes(self) -> list[str]:
+        client = self.redis_adapter.get_client()
+        dead = await client.zrangebyscore(
+            self.key("nodes"), "-inf", time() - self.node_ttl
+        )
+        dead_nodes = [_text(node_id) for node_id in dead]
+        for node_id in dead_nodes:
+            await self.reap(node_id)
+        return dead_nodes
+
+    # Every peer may race to reap the same node, so this only issues idempotent removals
+    async def reap(self, node_id: str):
+        client = self.redis_adapter.get_client()
+        entries_key = self._entries_key(node_id)
+        entries = await client.smembers(entries_key)
+        pipe = client.pipeline(transaction=False)
+        for entry in entries:
+            key, member = loads(entry)
+            pipe.srem(key, member)
+        pipe.delete(entries_key, self.key("node", node_id, "rooms"))
+        pipe.hdel(self.key("online"), node_id)
+        pipe.zrem(self.key("nodes"), node_id)
+        await pipe.execute()
+
+    async def _heartbeat_loop(self):
+        while True:
+            await sleep(self.heartbeat_interval)
+            try:
+                await self.heartbeat()
+                await self.reap_dead_nodes()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Presence heartbeat failed |%s|", e)
+
+    # ---------------------------------------------------------------------------------------
+    # QUERIES
+    # ---------------------------------------------------------------------------------------
+    async def count_online(self) -> int:
+        await self.flush()
+        counts = await self.redis_adapter.get_client().hvals(self.key("online"))
+        return sum(int(count) for count in counts)
+
+    async def get_room_members(self, room_id: str) -> list[str]:
+        await self.flush()
+        members = await self.redis_adapter.get_client().smembers(
+            self.key("room", room_id)
+        )
+        return [_text(member).split("|", 1)[1] for member in members]
+
+    # Routing lookups read sets of node ids, which stay small however many sockets a
+    # room or client has
+    async def find_nodes_for_client(self, client_id: Any) -> set[str]:
+        return await self._find_nodes(self.key("client", str(client_id)))
+
+    async def find_nodes_for_room(self, room_id: str) -> set[str]:
+        return await self._find_nodes(self.key("room_nodes", room_id))
+
+    async def find_nodes_for_socket(self, socket_id: str) -> set[str]:
+        return await self._find_nodes(self.key("socket", socket_id))
+
+    async def _find_nodes(self, key: str) -> set[str]:
+        await self.flush()
+        node_ids = await self.redis_adapter.get_client().smembers(key)
+        return {_text(node_id) for node_id in node_ids}
+
+    async def get_nodes(self) -> list[str]:
+        nodes = await self.redis_adapter.get_client().zrange(self.key("nodes"), 0, -1)
+        return [_text(node_id) for node_id in nodes]
+
+    async def get_room_list(self) -> set[str]:
+        await self.flush()
+        nodes = await self.get_nodes()
+        if len(nodes) == 0:
+            return set()
+        rooms = await self.redis_adapter.get_client().sunion(
+            [self.key("node", node_id, "rooms") for node_id in nodes]
+        )
+        return {_text(room_id) for room_id in rooms}
+
+
+def _text(value: str | bytes) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
@@ -1,77 +1,416 @@
 from __future__ import annotations
+from typing import Any
+from abc import ABC, abstractmethod
+from json import dumps as json_dumps, loads as json_loads
 from logging import getLogger
 from pickle import dumps, loads, HIGHEST_PROTOCOL
-from asyncio import sleep, TimeoutError as _TimeoutError, create_task, Task
-from async_timeout import timeout
+from asyncio import (
+    CancelledError,
+    Event,
+    Lock,
+    Queue,
+    Task,
+    TimeoutError as _TimeoutError,
+    create_task,
+    gather,
+    shield,
+    wait_for,
+)
+from collections import deque
+from time import monotonic
 from pymitter import EventEmitter
 from redis.asyncio.client import PubSub as _PubSub
 from .adapters import RedisAdapter
+from .util import json_serial
 from .schemas import (
     SocketMessage,
     BROADCAST_EVENT,
     CONTROL_EVENT,
     ROOM_EVENT,
     CLIENT_EVENT,
+    CACHE_EVENT,
+    MULTICAST_EVENT,
+    LIVE_QUERY_EVENT,
 )
 
 logger = getLogger(__name__)
 
 
+# -------------------------------------------------------------------------------------------
+# WIRE CODECS
+# -------------------------------------------------------------------------------------------
+class PubSubCodec(ABC):
+    # Every node subscribed to a channel must use the same codec
+    @abstractmethod
+    def encode(self, message: SocketMessage) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, payload: bytes) -> SocketMessage:
+        pass
+
+
+def _message_to_fields(message: SocketMessage) -> list:
+    fields = [message.route, message.target, message.type, message.sender, message.data]
+    # Optional trailing fields, so older five field payloads still decode
+    if message.targets is not None or message.sequence is not None:
+        fields.append(message.targets)
+    if message.sequence is not None:
+        fields.append(message.sequence)
+    return fields
+
+
+def _fields_to_message(fields: list) -> SocketMessage:
+    route, target, type, sender, data = fields[:5]
+    return SocketMessage(
+        route=route,
+        target=target,
+        type=type,
+        sender=sender,
+        data=data,
+        targets=fields[5] if len(fields) > 5 else None,
+        sequence=fields[6] if len(fields) > 6 else None,
+    )
+
+
+class JsonCodec(PubSubCodec):
+    # The default. A positional JSON array, using orjson when it is installed. Values
+    # JSON can't represent are stringified, as they would be on the way to a client anyway.
+    def __init__(self):
+        try:
+            from orjson import (
+                dumps as orjson_dumps,
+                loads as orjson_loads,
+                OPT_NON_STR_KEYS,
+                OPT_PASSTHROUGH_DATETIME,
+            )
+
+            # Output matches the stdlib fallback: non-str keys become strings, and
+            # dates go through json_serial rather than orjson's own formatting
+            options = OPT_NON_STR_KEYS | OPT_PASSTHROUGH_DATETIME
+            self._dumps = lambda fields: orjson_dumps(
+                fields, default=json_serial, option=options
+            )
+            self._loads = orjson_loads
+        except ImportError:
+            self._dumps = lambda fields: json_dumps(
+                fields, default=json_serial, separators=(",", ":")
+            ).encode("utf-8")
+            self._loads = json_loads
+
+    def encode(self, message: SocketMessage) -> bytes:
+        return self._dumps(_message_to_fields(message))
+
+    def decode(self, payload: bytes) -> SocketMessage:
+        return _fields_to_message(self._loads(payload))
+
+
+class MsgpackCodec(PubSubCodec):
+    # Requires the optional "msgpack" package
+    def __init__(self):
+        try:
+            from msgpack import packb, unpackb
+        except ImportError as e:
+            raise ImportError(
+                "MsgpackCodec requires the msgpack package: pip install msgpack"
+            ) from e
+        self._packb = packb
+        self._unpackb = unpackb
+
+    def encode(self, message: SocketMessage) -> bytes:
+        return self._packb(_message_to_fields(message), default=json_serial)
+
+    def decode(self, payload: bytes) -> SocketMessage:
+        return _fields_to_message(self._unpackb(payload))
+
+
+class PickleCodec(PubSubCodec):
+    # Legacy wire format. Only use it while rolling out an upgrade next to older nodes,
+    # and never on a redis that untrusted parties can publish to.
+    def encode(self, message: SocketMessage) -> bytes:
+        return dumps(obj=message, protocol=HIGHEST_PROTOCOL)
+
+    def decode(self, payload: bytes) -> SocketMessage:
+        return loads(payload)
+
+
 class PubSub:
-    psub: _PubSub
-    redis_client: RedisAdapter
+    psub: _PubSub | None
+    redis_client: RedisAdapter | None
     channel: str
+    channels: set[str]
     task: Task | None
+    dispatch_task: Task | None
+    queue: Queue | None
     emitter: EventEmitter
     keep_reading: bool
     p: _PubSub | None
+    codec: PubSubCodec
+    max_pending: int
+    batch_size: int
+    drain_timeout: float | None
+    received: int
+    routed: int
+    failed: int
+    batches: int
+    backpressure_waits: int
+    latencies: deque[float]
+    completions: deque[float]
+    publish_window: float | None
+    publish_batch_size: int
+    outbox: list[tuple[str, bytes]]
+    outbox_ready: Event
+    outbox_full: Event
+    publish_lock: Lock
+    publish_task: Task | None
+    published: int
+    publish_failures: int
+    publish_batch_sizes: deque[int]
 
-    def __init__(self, channel: str, redis_client: RedisAdapter):
+    def __init__(
+        self,
+        channel: str,
+        redis_client: RedisAdapter,
+        # Messages read off redis but not yet routed. When full, the reader stops pulling
+        # from redis until handlers catch up.
+        max_pending: int = 10000,
+        # How many queued messages are routed per wakeup of the dispatch loop
+        batch_size: int = 100,
+        # How many recent messages the latency / throughput metrics are computed over
+        metric_samples: int = 1024,
+        codec: PubSubCodec | None = None,
+        # When set, publishes are collected for up to this many seconds and sent in one
+        # redis pipeline. publish() then returns once the message is queued.
+        publish_window: float | None = None,
+        # A batch is sent early once it holds this many messages
+        publish_batch_size: int = 100,
+        # Longest dispose() waits for already received messages to be routed
+        drain_timeout: float | None = 5,
+    ):
         self.p = None
+        self.codec = JsonCodec() if codec is None else codec
         self.emitter = EventEmitter()
         self.redis_client = redis_client
-        self.psub = redis_client.get_client().pubsub()
+        self.psub = None if redis_client is None else redis_client.get_client().pubsub()
         self.channel = channel
+        # Extra channels (e.g. room shards) subscribed on top of the main channel
+        self.channels = set()
         self.keep_reading = True
         self.task = None
+        self.dispatch_task = None
+        self.queue = None
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.drain_timeout = drain_timeout
+        self.received = 0
+        self.routed = 0
+        self.failed = 0
+        self.batches = 0
+        self.backpressure_waits = 0
+        self.latencies = deque(maxlen=metric_samples)
+        self.completions = deque(maxlen=metric_samples)
+        self.publish_window = publish_window
+        self.publish_batch_size = publish_batch_size
+        self.outbox = []
+        self.outbox_ready = Event()
+        self.outbox_full = Event()
+        self.publish_lock = Lock()
+        self.publish_task = None
+        self.published = 0
+        self.publish_failures = 0
+        self.publish_batch_sizes = deque(maxlen=metric_samples)
 
     async def startup(self):
         try:
+            self.queue = Queue(maxsize=self.max_pending)
             self.task = create_task(self.read())
+            self.dispatch_task = create_task(self.dispatch())
         except Exception as e:  # pylint: disable=broad-exception-caught
             logger.warning("Unable to spawn pubsub read loop |%s|", e)
 
+    # Blocks on the redis connection until a message arrives, so an idle channel costs
+    # nothing and a busy one is drained as fast as redis delivers.
     async def read(self):
+        if self.psub is None:
+            return
         async with self.psub as p:
-            await p.subscribe(self.channel)
             self.p = p
-            while self.keep_reading:
+            await p.subscribe(self.channel, *self.channels)
+            try:
+                while self.keep_reading:
+                    message: dict | None = await p.get_message(
+                        ignore_subscribe_messages=True, timeout=None
+                    )
+                    if message is None or self.queue is None:
+                        continue
+                    self.received += 1
+                    if self.queue.full():
+                        self.backpressure_waits += 1
+                    await self.queue.put((monotonic(), message.get("data", "")))
+            except CancelledError:
+                pass
+            finally:
                 try:
-                    async with timeout(2):
-                        message: dict | None = await p.get_message(
-                            ignore_subscribe_messages=True
-                        )
-                        if message is not None:
-                            try:
-                                socket_message: SocketMessage = loads(
-                                    message.get("data", "")
-                                )
-                                await self.route_message(socket_message)
-                            except (
-                                Exception  # pylint: disable=broad-exception-caught
-                            ) as e:
-                                logger.info(msg=str(e))
-                        await sleep(0.01)
-                except _TimeoutError:
+                    await p.unsubscribe()
+                except Exception:  # pylint: disable=broad-exception-caught
                     pass
-            await self.p.unsubscribe(self.channel)
-            self.p = None
+                self.p = None
+
+    async def dispatch(self):
+        queue = self.queue
+        if queue is None:
+            return
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            self.batches += 1
+            await self._route_batch(queue, batch)
+
+    # Messages for one route and target stay in order, while different targets are
+    # routed concurrently. Control messages (joins, leaves, kills) are barriers, since
+    # the messages after them may depend on their effects.
+    async def _route_batch(self, queue: Queue, batch: list[tuple[float, Any]]):
+        lanes: dict[tuple[str, Any], list[tuple[float, SocketMessage]]] = {}
+        for received_at, data in batch:
+            try:
+                socket_message = self.decode(data)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self.failed += 1
+                logger.info(msg=str(e))
+                self._complete(queue, received_at)
+                continue
+            if socket_message.route == CONTROL_EVENT:
+                await self._route_lanes(queue, lanes)
+                lanes = {}
+                await self._route_lane(queue, [(received_at, socket_message)])
+                continue
+            lanes.setdefault((socket_message.route, socket_message.target), []).append(
+                (received_at, socket_message)
+            )
+        await self._route_lanes(queue, lanes)
+
+    async def _route_lanes(
+        self,
+        queue: Queue,
+        lanes: dict[tuple[str, Any], list[tuple[float, SocketMessage]]],
+    ):
+        if len(lanes) == 1:
+            await self._route_lane(queue, next(iter(lanes.values())))
+        elif len(lanes) > 1:
+            await gather(*(self._route_lane(queue, lane) for lane in lanes.values()))
+
+    async def _route_lane(self, queue: Queue, lane: list[tuple[float, SocketMessage]]):
+        for received_at, socket_message in lane:
+            try:
+                await self.route_message(socket_message)
+                self.routed += 1
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self.failed += 1
+                logger.info(msg=str(e))
+            self._complete(queue, received_at)
+
+    def _complete(self, queue: Queue, received_at: float):
+        finished_at = monotonic()
+        self.latencies.append(finished_at - received_at)
+        self.completions.append(finished_at)
+        queue.task_done()
 
-    async def publish(self, message: SocketMessage):
-        publisher = self.redis_client.get_client()
-        await publisher.publish(
-            channel=self.channel, message=dumps(obj=message, protocol=HIGHEST_PROTOCOL)
+    @property
+    def metrics(self) -> dict[str, float | int]:
+        latencies = sorted(self.latencies)
+        window = (
+            self.completions[-1] - self.completions[0]
+            if len(self.completions) > 1
+            else 0
         )
+        return {
+            "received": self.received,
+            "routed": self.routed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "pending": 0 if self.queue is None else self.queue.qsize(),
+            "backpressure_waits": self.backpressure_waits,
+            # messages per second over the most recent samples
+            "throughput": (len(self.completions) - 1) / window if window > 0 else 0,
+            # seconds from leaving redis to every handler finishing
+            "latency_p50": _percentile(latencies, 0.5),
+            "latency_p99": _percentile(latencies, 0.99),
+            "published": self.published,
+            "publish_failures": self.publish_failures,
+            "publish_pending": len(self.outbox),
+            "publish_batches": len(self.publish_batch_sizes),
+            "publish_batch_avg": (
+                sum(self.publish_batch_sizes) / len(self.publish_batch_sizes)
+                if len(self.publish_batch_sizes) > 0
+                else 0
+            ),
+            "publish_batch_max": max(self.publish_batch_sizes, default=0),
+        }
+
+    async def publish(self, message: SocketMessage, channel: str | None = None):
+        channel = self.channel if channel is None else channel
+        payload = self.codec.encode(message)
+        if self.publish_window is None:
+            publisher = self.redis_client.get_client()
+            await publisher.publish(channel=channel, message=payload)
+            self.published += 1
+            return
+        self.outbox.append((channel, payload))
+        if self.publish_task is None:
+            self.publish_task = create_task(self._publish_loop())
+        self.outbox_ready.set()
+        if len(self.outbox) >= self.publish_batch_size:
+            self.outbox_full.set()
+
+    # Sends everything queued so far, one pipeline per publish_batch_size messages.
+    # Batches never overlap, so messages reach each channel in the order published.
+    async def flush(self):
+        async with self.publish_lock:
+            self.outbox_ready.clear()
+            self.outbox_full.clear()
+            while len(self.outbox) > 0:
+                batch = self.outbox[: self.publish_batch_size]
+                del self.outbox[: self.publish_batch_size]
+                try:
+                    pipe = self.redis_client.get_client().pipeline(transaction=False)
+                    for channel, payload in batch:
+                        pipe.publish(channel, payload)
+                    await pipe.execute()
+                    self.published += len(batch)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    self.publish_failures += len(batch)
+                    logger.warning("Unable to publish %s messages |%s|", len(batch), e)
+                self.publish_batch_sizes.append(len(batch))
+
+    async def _publish_loop(self):
+        while True:
+            await self.outbox_ready.wait()
+            if len(self.outbox) < self.publish_batch_size:
+                try:
+                    await wait_for(self.outbox_full.wait(), self.publish_window)
+                except _TimeoutError:
+                    pass
+            # dispose() cancels this loop, but must not lose a batch already in flight
+            await shield(self.flush())
+
+    # Safe to call while the reader is parked; redis replies arrive on the read loop
+    async def subscribe(self, channel: str):
+        if channel in self.channels:
+            return
+        self.channels.add(channel)
+        if self.p is not None:
+            await self.p.subscribe(channel)
+
+    async def unsubscribe(self, channel: str):
+        if channel not in self.channels:
+            return
+        self.channels.discard(channel)
+        if self.p is not None:
+            await self.p.unsubscribe(channel)
+
+    def decode(self, data: Any) -> SocketMessage:
+        return self.codec.decode(data)
 
     async def route_message(self, socket_message: SocketMessage):
         if socket_message.route in [
@@ -79,6 +418,9 @@ class PubSub:
             CONTROL_EVENT,
             ROOM_EVENT,
             CLIENT_EVENT,
+            CACHE_EVENT,
+            MULTICAST_EVENT,
+            LIVE_QUERY_EVENT,
         ]:
             return await self.emit(socket_message.route, socket_message)
         raise ValueError(
@@ -97,8 +439,114 @@ class PubSub:
     # During tests, the task could enter its own run loop, catch the error
     async def dispose(self):
         self.keep_reading = False
+        if self.publish_task is not None:
+            self.publish_task.cancel()
+            try:
+                await self.publish_task
+            except CancelledError:
+                pass
+            self.publish_task = None
+            await self.flush()
         if self.task is not None:
+            # The reader is parked on the redis socket, so wake it by cancelling
+            self.task.cancel()
             try:
                 await self.task
-            except RuntimeError:
+            except (RuntimeError, CancelledError):
                 logger.warning("PubSub exited abnormally")
+        if self.dispatch_task is not None:
+            # Route whatever was already read before stopping, within the deadline
+            if self.queue is not None and not self.dispatch_task.done():
+                try:
+                    await wait_for(self.queue.join(), self.drain_timeout)
+                except _TimeoutError:
+                    logger.warning(
+                        "PubSub dropped %s unrouted messages on dispose",
+                        self.queue.qsize(),
+                    )
+            self.dispatch_task.cancel()
+            try:
+                await self.dispatch_task
+            except (RuntimeError, CancelledError):
+                pass
+
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    if len(ordered) == 0:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+# -------------------------------------------------------------------------------------------
+# IN-PROCESS BACKEND (SINGLE NODE / TESTS)
+# -------------------------------------------------------------------------------------------
+class InProcessBroker(PubSub):
+    # Brokers in the same process share channels, just like clients of one redis would
+    subscribers: dict[str, dict["InProcessBroker", None]] = {}
+
+    def __init__(
+        self,
+        channel: str,
+        max_pending: int = 10000,
+        batch_size: int = 100,
+        metric_samples: int = 1024,
+    ):
+        super().__init__(
+            channel=channel,
+            redis_client=None,  # type: ignore
+            max_pending=max_pending,
+            batch_size=batch_size,
+            metric_samples=metric_samples,
+        )
+
+    async def startup(self):
+        self.queue = Queue(maxsize=self.max_pending)
+        self.dispatch_task = create_task(self.dispatch())
+        for channel in [self.channel, *self.channels]:
+            self._attach(channel)
+
+    async def dispose(self):
+        for channel in [self.channel, *self.channels]:
+            self._detach(channel)
+        await super().dispose()
+
+    # Messages are handed over as objects: nothing is encoded or sent over a network
+    async def publish(self, message: SocketMessage, channel: str | None = None):
+        channel = self.channel if channel is None else channel
+        for broker in list(InProcessBroker.subscribers.get(channel, ())):
+            await broker.deliver(message)
+
+    async def deliver(self, message: SocketMessage):
+        if self.queue is None:
+            return
+        self.received += 1
+        if self.queue.full():
+            self.backpressure_waits += 1
+        await self.queue.put((monotonic(), message.model_copy()))
+
+    def decode(self, data: Any) -> SocketMessage:
+        return data
+
+    async def subscribe(self, channel: str):
+        if channel in self.channels:
+            return
+        self.channels.add(channel)
+        if self.queue is not None:
+            self._attach(channel)
+
+    async def unsubscribe(self, channel: str):
+        if channel not in self.channels:
+            return
+        self.channels.discard(channel)
+        self._detach(channel)
+
+    def _attach(self, channel: str):
+        InProcessBroker.subscribers.setdefault(channel, {})[self] = None
+
+    def _detach(self, channel: str):
+        brokers = InProcessBroker.subscribers.get(channel)
+        if brokers is None:
+            return
+        brokers.pop(self, None)
+        if len(brokers) == 0:
+            del InProcessBroker.subscribers[channel]
@@ -0,0 +1,160 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from json import dumps, loads
+from .adapters import RedisAdapter
+from .util import json_serial
+
+
+# -------------------------------------------------------------------------------------------
+# REPLAY LOGS
+# -------------------------------------------------------------------------------------------
+class ReplayLog(ABC):
+    # Records a client envelope on a stream ("broadcast", "room:<id>", "client:<id>") and
+    # returns its sequence id, which increases monotonically within the stream
+    @abstractmethod
+    async def append(self, stream: str, envelope: dict) -> str:
+        pass
+
+    # Returns the envelopes recorded after last_seen_id, each with its "id", and whether
+    # that is the complete gap (False if some of it has already been evicted)
+    @abstractmethod
+    async def read_since(
+        self, stream: str, last_seen_id: str
+    ) -> tuple[list[dict], bool]:
+        pass
+
+
+class MemoryReplayLog(ReplayLog):
+    # Only sees messages published by this process, so it suits single node deployments
+    max_entries: int
+    max_streams: int
+    sequence: int
+    streams: OrderedDict[str, deque[tuple[int, dict]]]
+    trimmed: dict[str, int]
+    evicted_upto: int
+
+    def __init__(self, max_entries: int = 1000, max_streams: int = 10000):
+        self.max_entries = max_entries
+        self.max_streams = max_streams
+        self.sequence = 0
+        self.streams = OrderedDict()
+        self.trimmed = {}
+        self.evicted_upto = 0
+
+    async def append(self, stream: str, envelope: dict) -> str:
+        self.sequence += 1
+        entries = self.streams.get(stream)
+        if entries is None:
+            entries = self.streams[stream] = deque(maxlen=self.max_entries)
+        elif len(entries) == self.max_entries:
+            self.trimmed[stream] = entries[0][0]
+        entries.append((self.sequence, envelope))
+        self.streams.move_to_end(stream)
+        while len(self.streams) > self.max_streams:
+            evicted, evicted_entries = self.streams.popitem(last=False)
+            self.trimmed.pop(evicted, None)
+            self.evicted_upto = max(self.evicted_upto, evicted_entries[-1][0])
+        return str(self.sequence)
+
+    async def read_since(
+        self, stream: str, last_seen_id: str
+    ) -> tuple[list[dict], bool]:
+        try:
+            last_seen = int(last_seen_id)
+        except ValueError:
+            return [], False
+        entries = self.streams.get(stream)
+        if entries is None:
+            # A stream dropped to make room may have held part of the gap
+            return [], last_seen >= self.evicted_upto
+        return (
+            [
+                {**envelope, "id": str(seq)}
+                for seq, envelope in entries
+                if seq > last_seen
+            ],
+            self.trimmed.get(stream, 0) <= last_seen,
+        )
+
+
+class RedisReplayLog(ReplayLog):
+    # One capped redis stream per room / client, shared by every node. Sequence ids are
+    # the stream entry ids redis assigns, which are time ordered across streams too.
+    redis_adapter: RedisAdapter
+    max_entries: int
+    retention: float | None
+    key_prefix: str
+
+    def __init__(
+        self,
+        redis_adapter: RedisAdapter,
+        max_entries: int = 1000,
+        # Streams nobody has written to for this many seconds are deleted
+        retention: float | None = 3600,
+        key_prefix: str = "cruddy:replay",
+    ):
+        self.redis_adapter = redis_adapter
+        self.max_entries = max_entries
+        self.retention = retention
+        self.key_prefix = key_prefix
+
+    def key(self, stream: str) -> str:
+        return f"{self.key_prefix}:{stream}"
+
+    async def append(self, stream: str, envelope: dict) -> str:
+        pipe = self.redis_adapter.get_client().pipeline(transaction=False)
+        pipe.xadd(
+            self.key(stream),
+            {"m": dumps(envelope, default=json_serial)},
+            maxlen=self.max_entries,
+            approximate=False,
+        )
+        if self.retention is not None:
+            pipe.pexpire(self.key(stream), int(self.retention * 1000))
+        results = await pipe.execute()
+        return _text(results[0])
+
+    async def read_since(
+        self, stream: str, last_seen_id: str
+    ) -> tuple[list[dict], bool]:
+        last_seen = _parse_stream_id(last_seen_id)
+        if last_seen is None:
+            return [], False
+        client = self.redis_adapter.get_client()
+        pipe = client.pipeline(transaction=False)
+        pipe.xlen(self.key(stream))
+        pipe.xrange(self.key(stream), min=last_seen_id, max="+")
+        pipe.time()
+        length, entries, (seconds, microseconds) = await pipe.execute()
+        envelopes = []
+        for entry_id, fields in entries:
+            entry_id = _text(entry_id)
+            if entry_id == last_seen_id:
+                continue
+            envelope = loads(fields.get(b"m", fields.get("m")))
+            envelopes.append({**envelope, "id": entry_id})
+        complete = True
+        # Every write renews the retention, so a missing stream may only have held
+        # messages the client never saw if it last saw something before that window
+        if length == 0 and self.retention is not None:
+            now = seconds * 1000 + microseconds // 1000
+            complete = last_seen[0] >= now - int(self.retention * 1000)
+        # A full stream has trimmed entries, possibly some the client never saw
+        elif length >= self.max_entries:
+            oldest = await client.xrange(self.key(stream), min="-", max="+", count=1)
+            oldest_id = _parse_stream_id(_text(oldest[0][0])) if oldest else None
+            complete = oldest_id is None or oldest_id <= last_seen
+        return envelopes, complete
+
+
+def _parse_stream_id(value: str) -> tuple[int, int] | None:
+    try:
+        milliseconds, _, sequence = value.partition("-")
+        return int(milliseconds), int(sequence or 0)
+    except ValueError:
+        return None
+
+
+def _text(value: str | bytes) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
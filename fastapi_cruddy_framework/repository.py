@@ -1,5 +1,6 @@
 import math
-from typing import Any, Type, Callable, TYPE_CHECKING
+from typing import Any, Type, Callable, Coroutine, TYPE_CHECKING
+from datetime import datetime
 from logging import getLogger
 from fastapi import Request
 from sqlalchemy import (
@@ -9,6 +10,7 @@ from sqlalchemy import (
     or_,
     and_,
     not_,
+    false,
     func,
     Cast,
     literal_column,
@@ -75,8 +77,9 @@ from sqlmodel import cast, inspect
 from pydantic_core import PydanticUndefined as Undefined
 from pydantic.types import Json
 from .schemas import BulkDTO, CruddyModel, CruddyGenericModel, UUID as PythonUUID
-from .exceptions import CruddyNoMatchingRowException
+from .exceptions import CruddyNoMatchingRowException, CruddyInvalidCursorException
 from .adapters import BaseAdapter, SqliteAdapter, MysqlAdapter, PostgresqlAdapter
+from .cache import CachePolicy, RepositoryCache, SingleFlight
 from .util import (
     get_pk,
     possible_id_types,
@@ -90,6 +93,7 @@ from .util import (
 
 if TYPE_CHECKING:
     from .resource import Resource
+    from .live_query import LiveQueryHub
 
 JSON_COLUMNS = (JSON, JSONB)
 # The CAST MAP provides composite keys (lhs comparator|rhs value type) which map to a DB cast function
@@ -219,6 +223,9 @@ class AbstractRepository:
         "after_set_relations": None,
     }
     op_map: dict
+    cache: RepositoryCache | None = None
+    single_flight: SingleFlight | None = None
+    live_queries: "LiveQueryHub | None" = None
     _resource: "Resource"
 
     def __init__(
@@ -244,6 +251,9 @@ class AbstractRepository:
         lifecycle_after_get_all: lifecycle_types = None,
         lifecycle_before_set_relations: lifecycle_types = None,
         lifecycle_after_set_relations: lifecycle_types = None,
+        cache_policy: CachePolicy | None = None,
+        single_flight: SingleFlight | None = None,
+        live_queries: "LiveQueryHub | None" = None,
     ):
         self.use_model_defaults = use_model_defaults
         self.adapter = adapter
@@ -253,6 +263,16 @@ class AbstractRepository:
         self.view_keys = list(view_model.model_fields.keys())
         self.model = model
         self._resource = _resource
+        self.cache = (
+            None
+            if cache_policy is None
+            else RepositoryCache(
+                namespace=str(getattr(model, "__tablename__", model.__name__)),
+                policy=cache_policy,
+            )
+        )
+        self.single_flight = single_flight
+        self.live_queries = live_queries
 
         self.id_type = id_type
         self.op_map = {
@@ -306,6 +326,7 @@ class AbstractRepository:
             result = await session.execute(query)
             await session.flush()
             inserted_row = result.first()
+        await self.invalidate_cache()
         if inserted_row is None:
             raise CruddyNoMatchingRowException(
                 f"The payload {values} failed to create a new record"
@@ -314,6 +335,7 @@ class AbstractRepository:
         if created_record is not None:
             if self.lifecycle["after_create"]:
                 await self.lifecycle["after_create"](created_record)
+            await self.publish_change("create", created_record)
             return created_record
         return None
         # return a value?
@@ -332,16 +354,48 @@ class AbstractRepository:
                 *self.query_forge(model=self.model, where=where),
             )
         )
-        async with self.adapter.getSession(request) as session:
-            result = (await session.execute(query)).fetchone()
 
-        if result is None:
+        async def fetch_record():
+            async with self.adapter.getSession(request) as session:
+                row = (await session.execute(query)).fetchone()
+            return None if row is None else dict(row._mapping)
+
+        fetch_record = self._coalesce(fetch_record, [query], request)
+        if self.cache is None:
+            record = await fetch_record()
+        else:
+            record = await self.cache.get_or_load(
+                self.cache.build_key("get_by_id", [id, where], request),
+                fetch_record,
+            )
+
+        if record is None:
             raise CruddyNoMatchingRowException(f"Unable to find record {id}")
-        result = self.view_model(**result._mapping)
+        result = self.view_model(**record)
         if self.lifecycle["after_get_one"]:
             await self.lifecycle["after_get_one"](result)
         return result
 
+    async def get_version(
+        self, id: possible_id_values, where: Json = None, request: Request | None = None
+    ) -> datetime | None:
+        # A single column lookup of a record's "updated_at", so conditional GETs can be
+        # answered without hydrating the full record. None if unversioned or missing.
+        version_column = getattr(self.model, "updated_at", None)
+        if version_column is None:
+            return None
+        query = select(version_column).where(
+            and_(
+                self.identity_function(id),
+                *self.query_forge(model=self.model, where=where),
+            )
+        )
+        async with self.adapter.getSession(request) as session:
+            version = (await session.execute(query)).scalar_one_or_none()
+        if version is None:
+            return None
+        return parse_and_coerce_to_utc_datetime(version)
+
     async def update(
         self, id: possible_id_values, data: CruddyModel, request: Request | None = None
     ) -> Any:
@@ -362,6 +416,7 @@ class AbstractRepository:
             result = await session.execute(query)
             await session.flush()
             udpated_row = result.first()
+        await self.invalidate_cache()
         if udpated_row is None:
             raise CruddyNoMatchingRowException(
                 f"The payload {values} failed to update a record"
@@ -369,6 +424,7 @@ class AbstractRepository:
         updated_record = self.view_model(**udpated_row._mapping)
         if self.lifecycle["after_update"]:
             await self.lifecycle["after_update"](updated_record)
+        await self.publish_change("update", updated_record)
         return updated_record
 
         # return a value?
@@ -387,10 +443,12 @@ class AbstractRepository:
         )
         async with self.adapter.getSession(request) as session:
             result = await session.execute(query)
+        await self.invalidate_cache()
         if result.rowcount < 1:  # type: ignore
             raise CruddyNoMatchingRowException(f"Failed to delete record {id}")
         if self.lifecycle["after_delete"]:
             await self.lifecycle["after_delete"](record)
+        await self.publish_change("delete", record)
         return record
 
         # return a value?
@@ -402,6 +460,8 @@ class AbstractRepository:
         columns: list[str] | None = None,
         sort: list[str] | None = None,
         where: Json = None,
+        after: dict[str, Any] | None = None,
+        before: dict[str, Any] | None = None,
         # possible lifecycle hooks from foreign resource
         request: Request | None = None,
         _lifecycle_before: lifecycle_types = None,
@@ -414,6 +474,8 @@ class AbstractRepository:
             "columns": columns,
             "sort": sort,
             "where": where,
+            "after": after,
+            "before": before,
         }
 
         if _use_own_hooks:
@@ -448,34 +510,33 @@ class AbstractRepository:
                 and_(*self.query_forge(model=self.model, where=query_conf["where"]))
             )
 
-        # select sort dynamically
-        if query_conf["sort"] is not None and query_conf["sort"] != []:
-            # we need sort format data like this --> ['id asc','name desc', 'email']
-            def splitter(sort_string: str):
-                parts = sort_string.split(" ")
-                getter = "asc"
-                if len(parts) == 2:
-                    getter = parts[1]
-                return getattr(getattr(self.model, parts[0]), getter)
-
-            sorts = [splitter(x) for x in query_conf["sort"]]
-            for field in sorts:
-                query = query.order_by(field())
-
-        # count query
-        count_query = select(func.count(1)).select_from(query)  # type: ignore
-        offset_page = query_conf["page"] - 1
-        # pagination
-        query = query.offset(offset_page * query_conf["limit"]).limit(
-            query_conf["limit"]
+        # select sort dynamically, plus keyset paging if a cursor was sent
+        query, count_query, is_backwards = self._sort_and_paginate(
+            query=query,
+            model=self.model,
+            primary_key=str(self.primary_key),
+            query_conf=query_conf,
         )
+
         # total record
-        async with self.adapter.getSession(request) as session:
-            records: Result = await session.execute(query)
-            await session.flush()
-            count: Result = await session.execute(count_query)
-            total_record = count.scalar() or 0
-            result = records.fetchall()
+        async def fetch_page():
+            async with self.adapter.getSession(request) as session:
+                records: Result = await session.execute(query)
+                await session.flush()
+                count: Result = await session.execute(count_query)
+                total_record = count.scalar() or 0
+                rows = records.fetchall()
+            return total_record, rows
+
+        fetch_page = self._coalesce(fetch_page, [query, count_query], request)
+        if self.cache is None:
+            total_record, result = await fetch_page()
+        else:
+            total_record, result = await self.cache.get_or_load(
+                self.cache.build_key("get_all", query_conf, request), fetch_page
+            )
+        # never hand the (possibly cached) row list itself to the after hook
+        result = result[::-1] if is_backwards else list(result)
         # possible pass in outside functions to map/alter data?
         # total page
         total_page = math.ceil(total_record / query_conf["limit"])
@@ -503,6 +564,8 @@ class AbstractRepository:
         columns: list[str] | None = None,
         sort: list[str] | None = None,
         where: Json = None,
+        after: dict[str, Any] | None = None,
+        before: dict[str, Any] | None = None,
         # the foreign repository's lifecycle hooks must be injected
         request: Request | None = None,
         _lifecycle_before: lifecycle_types = None,
@@ -517,6 +580,8 @@ class AbstractRepository:
             "columns": columns,
             "sort": sort,
             "where": where,
+            "after": after,
+            "before": before,
         }
 
         if _lifecycle_before:
@@ -546,26 +611,12 @@ class AbstractRepository:
             )
         query = query.filter(and_(*joinable))
 
-        # select sort dynamically
-        if query_conf["sort"] is not None and query_conf["sort"] != []:
-            # we need sort format data like this --> ['id asc','name desc', 'email']
-            def splitter(sort_string: str):
-                parts = sort_string.split(" ")
-                getter = "asc"
-                if len(parts) == 2:
-                    getter = parts[1]
-                return getattr(getattr(relation_model, parts[0]), getter)
-
-            sorts = [splitter(x) for x in query_conf["sort"]]
-            for field in sorts:
-                query = query.order_by(field())
-
-        # count query
-        count_query = select(func.count(1)).select_from(query)  # type: ignore
-        offset_page = query_conf["page"] - 1
-        # pagination
-        query = query.offset(offset_page * query_conf["limit"]).limit(
-            query_conf["limit"]
+        # select sort dynamically, plus keyset paging if a cursor was sent
+        query, count_query, is_backwards = self._sort_and_paginate(
+            query=query,
+            model=relation_model,
+            primary_key=relation_pk,
+            query_conf=query_conf,
         )
         # total record
 
@@ -575,6 +626,8 @@ class AbstractRepository:
             count: Result = await session.execute(count_query)
             total_record = count.scalar() or 0
             result = records.fetchall()
+        if is_backwards:
+            result = result[::-1]
 
         # possible pass in outside functions to map/alter data?
         # total page
@@ -684,6 +737,7 @@ class AbstractRepository:
                 result: int = (await session.execute(count_query)).scalar() or 0
             else:
                 result = 0
+        await self.invalidate_cache()
 
         if self.lifecycle["after_set_relations"]:
             await self.lifecycle["after_set_relations"](
@@ -773,6 +827,8 @@ class AbstractRepository:
                 alter_query
             )  # .rowcount # also affected by removing returning
             alter_result: int = (await session.execute(count_query)).scalar() or 0
+        # the foreign keys live on the related resource's rows
+        await self.invalidate_cache(relation=relation_conf["relation"])
 
         if self.lifecycle["after_set_relations"]:
             await self.lifecycle["after_set_relations"](
@@ -788,6 +844,172 @@ class AbstractRepository:
 
         return alter_result
 
+    def _coalesce(
+        self,
+        loader: Callable[[], Coroutine[Any, Any, Any]],
+        statements: list[Any],
+        request: Request | None = None,
+    ):
+        single_flight = self.single_flight
+        if single_flight is None:
+            return loader
+
+        async def coalesced_loader():
+            key = single_flight.build_key(statements, request)
+            return await single_flight.do(key, loader)
+
+        return coalesced_loader
+
+    async def invalidate_cache(self, relation: str | None = None):
+        if self.cache is not None:
+            await self.cache.invalidate()
+        if relation is not None:
+            config = self._resource._relations.get(relation, None)
+            foreign_cache = (
+                None if config is None else config.foreign_resource.repository.cache
+            )
+            if foreign_cache is not None:
+                await foreign_cache.invalidate()
+
+    # Lets live query subscribers on every node evaluate the changed row
+    async def publish_change(self, action: str, record: Any):
+        if self.live_queries is None:
+            return
+        try:
+            await self.live_queries.publish_change(
+                self.model.__name__,
+                action,
+                getattr(record, str(self.primary_key), None),
+                record,
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            LOGGER.warning("Unable to publish live query change |%s|", e)
+
+    # we need sort format data like this --> ['id asc','name desc', 'email']
+    def _parse_sort(self, sort: list[str] | None) -> list[tuple[str, str]]:
+        sort_parts = []
+        for sort_string in sort or []:
+            parts = sort_string.split(" ")
+            getter = "asc"
+            if len(parts) == 2:
+                getter = parts[1]
+            sort_parts.append((parts[0], getter))
+        return sort_parts
+
+    # Cursor values arrive as JSON, so cast them back to the column's python type
+    def _coerce_cursor_value(self, model_attribute: Any, value: Any):
+        if value is None:
+            return None
+        if isinstance(value, (dict, list)):
+            raise TypeError("cursor values must be scalars")
+        try:
+            python_type = model_attribute.type.python_type
+        except (AttributeError, NotImplementedError):
+            return value
+        if issubclass(python_type, datetime):
+            return parse_and_coerce_to_utc_datetime(value)
+        if issubclass(python_type, PythonUUID):
+            return coerce_uuid(value)
+        if python_type in (int, float):
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                raise TypeError(f"expected a number, got {value!r}")
+            return python_type(value)
+        if python_type in (str, bool) and not isinstance(value, python_type):
+            raise TypeError(f"expected a {python_type.__name__}, got {value!r}")
+        return value
+
+    # Builds the keyset predicate for rows strictly after (or before) a cursor:
+    # (c1 > v1) OR (c1 = v1 AND c2 > v2) OR ... with each comparison flipped for
+    # descending columns. Ordering columns should be non-null for stable paging.
+    # An empty cursor marks the end of the set: nothing is after it, and a
+    # "before" it pages backwards from the last row.
+    def _keyset_criteria(
+        self,
+        model: Type[CruddyModel],
+        sort_parts: list[tuple[str, str]],
+        cursor: dict[str, Any],
+        is_before: bool,
+    ):
+        if len(cursor) == 0:
+            return None if is_before else false()
+        columns = [name for name, _ in sort_parts]
+        unknown = [name for name in cursor if name not in columns]
+        if len(unknown) > 0:
+            raise ValueError(
+                f"Cursor has values for columns it is not ordered by: {', '.join(unknown)}"
+            )
+        clauses = []
+        equalities = []
+        for name, getter in sort_parts:
+            if name not in cursor:
+                raise ValueError(
+                    f"Cursor is missing a value for ordering column {name}"
+                )
+            model_attribute = getattr(model, name)
+            try:
+                value = self._coerce_cursor_value(model_attribute, cursor[name])
+            except (ValueError, TypeError) as e:
+                raise ValueError(
+                    f"Cursor value for ordering column {name} is invalid: {e}"
+                ) from e
+            ascending = (getter != "desc") != is_before
+            bound = model_attribute > value if ascending else model_attribute < value
+            clauses.append(and_(*equalities, bound))
+            equalities.append(model_attribute == value)
+        return or_(*clauses)
+
+    # Applies sorting and either OFFSET or keyset pagination. A keyset page is
+    # requested by sending an "after" or "before" cursor. The primary key is always
+    # appended to the ordering in keyset mode, so ties cannot skip or repeat rows.
+    # A "before"-only page is scanned in reverse, and must be flipped by the caller.
+    def _sort_and_paginate(
+        self,
+        query: Any,
+        model: Type[CruddyModel],
+        primary_key: str,
+        query_conf: dict[str, Any],
+    ):
+        after = query_conf.get("after", None)
+        before = query_conf.get("before", None)
+        is_keyset = after is not None or before is not None
+        is_backwards = after is None and before is not None
+        sort_parts = self._parse_sort(query_conf["sort"])
+        if is_keyset and primary_key not in [name for name, _ in sort_parts]:
+            sort_parts.append((primary_key, "asc"))
+
+        for name, getter in sort_parts:
+            if is_backwards:
+                getter = "asc" if getter == "desc" else "desc"
+            query = query.order_by(getattr(getattr(model, name), getter)())
+
+        # count query
+        count_query = select(func.count(1)).select_from(query)  # type: ignore
+
+        if not is_keyset:
+            offset_page = query_conf["page"] - 1
+            # pagination
+            query = query.offset(offset_page * query_conf["limit"]).limit(
+                query_conf["limit"]
+            )
+            return query, count_query, is_backwards
+
+        for cursor, is_before in ((after, False), (before, True)):
+            if cursor is None:
+                continue
+            try:
+                criteria = self._keyset_criteria(
+                    model=model,
+                    sort_parts=sort_parts,
+                    cursor=cursor,
+                    is_before=is_before,
+                )
+            except (ValueError, TypeError) as e:
+                raise CruddyInvalidCursorException(str(e)) from e
+            if criteria is not None:
+                query = query.filter(criteria)
+        query = query.limit(query_conf["limit"])
+        return query, count_query, is_backwards
+
     # Initial, simple, query forge. Invalid attrs or ops are just dropped.
     # Improvements to make:
     # 1. Table joins for relationships.
@@ -37,6 +37,8 @@ from .controller import (
     META_VALIDATION_MESSAGES_KEY,
 )
 from .repository import AbstractRepository
+from .cache import CachePolicy, SingleFlight
+from .live_query import LiveQueryHub
 from .adapters import BaseAdapter, SqliteAdapter, MysqlAdapter, PostgresqlAdapter
 from .util import (
     possible_id_types,
@@ -133,6 +135,9 @@ class Resource:
         disable_nested_objects: bool = False,
         default_limit: int = 10,
         use_model_defaults: bool = True,
+        cache_policy: CachePolicy | None = None,
+        single_flight: SingleFlight | None = None,
+        live_queries: LiveQueryHub | None = None,
         # Repository lifecycle actions
         lifecycle_before_create: lifecycle_types = None,
         lifecycle_after_create: lifecycle_types = None,
@@ -249,6 +254,9 @@ class Resource:
             lifecycle_after_get_all=lifecycle_after_get_all,
             lifecycle_before_set_relations=lifecycle_before_set_relations,
             lifecycle_after_set_relations=lifecycle_after_set_relations,
+            cache_policy=cache_policy,
+            single_flight=single_flight,
+            live_queries=live_queries,
         )
 
         self.controller = APIRouter(prefix=self._resource_path, tags=self._tags)
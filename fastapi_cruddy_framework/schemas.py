@@ -33,6 +33,12 @@ CONTROL_EVENT = "control"
 DISCONNECT_EVENT = "disconnect"
 ROOM_EVENT = "room"
 CLIENT_EVENT = "client"
+CACHE_EVENT = "cache"
+MULTICAST_EVENT = "multicast"
+HEARTBEAT_EVENT = "heartbeat"
+REPLAY_EVENT = "replay"
+LIVE_QUERY_EVENT = "live_query"
+DRAIN_EVENT = "drain"
 KILL_SOCKET_BY_ID = "killsocket_id"
 KILL_SOCKET_BY_CLIENT = "killsocket_client"
 KILL_ROOM_BY_ID = "killroom_id"
@@ -100,6 +106,8 @@ class SocketMessage(CruddyGenericModel):
     type: str | None = None  # Message type
     sender: str | None = None  # Sender (if any)
     data: dict | None = None  # Message payload
+    targets: list[str] | None = None  # Many targets (if route is "multicast")
+    sequence: str | None = None  # Replay log id (if the manager records messages)
 
 
 class SocketRoomConfiguration(CruddyGenericModel):
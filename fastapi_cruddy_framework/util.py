@@ -3,6 +3,8 @@ from typing import Type, Coroutine, Any, Callable, Union
 from typing_extensions import get_args, get_origin
 from datetime import date, datetime, timezone
 from json import dumps, loads
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as BinasciiError
 from datetime import date, datetime, timezone, timedelta
 from re import compile, Match
 from fastapi import Request, WebSocket, Depends
@@ -207,6 +209,24 @@ def to_json_object(thing):
     return loads(to_json_string(thing))
 
 
+# Keyset cursors are opaque to clients: url-safe base64 of a JSON object mapping each
+# ordering column (sort columns + primary key) to its value on the boundary row.
+# An empty object is a valid cursor, and marks the position past the end of a set.
+def encode_cursor(values: dict[str, Any]) -> str:
+    return urlsafe_b64encode(to_json_string(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = loads(urlsafe_b64decode(padded.encode()).decode())
+    except (BinasciiError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"'{cursor}' is not a valid cursor") from e
+    if not isinstance(values, dict):
+        raise ValueError(f"'{cursor}' is not a valid cursor")
+    return values
+
+
 def get_state(
     connection: Request | WebSocket | HTTPConnection,
     key: str,
@@ -1,15 +1,35 @@
 from __future__ import annotations
 from typing import Any, Literal
-from collections.abc import Callable
+from collections.abc import Callable, Coroutine, Iterable
 from contextlib import asynccontextmanager
 from logging import getLogger
 from uuid import uuid4
-from asyncio import gather
+from asyncio import (
+    CancelledError,
+    Event,
+    Task,
+    TimeoutError as _TimeoutError,
+    Lock,
+    Semaphore,
+    create_task,
+    gather,
+    sleep,
+    wait,
+    wait_for,
+)
+from collections import deque
+from math import ceil
+from random import uniform
+from time import monotonic
 from json import dumps
 from pymitter import EventEmitter
 from fastapi import WebSocket, WebSocketDisconnect
 from .adapters import RedisAdapter
-from .pubsub import PubSub
+from .exceptions import CruddyAdmissionRejectedException
+from .presence import PresenceRegistry
+from .pubsub import PubSub, PubSubCodec
+from .replay import ReplayLog
+from .work_queue import StreamWorkQueue
 from .schemas import (
     SocketMessage,
     SocketRoomConfiguration,
@@ -17,6 +37,10 @@ from .schemas import (
     CLIENT_EVENT,
     ROOM_EVENT,
     CONTROL_EVENT,
+    MULTICAST_EVENT,
+    HEARTBEAT_EVENT,
+    REPLAY_EVENT,
+    DRAIN_EVENT,
     KILL_SOCKET_BY_ID,
     KILL_SOCKET_BY_CLIENT,
     KILL_ROOM_BY_ID,
@@ -27,14 +51,531 @@ from .schemas import (
     CLIENT_MESSAGE_EVENT,
     DISCONNECT_EVENT,
 )
-from .util import to_json_object, get_state, set_state
+from .util import to_json_string, json_serial, get_state, set_state
 
 logger = getLogger(__name__)
+RESUME_STATE_KEY = "cruddy_resume_from"
+RESUMED_ROOMS_STATE_KEY = "cruddy_resumed_rooms"
+PROTOCOL_STATE_KEY = "cruddy_protocol"
+SOCKET_ID_OVERRIDDEN_STATE_KEY = "cruddy_socket_id_overridden"
+JSON_PROTOCOL = "json"
+MSGPACK_PROTOCOL = "msgpack"
+WireProtocol = Literal["json", "msgpack"]
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DISCONNECT = "disconnect"
+OverflowPolicy = Literal["drop_oldest", "drop_newest", "disconnect"]
+MulticastRoute = Literal["socket", "client", "room"]
+INLINE = "inline"
+CONCURRENT = "concurrent"
+ORDERED = "ordered"
+InboundMode = Literal["inline", "concurrent", "ordered"]
+
+
+# -------------------------------------------------------------------------------------------
+# ROOM MESSAGE COALESCING
+# -------------------------------------------------------------------------------------------
+class CoalescePolicy:
+    window: float
+    dedupe_by_type: bool
+
+    def __init__(
+        self,
+        # Seconds a room's messages are collected before being sent as one array frame
+        window: float = 0.05,
+        # Only keep the latest message of each type within a window
+        dedupe_by_type: bool = False,
+    ):
+        self.window = window
+        self.dedupe_by_type = dedupe_by_type
+
+
+# -------------------------------------------------------------------------------------------
+# CONNECTION ADMISSION CONTROL (ONE PER MANAGER)
+# -------------------------------------------------------------------------------------------
+class AdmissionControl:
+    rate: float | None
+    burst: int
+    max_handshakes: int | None
+    max_wait: float
+    retry_after: float
+    retry_jitter: float
+    close_code: int | None
+    tokens: float
+    refilled: float
+    handshakes: Semaphore | None
+    waiting: int
+    in_flight: int
+    admitted: int
+    rejected: int
+
+    def __init__(
+        self,
+        # Connections accepted per second once the burst is spent. None disables the bucket.
+        rate: float | None = 100,
+        burst: int = 100,
+        # Connections allowed between admission and the end of their setup at once,
+        # including the app's own setup inside the connect() block
+        max_handshakes: int | None = 100,
+        # Longest a connection may queue for admission before it is turned away
+        max_wait: float = 5,
+        # Base retry hint for rejected clients, randomized by +/- retry_jitter (a fraction)
+        retry_after: float = 5,
+        retry_jitter: float = 0.5,
+        # Rejected sockets are accepted and closed with this code and a
+        # {"retry_after": seconds} reason. None rejects the handshake outright instead.
+        close_code: int | None = 1013,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_handshakes = max_handshakes
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.retry_jitter = retry_jitter
+        self.close_code = close_code
+        self.tokens = burst
+        self.refilled = monotonic()
+        self.handshakes = None if max_handshakes is None else Semaphore(max_handshakes)
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+        }
+
+    # Tokens are reserved up front (the bucket may go negative), so queued connections
+    # are admitted in arrival order at the configured rate
+    def _reserve(self) -> float:
+        if self.rate is None:
+            return 0
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        self.tokens -= 1
+        return max(0, -self.tokens / self.rate)
+
+    async def acquire(self) -> bool:
+        deadline = monotonic() + self.max_wait
+        delay = self._reserve()
+        if delay > self.max_wait:
+            self.tokens += 1
+            self.rejected += 1
+            return False
+        self.waiting += 1
+        try:
+            if delay > 0:
+                await sleep(delay)
+            if self.handshakes is not None:
+                try:
+                    await wait_for(
+                        self.handshakes.acquire(), max(0, deadline - monotonic())
+                    )
+                except _TimeoutError:
+                    # Give back the token this connection never used
+                    if self.rate is not None:
+                        self.tokens += 1
+                    self.rejected += 1
+                    return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        if self.handshakes is not None:
+            self.handshakes.release()
+
+    # Spread over the time it would take to drain the current backlog, so a storm of
+    # rejected clients doesn't return as a second storm
+    def retry_hint(self) -> float:
+        base = self.retry_after
+        if self.rate is not None:
+            base = max(base, self.waiting / self.rate)
+        return round(base * uniform(1 - self.retry_jitter, 1 + self.retry_jitter), 3)
+
+
+# -------------------------------------------------------------------------------------------
+# HASHED TIMER WHEEL (ONE PER MANAGER)
+# -------------------------------------------------------------------------------------------
+class TimerWheel:
+    tick: float
+    slots: list[dict[Any, int]]
+    positions: dict[Any, int]
+    cursor: int
+
+    def __init__(self, tick: float = 1, size: int = 512):
+        self.tick = tick
+        self.slots = [{} for _ in range(size)]
+        self.positions = {}
+        self.cursor = 0
+
+    # O(1): an item lands in the slot its deadline hashes to, with the number of full
+    # turns of the wheel it must wait out before expiring
+    def schedule(self, item: Any, delay: float):
+        self.cancel(item)
+        ticks = max(1, ceil(delay / self.tick))
+        rounds, offset = divmod(ticks - 1, len(self.slots))
+        slot = (self.cursor + 1 + offset) % len(self.slots)
+        self.slots[slot][item] = rounds
+        self.positions[item] = slot
+
+    def cancel(self, item: Any):
+        slot = self.positions.pop(item, None)
+        if slot is not None:
+            self.slots[slot].pop(item, None)
+
+    def advance(self) -> list[Any]:
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        slot = self.slots[self.cursor]
+        expired = []
+        for item, rounds in list(slot.items()):
+            if rounds > 0:
+                slot[item] = rounds - 1
+            else:
+                del slot[item]
+                del self.positions[item]
+                expired.append(item)
+        return expired
+
+    def __len__(self):
+        return len(self.positions)
+
+
+# -------------------------------------------------------------------------------------------
+# PER-SOCKET INBOUND DISPATCH
+# -------------------------------------------------------------------------------------------
+class InboundDispatcher:
+    manager: "WebsocketConnectionManager"
+    websocket: WebSocket
+    slots: Semaphore
+    tails: dict[Any, Task]
+    tasks: set[Task]
+
+    def __init__(self, manager: "WebsocketConnectionManager", websocket: WebSocket):
+        self.manager = manager
+        self.websocket = websocket
+        self.slots = Semaphore(manager.inbound_concurrency)
+        self.tails = {}
+        self.tasks = set()
+
+    # Returns once the message is handled (inline) or handed off. A socket with
+    # inbound_concurrency messages in flight is not read from until one finishes.
+    async def dispatch(self, data: dict):
+        manager = self.manager
+        work_queue = manager.work_queue
+        if work_queue is not None and work_queue.accepts(data):
+            socket_id = f"{get_state(self.websocket, manager.socket_id_attr)}"
+            client_id = manager.socket_client_ids.get(self.websocket)
+            await work_queue.enqueue(
+                socket_id,
+                (
+                    socket_id
+                    if manager.custom_client_identifier is None
+                    else f"{client_id}"
+                ),
+                data,
+            )
+            return
+        if manager.inbound_mode == INLINE:
+            await manager.emit(CLIENT_MESSAGE_EVENT, self.websocket, data)
+            return
+        await self.slots.acquire()
+        key = None
+        previous = None
+        if manager.inbound_mode == ORDERED:
+            key = manager.inbound_key(data)
+            previous = self.tails.get(key)
+        task = create_task(self._run(data, previous))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if manager.inbound_mode == ORDERED:
+            self.tails[key] = task
+            task.add_done_callback(lambda done: self._release_tail(key, done))
+
+    def _release_tail(self, key: Any, task: Task):
+        if self.tails.get(key) is task:
+            del self.tails[key]
+
+    async def _run(self, data: dict, previous: Task | None):
+        manager = self.manager
+        try:
+            # Messages sharing a key are handled one after another, in arrival order
+            if previous is not None:
+                await wait([previous])
+            async with manager.inbound_workers:
+                manager.inbound_in_flight += 1
+                try:
+                    await manager.emit(CLIENT_MESSAGE_EVENT, self.websocket, data)
+                finally:
+                    manager.inbound_in_flight -= 1
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            manager.inbound_failed += 1
+            logger.warning("Websocket message handler failed |%s|", e)
+        finally:
+            self.slots.release()
+
+
+def _message_type(data: dict) -> Any:
+    return data.get("type")
+
+
+# -------------------------------------------------------------------------------------------
+# GRACEFUL DRAIN FOR ROLLING DEPLOYS
+# -------------------------------------------------------------------------------------------
+class DrainPolicy:
+    batch_size: int
+    close_timeout: float
+    window: float
+    timeout: float | None
+    close_code: int
+    reconnect: bool
+    reconnect_data: dict | None
+
+    def __init__(
+        self,
+        # Sockets closed concurrently at a time
+        batch_size: int = 500,
+        # Longest a single socket may take to receive its reconnect frame and close
+        close_timeout: float = 5,
+        # Seconds the batches are spread across, so clients don't reconnect in one herd
+        window: float = 0,
+        # Longest a whole drain may take. Sockets still open after it are abandoned.
+        timeout: float | None = 60,
+        # 1001 is "going away"
+        close_code: int = 1001,
+        # Send each socket a DRAIN_EVENT "reconnect" frame (with reconnect_data) before closing it
+        reconnect: bool = False,
+        reconnect_data: dict | None = None,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.close_timeout = close_timeout
+        self.window = window
+        self.timeout = timeout
+        self.close_code = close_code
+        self.reconnect = reconnect
+        self.reconnect_data = reconnect_data
+
+
+# -------------------------------------------------------------------------------------------
+# ENCODE-ONCE-PER-PROTOCOL FRAMES
+# -------------------------------------------------------------------------------------------
+class OutboundFrame:
+    __slots__ = ("envelope", "encoders", "encoded")
+    envelope: dict | list[dict]
+    encoders: dict[str, Callable[[Any], str | bytes]]
+    encoded: dict[str, str | bytes]
+
+    def __init__(
+        self,
+        envelope: dict | list[dict],
+        encoders: dict[str, Callable[[Any], str | bytes]],
+    ):
+        self.envelope = envelope
+        self.encoders = encoders
+        self.encoded = {}
+
+    # The first socket speaking a protocol pays for its encoding, the rest share the buffer
+    def encode(self, protocol: str) -> str | bytes:
+        frame = self.encoded.get(protocol)
+        if frame is None:
+            frame = self.encoded[protocol] = self.encoders[protocol](self.envelope)
+        return frame
+
+
+def _msgpack():
+    try:
+        import msgpack  # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise ImportError(
+            "The msgpack websocket protocol requires the msgpack package: pip install msgpack"
+        ) from e
+    return msgpack
+
+
+# -------------------------------------------------------------------------------------------
+# PER-SOCKET OUTBOUND QUEUE
+# -------------------------------------------------------------------------------------------
+class SocketWriter:
+    websocket: WebSocket
+    protocol: str
+    queue: deque[str | bytes | OutboundFrame]
+    max_queue: int
+    overflow: OverflowPolicy
+    send_timeout: float | None
+    on_evict: Callable[["SocketWriter", str], None]
+    on_drop: Callable[["SocketWriter"], None]
+    on_failed: Callable[["SocketWriter"], None] | None
+    coalesce: CoalescePolicy | None
+    wakeup: Event
+    task: Task | None
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        on_evict: Callable[["SocketWriter", str], None],
+        on_drop: Callable[["SocketWriter"], None],
+        max_queue: int = 1000,
+        overflow: OverflowPolicy = DROP_OLDEST,
+        send_timeout: float | None = 10,
+        protocol: str = JSON_PROTOCOL,
+        # Called when a send fails because the socket is gone
+        on_failed: Callable[["SocketWriter"], None] | None = None,
+        # Collects this socket's messages for a window and sends them as one array frame
+        coalesce: CoalescePolicy | None = None,
+    ):
+        self.websocket = websocket
+        self.protocol = protocol
+        self.queue = deque()
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.send_timeout = send_timeout
+        self.on_evict = on_evict
+        self.on_drop = on_drop
+        self.on_failed = on_failed
+        self.coalesce = coalesce
+        self.wakeup = Event()
+        self.task = None
+
+    def start(self):
+        self.task = create_task(self.run())
+
+    def stop(self):
+        self.queue.clear()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    # Never awaits, so a broadcast costs O(n) appends no matter how slow its peers are
+    def enqueue(self, frame: str | bytes | OutboundFrame) -> bool:
+        if len(self.queue) >= self.max_queue:
+            if self.overflow == DISCONNECT:
+                self.on_evict(self, "send queue overflow")
+                return False
+            self.on_drop(self)
+            if self.overflow == DROP_NEWEST:
+                return False
+            self.queue.popleft()
+        self.queue.append(frame)
+        self.wakeup.set()
+        return True
+
+    async def run(self):
+        while True:
+            while len(self.queue) == 0:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            frame = self.queue.popleft()
+            if self.coalesce is not None and isinstance(frame, OutboundFrame):
+                await sleep(self.coalesce.window)
+                frame = self._coalesce(frame)
+            try:
+                if self.send_timeout is None:
+                    await self.send(frame)
+                else:
+                    await wait_for(self.send(frame), self.send_timeout)
+            except CancelledError:
+                raise
+            except _TimeoutError:
+                self.queue.clear()
+                self.task = None
+                self.on_evict(self, "send timeout")
+                return
+            except Exception:  # pylint: disable=broad-exception-caught
+                # The socket is gone
+                self.queue.clear()
+                self.task = None
+                if self.on_failed is not None:
+                    self.on_failed(self)
+                return
+
+    # Joins the frames queued behind the first, up to any pre-encoded one, into one array.
+    # The array is encoded for this socket alone, unlike a coalesced room's.
+    def _coalesce(self, first: OutboundFrame) -> OutboundFrame:
+        envelopes: list[dict] = []
+        frame = first
+        while True:
+            if isinstance(frame.envelope, list):
+                envelopes.extend(frame.envelope)
+            else:
+                envelopes.append(frame.envelope)
+            if len(self.queue) == 0 or not isinstance(self.queue[0], OutboundFrame):
+                break
+            frame = self.queue.popleft()  # type: ignore
+        if self.coalesce is not None and self.coalesce.dedupe_by_type:
+            envelopes = _latest_by_type(envelopes)
+        return OutboundFrame(envelopes, first.encoders)
+
+    # Sends one frame right away, bypassing the queue
+    async def send(self, frame: str | bytes | OutboundFrame):
+        if isinstance(frame, OutboundFrame):
+            frame = frame.encode(self.protocol)
+        if isinstance(frame, bytes):
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
 
 
 class WebsocketConnectionManager:
     pubsub_instance: PubSub
-    active_connections: list[WebSocket]
+    # Ordered sets (dicts with None values) so linking and unlinking a socket is O(1)
+    active_connections: dict[WebSocket, None]
+    socket_index: dict[str, dict[WebSocket, None]]
+    client_index: dict[str, dict[WebSocket, None]]
+    room_index: dict[str, dict[WebSocket, None]]
+    socket_client_ids: dict[WebSocket, Any]
+    writers: dict[WebSocket, SocketWriter]
+    send_queue_size: int
+    send_overflow: OverflowPolicy
+    send_timeout: float | None
+    dropped_frames: int
+    evicted_slow_consumers: int
+    room_channels: bool
+    room_channel_lock: Lock
+    presence: PresenceRegistry | None
+    control_addressed: int
+    control_broadcast: int
+    local_deliveries: int
+    room_coalescing: Callable[[str], CoalescePolicy | None] | None
+    socket_coalescing: Callable[[WebSocket], CoalescePolicy | None] | None
+    coalesced: dict[str, list[dict]]
+    coalesce_timers: dict[str, Task]
+    # Fire-and-forget work (closing evicted sockets and the like), held until it finishes
+    background_tasks: set[Task]
+    inbound_mode: InboundMode
+    inbound_concurrency: int
+    inbound_key: Callable[[dict], Any]
+    inbound_workers: Semaphore
+    inbound_in_flight: int
+    inbound_failed: int
+    ping_interval: float | None
+    pong_timeout: float
+    idle_timeout: float | None
+    heartbeat_wheel: TimerWheel
+    heartbeat_task: Task | None
+    last_seen: dict[WebSocket, float]
+    last_active: dict[WebSocket, float]
+    ping_sent: dict[WebSocket, float]
+    reaping: set[WebSocket]
+    reaped_connections: int
+    replay_log: ReplayLog | None
+    replayed_messages: int
+    admission: AdmissionControl | None
+    drain_policy: DrainPolicy
+    draining: bool
+    drain_total: int
+    drain_closed: int
+    protocols: list[WireProtocol]
+    frame_encoders: dict[str, Callable[[Any], str | bytes]]
+    work_queue: StreamWorkQueue | None
     emitter: EventEmitter
     accept_new: bool
     custom_client_identifier: Callable | None
@@ -52,15 +593,76 @@ class WebsocketConnectionManager:
         redis_host: str = "redis",
         redis_port: int = 6379,
         redis_max_connections: int = 10000,
-        custom_json_serializer: Callable = to_json_object,
+        # Turns a client message envelope into a frame: str is sent as text, bytes as binary
+        custom_json_serializer: Callable[[dict], str | bytes] = to_json_string,
         connected_state_attr: str = "is_connected",
         socket_id_attr: str = "socket_id",
         custom_client_identifier: Callable | None = None,
         room_configuration_object_key: str = "rooms",
+        codec: PubSubCodec | None = None,
+        # Each socket gets a bounded outbound queue drained by its own writer task
+        send_queue_size: int = 1000,
+        send_overflow: OverflowPolicy = DROP_OLDEST,
+        send_timeout: float | None = 10,
+        # Publish room messages on "<redis_channel>:room:<room_id>", which a node only
+        # subscribes to while it hosts at least one member of that room
+        room_channels: bool = False,
+        # Mirror connections and room membership into redis for cluster-wide queries, and
+        # address control messages to the node(s) owning their target
+        presence: bool = False,
+        presence_heartbeat_interval: float = 5,
+        presence_node_ttl: float = 15,
+        # Returns a CoalescePolicy for rooms whose messages should be batched (e.g. a
+        # dict's .get), or None to send that room's messages as they arrive
+        room_coalescing: Callable[[str], CoalescePolicy | None] | None = None,
+        # Returns a CoalescePolicy for sockets whose messages (from any room, broadcast or
+        # direct message) should be batched, or None. Called once, when a socket connects.
+        socket_coalescing: Callable[[WebSocket], CoalescePolicy | None] | None = None,
+        # How CLIENT_MESSAGE_EVENT handlers run: "inline" awaits each one before reading
+        # the next message, "concurrent" runs up to inbound_concurrency per socket at once,
+        # "ordered" does too but serializes messages with the same inbound_key
+        inbound_mode: InboundMode = INLINE,
+        inbound_concurrency: int = 8,
+        inbound_key: Callable[[dict], Any] = _message_type,
+        # Node-wide cap on concurrently running handlers, shared by every socket
+        inbound_workers: int = 256,
+        # Send a ping frame to sockets that have been silent this long, and reap them if
+        # nothing arrives within pong_timeout. None disables pings.
+        ping_interval: float | None = None,
+        pong_timeout: float = 10,
+        # Reap sockets that send no messages (pongs aside) for this long
+        idle_timeout: float | None = None,
+        # Resolution of the timer wheel that drives pings and timeouts
+        heartbeat_tick: float = 1,
+        # Record broadcast / room / direct messages with sequence ids, so reconnecting
+        # clients can be sent just the messages they missed
+        replay_log: ReplayLog | None = None,
+        # Throttles connect() during reconnect storms. None admits every connection at once.
+        admission: AdmissionControl | None = None,
+        # How drain() and dispose() close sockets. Defaults to DrainPolicy().
+        drain_policy: DrainPolicy | None = None,
+        # Hands client messages to a redis stream consumed by every node, instead of
+        # emitting them as CLIENT_MESSAGE_EVENT on the node holding the socket
+        work_queue: StreamWorkQueue | None = None,
+        # Wire protocols a client may negotiate, via a "cruddy.<protocol>" subprotocol or a
+        # ?protocol=<protocol> query param. "msgpack" needs the msgpack package.
+        protocols: list[WireProtocol] = [JSON_PROTOCOL],
     ):
         self.accept_new = True
         self.emitter = EventEmitter()
-        self.active_connections: list[WebSocket] = []
+        self.active_connections = {}
+        self.socket_index = {}
+        self.client_index = {}
+        self.room_index = {}
+        self.socket_client_ids = {}
+        self.writers = {}
+        self.send_queue_size = send_queue_size
+        self.send_overflow = send_overflow
+        self.send_timeout = send_timeout
+        self.dropped_frames = 0
+        self.evicted_slow_consumers = 0
+        self.room_channels = room_channels
+        self.room_channel_lock = Lock()
         self.custom_json_serializer = custom_json_serializer
         self.custom_client_identifier = custom_client_identifier
         self.room_configuration_object_key = room_configuration_object_key
@@ -75,13 +677,65 @@ class WebsocketConnectionManager:
                     redis_max_connections=redis_max_connections,
                 )
             self.pubsub_instance = PubSub(
-                channel=redis_channel, redis_client=redis_adapter
+                channel=redis_channel, redis_client=redis_adapter, codec=codec
             )
         else:
             self.pubsub_instance = pubsub_instance
+        if presence and self.pubsub_instance.redis_client is None:
+            raise ValueError("presence=True requires a redis backed PubSub")
+        self.presence = (
+            PresenceRegistry(
+                redis_adapter=self.pubsub_instance.redis_client,
+                namespace=f"cruddy:presence:{self.pubsub_instance.channel}",
+                heartbeat_interval=presence_heartbeat_interval,
+                node_ttl=presence_node_ttl,
+            )
+            if presence
+            else None
+        )
+        self.control_addressed = 0
+        self.control_broadcast = 0
+        self.local_deliveries = 0
+        self.room_coalescing = room_coalescing
+        self.socket_coalescing = socket_coalescing
+        self.inbound_mode = inbound_mode
+        self.inbound_concurrency = inbound_concurrency
+        self.inbound_key = inbound_key
+        self.inbound_workers = Semaphore(inbound_workers)
+        self.inbound_in_flight = 0
+        self.inbound_failed = 0
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.idle_timeout = idle_timeout
+        self.heartbeat_wheel = TimerWheel(tick=heartbeat_tick)
+        self.heartbeat_task = None
+        self.background_tasks = set()
+        self.last_seen = {}
+        self.last_active = {}
+        self.ping_sent = {}
+        self.reaping = set()
+        self.reaped_connections = 0
+        self.replay_log = replay_log
+        self.replayed_messages = 0
+        self.admission = admission
+        self.drain_policy = DrainPolicy() if drain_policy is None else drain_policy
+        self.draining = False
+        self.drain_total = 0
+        self.drain_closed = 0
+        self.work_queue = work_queue
+        self.protocols = list(protocols)
+        self.frame_encoders = {JSON_PROTOCOL: self._serialize}
+        if MSGPACK_PROTOCOL in self.protocols:
+            packb = _msgpack().packb
+            self.frame_encoders[MSGPACK_PROTOCOL] = lambda envelope: packb(
+                envelope, default=json_serial
+            )
+        self.coalesced = {}
+        self.coalesce_timers = {}
         self.pubsub_instance.on(CONTROL_EVENT, self._handle_control_plane)
         self.pubsub_instance.on(BROADCAST_EVENT, self._transmit)
         self.pubsub_instance.on(ROOM_EVENT, self._route_to_room)
+        self.pubsub_instance.on(MULTICAST_EVENT, self._route_multicast)
         if custom_client_identifier is not None:
             self.pubsub_instance.on(CLIENT_EVENT, self._route_to_client_id)
         else:
@@ -98,14 +752,116 @@ class WebsocketConnectionManager:
 
     async def startup(self):
         if self.accept_new:
+            if self.presence is not None:
+                await self.pubsub_instance.subscribe(
+                    self.get_node_channel(self.presence.node_id)
+                )
             await self.pubsub_instance.startup()
+            if self.presence is not None:
+                await self.presence.startup()
+            if self.heartbeat_enabled and self.heartbeat_task is None:
+                self.heartbeat_task = create_task(self._heartbeat_loop())
+            if self.work_queue is not None:
+                await self.work_queue.startup(self)
 
     async def dispose(self):
         self.accept_new = False
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        if self.work_queue is not None:
+            await self.work_queue.dispose()
+        await self.drain(window=0)
         await self.pubsub_instance.dispose()
-        await self._kill_sockets(sockets=self.active_connections)
-        self.active_connections = []
+        if self.presence is not None:
+            await self.presence.dispose()
+        self.active_connections = {}
+        self.socket_index = {}
+        self.client_index = {}
+        self.room_index = {}
+        self.socket_client_ids = {}
+        for writer in self.writers.values():
+            writer.stop()
+        self.writers = {}
+        for timer in self.coalesce_timers.values():
+            timer.cancel()
+        self.coalesce_timers = {}
+        self.coalesced = {}
+        for task in self.background_tasks:
+            task.cancel()
+        self.background_tasks = set()
+
+    # Stops accepting sockets, then closes the open ones in concurrent batches spread
+    # over the window. Call it on shutdown signals, ahead of dispose().
+    async def drain(self, window: float | None = None):
+        self.accept_new = False
+        policy = self.drain_policy
+        window = policy.window if window is None else window
+        sockets = list(self.active_connections)
+        self.draining = True
+        self.drain_total = len(sockets)
+        self.drain_closed = 0
+        frame = (
+            self.generate_client_frame(
+                DRAIN_EVENT, None, None, "reconnect", policy.reconnect_data or {}
+            )
+            if policy.reconnect
+            else None
+        )
+        try:
+            if policy.timeout is None:
+                await self._drain_batches(sockets, window, frame)
+            else:
+                await wait_for(
+                    self._drain_batches(sockets, window, frame), policy.timeout
+                )
+        except _TimeoutError:
+            logger.warning(
+                "Drain timed out with %s websockets still open",
+                self.drain_total - self.drain_closed,
+            )
+            for socket in sockets:
+                set_state(socket, self.connected_state_attr, False)
+        finally:
+            self.draining = False
 
+    @property
+    def drain_progress(self) -> dict[str, int | bool]:
+        return {
+            "draining": self.draining,
+            "total": self.drain_total,
+            "closed": self.drain_closed,
+            "remaining": self.drain_total - self.drain_closed,
+        }
+
+    @property
+    def metrics(self) -> dict[str, int]:
+        return {
+            "connections": len(self.active_connections),
+            "queued_frames": sum(len(writer.queue) for writer in self.writers.values()),
+            "dropped_frames": self.dropped_frames,
+            "evicted_slow_consumers": self.evicted_slow_consumers,
+            "control_addressed": self.control_addressed,
+            "control_broadcast": self.control_broadcast,
+            "local_deliveries": self.local_deliveries,
+            "inbound_in_flight": self.inbound_in_flight,
+            "inbound_failed": self.inbound_failed,
+            "reaped_connections": self.reaped_connections,
+            "replayed_messages": self.replayed_messages,
+            "admission_rejected": (
+                0 if self.admission is None else self.admission.rejected
+            ),
+            "admission_waiting": (
+                0 if self.admission is None else self.admission.waiting
+            ),
+        }
+
+    @property
+    def heartbeat_enabled(self) -> bool:
+        return self.ping_interval is not None or self.idle_timeout is not None
+
+    # With admission control, a socket turned away is closed with a retry hint and this
+    # raises CruddyAdmissionRejectedException before the block runs. Routes should catch it.
     @asynccontextmanager
     async def connect(
         self,
@@ -113,27 +869,71 @@ class WebsocketConnectionManager:
         override_socket_id: str | None = None,
         disconnect_message_type: str | None = None,
         disconnect_message_data: dict | None = None,
+        # The "id" of the last message a reconnecting client received
+        last_seen_id: str | None = None,
     ):
         if not self.accept_new:
             raise RuntimeError(
                 "The WebsocketConnectionManager instance is shutting down and not accepting new connections"
             )
-        socket_id = str(uuid4()) if override_socket_id is None else override_socket_id
-        set_state(websocket, self.socket_id_attr, socket_id)
-        set_state(
-            websocket,
-            self.room_configuration_object_key,
-            SocketRoomConfiguration(room_list=set()),
-        )
-        set_state(websocket, self.connected_state_attr, True)
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        yield socket_id
+        admission = self.admission
+        if admission is not None and not await admission.acquire():
+            await self._reject(websocket, admission)
+        try:
+            socket_id = (
+                str(uuid4()) if override_socket_id is None else override_socket_id
+            )
+            set_state(websocket, self.socket_id_attr, socket_id)
+            set_state(
+                websocket,
+                SOCKET_ID_OVERRIDDEN_STATE_KEY,
+                override_socket_id is not None,
+            )
+            set_state(
+                websocket,
+                self.room_configuration_object_key,
+                SocketRoomConfiguration(room_list=set()),
+            )
+            set_state(websocket, self.connected_state_attr, True)
+            protocol, subprotocol = self._negotiate_protocol(websocket)
+            set_state(websocket, PROTOCOL_STATE_KEY, protocol)
+            await websocket.accept(subprotocol=subprotocol)
+            self._link_socket(websocket, socket_id)
+            if last_seen_id is not None and self.replay_log is not None:
+                # Rooms are replayed the first time the socket rejoins each of them
+                set_state(websocket, RESUME_STATE_KEY, last_seen_id)
+                set_state(websocket, RESUMED_ROOMS_STATE_KEY, set())
+                streams = ["broadcast"]
+                # Direct messages can only be found again under an identity that
+                # outlives the socket: a client id, or an app-supplied socket id
+                if self.custom_client_identifier is not None:
+                    streams.append(f"client:{self.socket_client_ids.get(websocket)}")
+                elif override_socket_id is not None:
+                    streams.append(f"client:{socket_id}")
+                else:
+                    self._request_refresh(websocket, "client")
+                await self._replay(websocket, last_seen_id, streams)
+            # The slot is held while the app finishes its own setup (joining rooms, etc.)
+            yield socket_id
+        finally:
+            if admission is not None:
+                admission.release()
+        dispatcher = InboundDispatcher(self, websocket)
+        unpackb = _msgpack().unpackb if protocol == MSGPACK_PROTOCOL else None
         try:
             while get_state(websocket, self.connected_state_attr, default=False):
-                data = await websocket.receive_json()
+                if unpackb is None:
+                    data = await websocket.receive_json()
+                else:
+                    data = unpackb(await websocket.receive_bytes())
+                if self.heartbeat_enabled:
+                    now = monotonic()
+                    self.last_seen[websocket] = now
+                    if _is_pong(data):
+                        continue
+                    self.last_active[websocket] = now
                 if isinstance(data, dict):
-                    await self.emit(CLIENT_MESSAGE_EVENT, websocket, data)
+                    await dispatcher.dispatch(data)
         except WebSocketDisconnect as e:
             await self._unlink_socket(websocket)
             logger.info("Websocket client %s disconnected %s", socket_id, str(e))
@@ -160,15 +960,15 @@ class WebsocketConnectionManager:
         type: str = "",
         data: dict | None = {},
     ):
-        await self.send_message_raw(
-            message=SocketMessage(
-                route=BROADCAST_EVENT,
-                target=target,
-                sender=sender,
-                type=type,
-                data=data,
-            )
+        message = SocketMessage(
+            route=BROADCAST_EVENT,
+            target=target,
+            sender=sender,
+            type=type,
+            data=data,
         )
+        await self._record(message)
+        await self.send_message_raw(message=message)
 
     async def direct_message(
         self,
@@ -177,15 +977,15 @@ class WebsocketConnectionManager:
         type: str = "",
         data: dict | None = {},
     ):
-        await self.send_message_raw(
-            message=SocketMessage(
-                route=CLIENT_EVENT,
-                target=target,
-                sender=sender,
-                type=type,
-                data=data,
-            )
+        message = SocketMessage(
+            route=CLIENT_EVENT,
+            target=target,
+            sender=sender,
+            type=type,
+            data=data,
         )
+        await self._record(message)
+        await self._publish_targeted(message=message)
 
     async def room_message(
         self,
@@ -194,16 +994,45 @@ class WebsocketConnectionManager:
         type: str = "",
         data: dict | None = {},
     ):
+        message = SocketMessage(
+            route=ROOM_EVENT,
+            target=target,
+            sender=sender,
+            type=type,
+            data=data,
+        )
+        await self._record(message)
+        await self._publish_targeted(message=message)
+
+    # One message for many socket ids, client ids or rooms. It is published once, and
+    # each node delivers it to whichever of the targets it holds.
+    async def multicast(
+        self,
+        targets: list[str],
+        route: MulticastRoute = "client",
+        sender: str | None = None,
+        type: str = "",
+        data: dict | None = {},
+    ):
+        if len(targets) == 0:
+            return
         await self.send_message_raw(
             message=SocketMessage(
-                route=ROOM_EVENT,
-                target=target,
+                route=MULTICAST_EVENT,
+                target=route,
+                targets=list(targets),
                 sender=sender,
                 type=type,
                 data=data,
             )
         )
 
+    def get_room_channel(self, room_id: str) -> str:
+        return f"{self.pubsub_instance.channel}:room:{room_id}"
+
+    def get_node_channel(self, node_id: str) -> str:
+        return f"{self.pubsub_instance.channel}:node:{node_id}"
+
     def get_room_config(self, socket: WebSocket):
         room_config: SocketRoomConfiguration = get_state(
             socket,
@@ -213,33 +1042,36 @@ class WebsocketConnectionManager:
         return room_config
 
     def get_sockets_by_id(self, id: str):
-        sockets: list[WebSocket] = []
-        for socket in self.active_connections:
-            if get_state(socket, self.socket_id_attr, default="") == id:
-                sockets.append(socket)
-        return sockets
+        return list(self.socket_index.get(id, ()))
 
     def get_sockets_by_client_id(self, id: str):
-        sockets: list[WebSocket] = []
-        for socket in self.active_connections:
-            if self._exec_custom_getter(socket) == id:
-                sockets.append(socket)
-        return sockets
+        return list(self.client_index.get(id, ()))
 
     def get_sockets_by_room(self, room_id: str):
-        sockets: list[WebSocket] = []
-        for socket in self.active_connections:
-            room_config = self.get_room_config(socket)
-            if room_id in room_config.room_list:
-                sockets.append(socket)
-        return sockets
+        return list(self.room_index.get(room_id, ()))
 
     def get_room_list(self) -> set[str]:
-        rooms = set()
-        for socket in self.active_connections:
-            room_config = self.get_room_config(socket)
-            rooms.update(room_config.room_list)
-        return rooms
+        return set(self.room_index)
+
+    # Cluster-wide queries, answered from redis when presence is enabled
+    async def count_online(self) -> int:
+        return await self._require_presence().count_online()
+
+    async def get_room_members(self, room_id: str) -> list[str]:
+        return await self._require_presence().get_room_members(room_id)
+
+    async def find_nodes_for_client(self, id: Any) -> set[str]:
+        return await self._require_presence().find_nodes_for_client(id)
+
+    async def get_cluster_room_list(self) -> set[str]:
+        return await self._require_presence().get_room_list()
+
+    def _require_presence(self) -> PresenceRegistry:
+        if self.presence is None:
+            raise RuntimeError(
+                "Cluster-wide queries require a WebsocketConnectionManager created with presence=True"
+            )
+        return self.presence
 
     async def join_room_by_socket_id(self, id: str, room_id: str):
         await self.send_control_message(
@@ -312,13 +1144,102 @@ class WebsocketConnectionManager:
             )
         )
 
+    # With presence, control messages go straight to the node(s) holding their target.
+    # Custom commands, and targets presence doesn't know about yet, are broadcast.
     async def send_control_message(self, message: SocketMessage):
         message.route = CONTROL_EVENT
-        await self.send_message_raw(message=message)
+        node_ids = await self._find_control_nodes(message)
+        if node_ids is None:
+            self.control_broadcast += 1
+            await self.send_message_raw(message=message)
+            return
+        self.control_addressed += 1
+        for node_id in node_ids:
+            await self.pubsub_instance.publish(
+                message=message, channel=self.get_node_channel(node_id)
+            )
+
+    async def _find_control_nodes(self, message: SocketMessage) -> set[str] | None:
+        if self.presence is None:
+            return None
+        target = str(message.target)
+        try:
+            if message.type in (
+                KILL_SOCKET_BY_ID,
+                JOIN_SOCKET_BY_ID,
+                LEAVE_SOCKET_BY_ID,
+            ):
+                node_ids = await self.presence.find_nodes_for_socket(target)
+            elif message.type in (
+                KILL_SOCKET_BY_CLIENT,
+                JOIN_SOCKET_BY_CLIENT,
+                LEAVE_SOCKET_BY_CLIENT,
+            ):
+                node_ids = await self.presence.find_nodes_for_client(target)
+            elif message.type == KILL_ROOM_BY_ID:
+                node_ids = await self.presence.find_nodes_for_room(target)
+            else:
+                return None
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("Unable to resolve control message target |%s|", e)
+            return None
+        return node_ids if len(node_ids) > 0 else None
 
     async def send_message_raw(self, message: SocketMessage):
         await self.pubsub_instance.publish(message=message)
 
+    # Targets known to live on this node are delivered directly, skipping the broker.
+    # A generated local socket id needs no lookup, as it can't exist anywhere else. An
+    # overridden id may be reused by other tabs or nodes, so it is published like a
+    # client target, which needs presence to know which other nodes hold members.
+    async def _publish_targeted(self, message: SocketMessage):
+        target = str(message.target)
+        if message.route == CLIENT_EVENT and self.custom_client_identifier is None:
+            if self._is_unique_local_socket_id(target):
+                self.local_deliveries += 1
+                await self._route_to_socket_id(message)
+                return
+        elif self.presence is not None:
+            try:
+                node_ids = (
+                    await self.presence.find_nodes_for_room(target)
+                    if message.route == ROOM_EVENT
+                    else await self.presence.find_nodes_for_client(target)
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Unable to resolve message target |%s|", e)
+                node_ids = set()
+            if len(node_ids) > 0:
+                if self.presence.node_id in node_ids:
+                    self.local_deliveries += 1
+                    await self._route_locally(message)
+                for node_id in node_ids - {self.presence.node_id}:
+                    await self.pubsub_instance.publish(
+                        message=message, channel=self.get_node_channel(node_id)
+                    )
+                return
+        if message.route == ROOM_EVENT and self.room_channels:
+            await self.pubsub_instance.publish(
+                message=message, channel=self.get_room_channel(target)
+            )
+        else:
+            await self.send_message_raw(message=message)
+
+    def _is_unique_local_socket_id(self, socket_id: str) -> bool:
+        sockets = self.socket_index.get(socket_id)
+        return sockets is not None and not any(
+            get_state(socket, SOCKET_ID_OVERRIDDEN_STATE_KEY, default=False)
+            for socket in sockets
+        )
+
+    async def _route_locally(self, message: SocketMessage):
+        if message.route == ROOM_EVENT:
+            await self._route_to_room(message)
+        elif self.custom_client_identifier is not None:
+            await self._route_to_client_id(message)
+        else:
+            await self._route_to_socket_id(message)
+
     def generate_client_message(
         self,
         route: str,
@@ -326,16 +1247,41 @@ class WebsocketConnectionManager:
         sender: str | None,
         type: str | None,
         data: Any,
-    ):
-        return dumps(
-            {
-                "route": route,
-                "target": target,
-                "sender": sender,
-                "type": type,
-                "data": data,
-            }
-        )
+        id: str | None = None,
+    ) -> str | bytes:
+        return self._serialize(_client_envelope(route, target, sender, type, data, id))
+
+    # Like generate_client_message, but encoded lazily for each protocol its sockets speak
+    def generate_client_frame(
+        self,
+        route: str,
+        target: str | None,
+        sender: str | None,
+        type: str | None,
+        data: Any,
+        id: str | None = None,
+    ) -> OutboundFrame:
+        return self._frame(_client_envelope(route, target, sender, type, data, id))
+
+    def _frame(self, envelope: dict | list[dict]) -> OutboundFrame:
+        return OutboundFrame(envelope, self.frame_encoders)
+
+    def _negotiate_protocol(self, websocket: WebSocket) -> tuple[str, str | None]:
+        offered = websocket.scope.get("subprotocols") or []
+        for protocol in self.protocols:
+            if f"cruddy.{protocol}" in offered:
+                return protocol, f"cruddy.{protocol}"
+        requested = websocket.query_params.get("protocol")
+        if requested in self.protocols:
+            return requested, None
+        return JSON_PROTOCOL, None
+
+    def _serialize(self, envelope: dict | list[dict]) -> str | bytes:
+        frame = self.custom_json_serializer(envelope)
+        # Serializers written for the old contract return JSON-safe objects
+        if not isinstance(frame, (str, bytes)):
+            frame = dumps(frame)
+        return frame
 
     async def _eval_disconnect_settings(
         self,
@@ -347,8 +1293,63 @@ class WebsocketConnectionManager:
                 type=disconnect_message_type, data=disconnect_message_data
             )
 
+    # The client identity is resolved once, when the socket connects
+    def _link_socket(self, websocket: WebSocket, socket_id: str):
+        client_id = self._exec_custom_getter(websocket)
+        self.active_connections[websocket] = None
+        self.socket_client_ids[websocket] = client_id
+        _index_add(self.socket_index, socket_id, websocket)
+        _index_add(self.client_index, client_id, websocket)
+        writer = SocketWriter(
+            websocket=websocket,
+            on_evict=self._evict_slow_consumer,
+            on_drop=self._count_dropped_frame,
+            on_failed=self._writer_failed,
+            max_queue=self.send_queue_size,
+            overflow=self.send_overflow,
+            send_timeout=self.send_timeout,
+            protocol=get_state(websocket, PROTOCOL_STATE_KEY, JSON_PROTOCOL),
+            coalesce=(
+                None
+                if self.socket_coalescing is None
+                else self.socket_coalescing(websocket)
+            ),
+        )
+        self.writers[websocket] = writer
+        writer.start()
+        if self.heartbeat_enabled:
+            now = monotonic()
+            self.last_seen[websocket] = now
+            self.last_active[websocket] = now
+            self._schedule_heartbeat(websocket, now)
+        if self.presence is not None:
+            self.presence.socket_connected(socket_id, client_id)
+
     async def _unlink_socket(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        if websocket not in self.active_connections:
+            return
+        del self.active_connections[websocket]
+        writer = self.writers.pop(websocket, None)
+        if writer is not None:
+            writer.stop()
+        self.heartbeat_wheel.cancel(websocket)
+        self.last_seen.pop(websocket, None)
+        self.last_active.pop(websocket, None)
+        self.ping_sent.pop(websocket, None)
+        socket_id = str(get_state(websocket, self.socket_id_attr, default=""))
+        client_id = self.socket_client_ids.pop(websocket, "")
+        _index_discard(self.socket_index, socket_id, websocket)
+        _index_discard(self.client_index, client_id, websocket)
+        room_list = list(self.get_room_config(websocket).room_list)
+        for room_id in room_list:
+            _index_discard(self.room_index, room_id, websocket)
+        # Once shutting down, the registry removes this node's entries wholesale
+        if self.presence is not None and self.accept_new:
+            self.presence.socket_disconnected(socket_id, client_id, room_list)
+            for room_id in room_list:
+                if room_id not in self.room_index:
+                    self.presence.room_hosted(room_id, False)
+        await self._sync_room_channels(room_list)
         await self.emit(DISCONNECT_EVENT, websocket)
 
     def _exec_custom_getter(self, socket: WebSocket):
@@ -370,22 +1371,22 @@ class WebsocketConnectionManager:
                 self.get_sockets_by_room(room_id=str(message.target))
             )
         elif JOIN_SOCKET_BY_ID == message.type:
-            return self._join_sockets(
+            return await self._join_sockets(
                 sockets=self.get_sockets_by_id(id=str(message.target)),
                 room_id=str(message.sender),
             )
         elif JOIN_SOCKET_BY_CLIENT == message.type:
-            return self._join_sockets(
+            return await self._join_sockets(
                 sockets=self.get_sockets_by_client_id(id=str(message.target)),
                 room_id=str(message.sender),
             )
         elif LEAVE_SOCKET_BY_ID == message.type:
-            return self._leave_sockets(
+            return await self._leave_sockets(
                 sockets=self.get_sockets_by_id(id=str(message.target)),
                 room_id=str(message.sender),
             )
         elif LEAVE_SOCKET_BY_CLIENT == message.type:
-            return self._leave_sockets(
+            return await self._leave_sockets(
                 sockets=self.get_sockets_by_client_id(id=str(message.target)),
                 room_id=str(message.sender),
             )
@@ -395,75 +1396,444 @@ class WebsocketConnectionManager:
     async def _kill_sockets(self, sockets: list[WebSocket]):
         for socket in sockets:
             set_state(socket, self.connected_state_attr, False)
-            await socket.close()
+        batch_size = self.drain_policy.batch_size
+        for start in range(0, len(sockets), batch_size):
+            await gather(
+                *(
+                    self._close_quietly(socket)
+                    for socket in sockets[start : start + batch_size]
+                )
+            )
 
-    def _join_sockets(self, sockets: list[WebSocket], room_id: str):
+    async def _drain_batches(
+        self,
+        sockets: list[WebSocket],
+        window: float,
+        frame: OutboundFrame | None,
+    ):
+        batch_size = self.drain_policy.batch_size
+        batches = ceil(len(sockets) / batch_size)
+        started = monotonic()
+        for index in range(batches):
+            delay = started + window * index / batches - monotonic()
+            if delay > 0:
+                await sleep(delay)
+            await gather(
+                *(
+                    self._drain_socket(socket, frame)
+                    for socket in sockets[index * batch_size : (index + 1) * batch_size]
+                )
+            )
+
+    async def _drain_socket(self, socket: WebSocket, frame: OutboundFrame | None):
+        policy = self.drain_policy
+        set_state(socket, self.connected_state_attr, False)
+        writer = self.writers.get(socket)
+        try:
+            if writer is not None:
+                # Queued frames are dropped so the close isn't held up behind them
+                writer.stop()
+                if frame is not None:
+                    await wait_for(writer.send(frame), policy.close_timeout)
+            await wait_for(socket.close(code=policy.close_code), policy.close_timeout)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.debug("Unable to drain websocket |%s|", e)
+        self.drain_closed += 1
+
+    async def _join_sockets(self, sockets: list[WebSocket], room_id: str):
+        hosted = room_id in self.room_index
         for socket in sockets:
             room_config = self.get_room_config(socket)
+            resume_from = get_state(socket, RESUME_STATE_KEY)
+            if resume_from is not None and room_id not in room_config.room_list:
+                resumed_rooms: set[str] = get_state(socket, RESUMED_ROOMS_STATE_KEY)
+                if room_id not in resumed_rooms:
+                    resumed_rooms.add(room_id)
+                    await self._replay(socket, resume_from, [f"room:{room_id}"])
             room_config.room_list.add(room_id)
+            _index_add(self.room_index, room_id, socket)
+            if self.presence is not None:
+                self.presence.room_joined(
+                    room_id, str(get_state(socket, self.socket_id_attr, default=""))
+                )
+        if self.presence is not None and not hosted and room_id in self.room_index:
+            self.presence.room_hosted(room_id, True)
+        await self._sync_room_channels([room_id])
 
-    def _leave_sockets(self, sockets: list[WebSocket], room_id: str):
+    async def _leave_sockets(self, sockets: list[WebSocket], room_id: str):
+        hosted = room_id in self.room_index
+        left = False
         for socket in sockets:
             room_config = self.get_room_config(socket)
-            room_config.room_list.remove(room_id)
+            # Leaving a room the socket isn't in (a duplicate leave, say) is a no-op
+            if room_id not in room_config.room_list:
+                continue
+            room_config.room_list.discard(room_id)
+            _index_discard(self.room_index, room_id, socket)
+            left = True
+            if self.presence is not None:
+                self.presence.room_left(
+                    room_id, str(get_state(socket, self.socket_id_attr, default=""))
+                )
+        if not left:
+            return
+        if self.presence is not None and hosted and room_id not in self.room_index:
+            self.presence.room_hosted(room_id, False)
+        await self._sync_room_channels([room_id])
 
-    async def _send_to_sockets(self, sockets: list[WebSocket], message: str):
-        awaitables = [connection.send_text(message) for connection in sockets]
-        await gather(*awaitables, return_exceptions=True)
+    # Subscribes to a room's channel when local membership goes 0 -> 1 and drops it
+    # on 1 -> 0. Reconciling under a lock keeps interleaved joins / leaves consistent.
+    async def _sync_room_channels(self, room_ids: list[str]):
+        if not self.room_channels or len(room_ids) == 0:
+            return
+        async with self.room_channel_lock:
+            for room_id in room_ids:
+                channel = self.get_room_channel(room_id)
+                hosted = room_id in self.room_index
+                subscribed = channel in self.pubsub_instance.channels
+                try:
+                    if hosted and not subscribed:
+                        await self.pubsub_instance.subscribe(channel)
+                    elif subscribed and not hosted:
+                        await self.pubsub_instance.unsubscribe(channel)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logger.warning("Unable to sync room channel %s |%s|", channel, e)
 
-    async def _transmit(self, message: SocketMessage):
+    # Each message is serialized once, and the same frame is queued for every socket
+    async def _send_to_sockets(
+        self, sockets: Iterable[WebSocket], message: str | bytes | OutboundFrame
+    ):
+        writers = self.writers
+        for socket in sockets:
+            writer = writers.get(socket)
+            if writer is not None:
+                writer.enqueue(message)
+
+    def _count_dropped_frame(self, writer: SocketWriter):
+        self.dropped_frames += 1
+
+    def _evict_slow_consumer(self, writer: SocketWriter, reason: str):
+        socket = writer.websocket
+        if not get_state(socket, self.connected_state_attr, default=False):
+            return
+        self.evicted_slow_consumers += 1
+        logger.info(
+            "Evicting websocket client %s: %s",
+            get_state(socket, self.socket_id_attr, default=""),
+            reason,
+        )
+        writer.stop()
+        set_state(socket, self.connected_state_attr, False)
+        self._spawn(self._close_quietly(socket))
+
+    # Stops routing to a socket whose send failed, rather than waiting for its
+    # receive loop to notice
+    def _writer_failed(self, writer: SocketWriter):
+        socket = writer.websocket
+        if self.writers.get(socket) is not writer:
+            return
+        set_state(socket, self.connected_state_attr, False)
+        self._spawn(self._unlink_socket(socket))
+
+    def _spawn(self, coroutine: Coroutine[Any, Any, Any]) -> Task:
+        task = create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def _heartbeat_loop(self):
+        while True:
+            await sleep(self.heartbeat_wheel.tick)
+            for websocket in self.heartbeat_wheel.advance():
+                self._check_heartbeat(websocket)
+
+    def _check_heartbeat(self, websocket: WebSocket):
+        if websocket not in self.active_connections or websocket in self.reaping:
+            return
+        now = monotonic()
+        if (
+            self.idle_timeout is not None
+            and now - self.last_active.get(websocket, now) >= self.idle_timeout
+        ):
+            self._start_reap(websocket, "idle timeout")
+            return
+        last_seen = self.last_seen.get(websocket, now)
+        pinged_at = self.ping_sent.get(websocket)
+        if pinged_at is not None:
+            if last_seen < pinged_at:
+                if now - pinged_at >= self.pong_timeout:
+                    self._start_reap(websocket, "no pong")
+                else:
+                    self.heartbeat_wheel.schedule(
+                        websocket, pinged_at + self.pong_timeout - now
+                    )
+                return
+            del self.ping_sent[websocket]
+        if self.ping_interval is not None and now - last_seen >= self.ping_interval:
+            writer = self.writers.get(websocket)
+            if writer is not None:
+                writer.enqueue(
+                    self.generate_client_frame(
+                        HEARTBEAT_EVENT, None, None, "ping", None
+                    )
+                )
+            self.ping_sent[websocket] = now
+            self.heartbeat_wheel.schedule(websocket, self.pong_timeout)
+            return
+        self._schedule_heartbeat(websocket, now)
+
+    def _schedule_heartbeat(self, websocket: WebSocket, now: float):
+        deadlines = []
+        if self.ping_interval is not None:
+            deadlines.append(self.last_seen.get(websocket, now) + self.ping_interval)
+        if self.idle_timeout is not None:
+            deadlines.append(self.last_active.get(websocket, now) + self.idle_timeout)
+        self.heartbeat_wheel.schedule(websocket, min(deadlines) - now)
+
+    # Dead or idle sockets leave through the same path as a disconnect
+    def _start_reap(self, websocket: WebSocket, reason: str):
+        self.reaping.add(websocket)
+        self._spawn(self._reap(websocket, reason))
+
+    async def _reap(self, websocket: WebSocket, reason: str):
+        try:
+            if websocket not in self.active_connections:
+                return
+            self.reaped_connections += 1
+            logger.info(
+                "Reaping websocket client %s: %s",
+                get_state(websocket, self.socket_id_attr, default=""),
+                reason,
+            )
+            set_state(websocket, self.connected_state_attr, False)
+            await self._unlink_socket(websocket)
+            await self._close_quietly(websocket)
+        finally:
+            self.reaping.discard(websocket)
+
+    async def _record(self, message: SocketMessage):
+        if self.replay_log is None:
+            return
+        if message.route == BROADCAST_EVENT:
+            stream, target = "broadcast", None
+        elif message.route == ROOM_EVENT:
+            stream, target = f"room:{message.target}", message.target
+        else:
+            stream, target = f"client:{message.target}", message.target
+        try:
+            message.sequence = await self.replay_log.append(
+                stream,
+                _client_envelope(
+                    message.route, target, message.sender, message.type, message.data
+                ),
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("Unable to record message for replay |%s|", e)
+
+    # Queues the missed messages ahead of anything new. If part of the gap has been
+    # evicted, the client is told to refresh that stream from the API instead.
+    async def _replay(self, socket: WebSocket, last_seen_id: str, streams: list[str]):
+        writer = self.writers.get(socket)
+        if writer is None or self.replay_log is None:
+            return
+        for stream in streams:
+            try:
+                envelopes, complete = await self.replay_log.read_since(
+                    stream, last_seen_id
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Unable to read replay log |%s|", e)
+                envelopes, complete = [], False
+            if not complete:
+                self._request_refresh(socket, stream)
+            for envelope in envelopes:
+                writer.enqueue(self._frame(envelope))
+            self.replayed_messages += len(envelopes)
+
+    # Tells the client to reload a stream's state from the API, since it can't be replayed
+    def _request_refresh(self, socket: WebSocket, stream: str):
+        writer = self.writers.get(socket)
+        if writer is not None:
+            writer.enqueue(
+                self.generate_client_frame(REPLAY_EVENT, stream, None, "refresh", None)
+            )
+
+    async def _reject(self, websocket: WebSocket, admission: AdmissionControl):
+        retry_after = admission.retry_hint()
+        try:
+            if admission.close_code is None:
+                await websocket.close()
+            else:
+                await websocket.accept()
+                await websocket.close(
+                    code=admission.close_code,
+                    reason=dumps({"retry_after": retry_after}),
+                )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.debug("Unable to close rejected websocket |%s|", e)
+        raise CruddyAdmissionRejectedException(retry_after)
+
+    async def _close_quietly(self, socket: WebSocket):
+        try:
+            await wait_for(socket.close(), self.send_timeout)
+        except Exception:  # pylint: disable=broad-exception-caught
+            pass
+
+    async def _deliver(
+        self,
+        sockets: Iterable[WebSocket],
+        route: str,
+        target: str | None,
+        message: SocketMessage,
+    ):
         await self._send_to_sockets(
-            sockets=self.active_connections,
-            message=self.generate_client_message(
-                BROADCAST_EVENT,
-                None,
+            sockets=sockets,
+            message=self.generate_client_frame(
+                route,
+                target,
                 message.sender,
                 message.type,
-                to_json_object(message.data),
+                message.data,
+                message.sequence,
             ),
         )
 
+    async def _transmit(self, message: SocketMessage):
+        if len(self.active_connections) == 0:
+            return
+        await self._deliver(
+            list(self.active_connections), BROADCAST_EVENT, None, message
+        )
+
     async def _route_to_socket_id(self, message: SocketMessage):
         sockets = self.get_sockets_by_id(id=str(message.target))
         if len(sockets) == 0:
             return
-        await self._send_to_sockets(
-            sockets=sockets,
-            message=self.generate_client_message(
-                CLIENT_EVENT,
-                message.target,
-                message.sender,
-                message.type,
-                to_json_object(message.data),
-            ),
-        )
+        await self._deliver(sockets, CLIENT_EVENT, message.target, message)
 
     async def _route_to_client_id(self, message: SocketMessage):
         sockets = self.get_sockets_by_client_id(id=str(message.target))
         if len(sockets) == 0:
             return
-        await self._send_to_sockets(
-            sockets=sockets,
-            message=self.generate_client_message(
-                CLIENT_EVENT,
-                message.target,
-                message.sender,
-                message.type,
-                to_json_object(message.data),
-            ),
-        )
+        await self._deliver(sockets, CLIENT_EVENT, message.target, message)
+
+    async def _route_multicast(self, message: SocketMessage):
+        route = message.target
+        if route == "room":
+            index, client_route = self.room_index, ROOM_EVENT
+        elif route == "client" and self.custom_client_identifier is not None:
+            index, client_route = self.client_index, CLIENT_EVENT
+        else:
+            index, client_route = self.socket_index, CLIENT_EVENT
+        targets = message.targets or []
+        # Walk whichever side is smaller
+        if len(targets) > len(index):
+            wanted = set(targets)
+            matches = [target for target in index if target in wanted]
+        else:
+            matches = [target for target in targets if target in index]
+        # Each socket gets the message once, framed for the first target it matched
+        delivered: set[WebSocket] = set()
+        for target in matches:
+            sockets = [socket for socket in index[target] if socket not in delivered]
+            if len(sockets) == 0:
+                continue
+            delivered.update(sockets)
+            await self._deliver(sockets, client_route, target, message)
 
     async def _route_to_room(self, message: SocketMessage):
-        sockets = self.get_sockets_by_room(room_id=str(message.target))
-        if len(sockets) == 0:
+        room_id = str(message.target)
+        if room_id not in self.room_index:
             return
-        await self._send_to_sockets(
-            sockets=sockets,
-            message=self.generate_client_message(
+        policy = None if self.room_coalescing is None else self.room_coalescing(room_id)
+        if policy is not None:
+            self._coalesce(room_id, policy, message)
+            return
+        await self._deliver(
+            self.get_sockets_by_room(room_id), ROOM_EVENT, message.target, message
+        )
+
+    def _coalesce(self, room_id: str, policy: CoalescePolicy, message: SocketMessage):
+        batch = self.coalesced.get(room_id)
+        if batch is None:
+            batch = self.coalesced[room_id] = []
+            self.coalesce_timers[room_id] = create_task(
+                self._flush_coalesced(room_id, policy)
+            )
+        batch.append(
+            _client_envelope(
                 ROOM_EVENT,
                 message.target,
                 message.sender,
                 message.type,
-                to_json_object(message.data),
-            ),
+                message.data,
+                message.sequence,
+            )
         )
+
+    # The window's messages go out as one array frame, serialized once for the whole room
+    async def _flush_coalesced(self, room_id: str, policy: CoalescePolicy):
+        await sleep(policy.window)
+        self.coalesce_timers.pop(room_id, None)
+        batch = self.coalesced.pop(room_id, [])
+        if policy.dedupe_by_type:
+            batch = _latest_by_type(batch)
+        sockets = self.get_sockets_by_room(room_id)
+        if len(batch) == 0 or len(sockets) == 0:
+            return
+        await self._send_to_sockets(sockets, self._frame(batch))
+
+
+# Keeps the latest envelope of each type, ordered by when that latest one arrived
+def _latest_by_type(envelopes: list[dict]) -> list[dict]:
+    latest: dict[Any, dict] = {}
+    for envelope in envelopes:
+        latest.pop(envelope["type"], None)
+        latest[envelope["type"]] = envelope
+    return list(latest.values())
+
+
+def _client_envelope(
+    route: str,
+    target: str | None,
+    sender: str | None,
+    type: str | None,
+    data: Any,
+    id: str | None = None,
+) -> dict:
+    envelope = {
+        "route": route,
+        "target": target,
+        "sender": sender,
+        "type": type,
+        "data": data,
+    }
+    if id is not None:
+        envelope["id"] = id
+    return envelope
+
+
+def _is_pong(data: Any) -> bool:
+    return (
+        isinstance(data, dict)
+        and data.get("route") == HEARTBEAT_EVENT
+        and data.get("type") == "pong"
+    )
+
+
+def _index_add(index: dict[Any, dict[WebSocket, None]], key: Any, socket: WebSocket):
+    bucket = index.get(key)
+    if bucket is None:
+        bucket = index[key] = {}
+    bucket[socket] = None
+
+
+def _index_discard(
+    index: dict[Any, dict[WebSocket, None]], key: Any, socket: WebSocket
+):
+    bucket = index.get(key)
+    if bucket is None:
+        return
+    bucket.pop(socket, None)
+    if len(bucket) == 0:
+        del index[key]
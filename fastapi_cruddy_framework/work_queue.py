@@ -0,0 +1,279 @@
+from __future__ import annotations
+from typing import Any, TYPE_CHECKING
+from asyncio import CancelledError, Semaphore, Task, create_task, gather, sleep
+from collections.abc import Awaitable, Callable, Iterable
+from json import dumps, loads
+from logging import getLogger
+from time import monotonic
+from uuid import uuid4
+from .adapters import RedisAdapter
+from .schemas import DRAIN_EVENT, HEARTBEAT_EVENT, LIVE_QUERY_EVENT, REPLAY_EVENT
+from .util import json_serial
+
+if TYPE_CHECKING:
+    from .websocket_manager import WebsocketConnectionManager
+
+logger = getLogger(__name__)
+# Routes the framework answers itself, on the node holding the socket
+FRAMEWORK_ROUTES = frozenset(
+    {DRAIN_EVENT, HEARTBEAT_EVENT, LIVE_QUERY_EVENT, REPLAY_EVENT}
+)
+
+
+class WorkItem:
+    id: str
+    socket_id: str
+    # A client id when the manager has a custom_client_identifier, else the socket id
+    reply_to: str
+    data: dict
+    attempts: int
+
+    def __init__(
+        self,
+        id: str,  # pylint: disable=redefined-builtin
+        socket_id: str,
+        reply_to: str,
+        data: dict,
+        attempts: int = 1,
+    ):
+        self.id = id
+        self.socket_id = socket_id
+        self.reply_to = reply_to
+        self.data = data
+        self.attempts = attempts
+
+
+# -------------------------------------------------------------------------------------------
+# CLUSTER-WIDE INBOUND WORK QUEUE (ONE PER MANAGER, SHARED STREAM PER CLUSTER)
+# -------------------------------------------------------------------------------------------
+class StreamWorkQueue:
+    handler: Callable[[WorkItem], Awaitable[Any]]
+    redis_adapter: RedisAdapter | None
+    stream: str
+    group: str
+    consumer: str
+    types: set[str] | None
+    concurrency: Semaphore
+    batch_size: int
+    block: float
+    claim_idle: float
+    max_attempts: int
+    maxlen: int
+    websocket_manager: "WebsocketConnectionManager | None"
+    running: bool
+    tasks: list[Task]
+    in_flight: set[Task]
+    enqueued: int
+    processed: int
+    failed: int
+    retried: int
+    dead_lettered: int
+
+    def __init__(
+        self,
+        # Runs on whichever node claims the message. A non-None result is sent back to
+        # the sender with direct_message, using the message's type.
+        handler: Callable[[WorkItem], Awaitable[Any]],
+        # Defaults to the manager's pubsub redis
+        redis_adapter: RedisAdapter | None = None,
+        stream: str = "cruddy:work",
+        group: str = "cruddy_workers",
+        consumer: str | None = None,
+        # Message types sent through the queue. None sends every client message, except
+        # framework routes (live queries, heartbeats, ...), which are always handled locally.
+        types: Iterable[str] | None = None,
+        # Handlers running on this node at once
+        concurrency: int = 16,
+        batch_size: int = 10,
+        # Seconds each read blocks waiting for new entries
+        block: float = 1,
+        # Unacknowledged entries idle this long are reclaimed and retried by any node
+        claim_idle: float = 30,
+        # Deliveries before an entry is moved to "<stream>:dead"
+        max_attempts: int = 5,
+        maxlen: int = 100000,
+    ):
+        self.handler = handler
+        self.redis_adapter = redis_adapter
+        self.stream = stream
+        self.group = group
+        self.consumer = f"{uuid4()}" if consumer is None else consumer
+        self.types = None if types is None else set(types)
+        self.concurrency = Semaphore(concurrency)
+        self.batch_size = batch_size
+        self.block = block
+        self.claim_idle = claim_idle
+        self.max_attempts = max_attempts
+        self.maxlen = maxlen
+        self.websocket_manager = None
+        self.running = False
+        self.tasks = []
+        self.in_flight = set()
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "in_flight": len(self.in_flight),
+        }
+
+    def accepts(self, data: dict) -> bool:
+        if data.get("route") in FRAMEWORK_ROUTES:
+            return False
+        return self.types is None or data.get("type") in self.types
+
+    def get_client(self):
+        if self.redis_adapter is None:
+            raise RuntimeError("StreamWorkQueue needs a redis_adapter")
+        return self.redis_adapter.get_client()
+
+    async def startup(self, websocket_manager: "WebsocketConnectionManager"):
+        self.websocket_manager = websocket_manager
+        if self.redis_adapter is None:
+            self.redis_adapter = websocket_manager.pubsub_instance.redis_client
+        try:
+            await self.get_client().xgroup_create(
+                self.stream, self.group, id="0", mkstream=True
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Another node already created the group
+            if "BUSYGROUP" not in str(e):
+                raise
+        self.running = True
+        self.tasks = [create_task(self._read_loop()), create_task(self._claim_loop())]
+
+    # Unacknowledged work is left pending, so another node reclaims it
+    async def dispose(self):
+        # The flag ends the loops even if a redis call swallows the cancellation
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        await gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await gather(*self.in_flight, return_exceptions=True)
+
+    async def enqueue(self, socket_id: str, reply_to: str, data: dict) -> str:
+        entry_id = await self.get_client().xadd(
+            self.stream,
+            {
+                "m": dumps(
+                    {"socket_id": socket_id, "reply_to": reply_to, "data": data},
+                    default=json_serial,
+                )
+            },
+            maxlen=self.maxlen,
+            approximate=True,
+        )
+        self.enqueued += 1
+        return _text(entry_id)
+
+    async def _read_loop(self):
+        while self.running:
+            started = monotonic()
+            try:
+                response = await self.get_client().xreadgroup(
+                    self.group,
+                    self.consumer,
+                    {self.stream: ">"},
+                    count=self.batch_size,
+                    block=int(self.block * 1000),
+                )
+            except CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Unable to read work queue |%s|", e)
+                await sleep(self.block)
+                continue
+            for _, entries in response or []:
+                for entry_id, fields in entries:
+                    await self._start(_text(entry_id), fields, 1)
+            if not response:
+                # Servers (and fakes) that don't honor BLOCK would otherwise spin
+                await sleep(max(0, self.block - (monotonic() - started)))
+
+    async def _claim_loop(self):
+        while self.running:
+            await sleep(self.claim_idle / 2)
+            try:
+                await self.claim()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Unable to reclaim work queue entries |%s|", e)
+
+    # Takes over entries another consumer (possibly a dead node) never acknowledged
+    async def claim(self):
+        client = self.get_client()
+        _, entries, *_ = await client.xautoclaim(
+            self.stream,
+            self.group,
+            self.consumer,
+            min_idle_time=int(self.claim_idle * 1000),
+            start_id="0-0",
+            count=self.batch_size,
+        )
+        for entry_id, fields in entries:
+            entry_id = _text(entry_id)
+            if not fields:
+                # Trimmed from the stream (maxlen) while pending
+                await client.xack(self.stream, self.group, entry_id)
+                continue
+            pending = await client.xpending_range(
+                self.stream, self.group, min=entry_id, max=entry_id, count=1
+            )
+            attempts = pending[0]["times_delivered"] if pending else 1
+            if attempts > self.max_attempts:
+                await self._dead_letter(entry_id, fields)
+                continue
+            self.retried += 1
+            await self._start(entry_id, fields, attempts)
+
+    async def _start(self, entry_id: str, fields: dict, attempts: int):
+        await self.concurrency.acquire()
+        task = create_task(self._process(entry_id, fields, attempts))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    async def _process(self, entry_id: str, fields: dict, attempts: int):
+        try:
+            payload = loads(fields.get(b"m", fields.get("m")))
+            item = WorkItem(
+                id=entry_id,
+                socket_id=payload["socket_id"],
+                reply_to=payload["reply_to"],
+                data=payload["data"],
+                attempts=attempts,
+            )
+            result = await self.handler(item)
+            if result is not None and self.websocket_manager is not None:
+                await self.websocket_manager.direct_message(
+                    target=item.reply_to,
+                    type=f"{item.data.get('type', '')}",
+                    data=result,
+                )
+            await self.get_client().xack(self.stream, self.group, entry_id)
+            self.processed += 1
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.failed += 1
+            logger.warning("Work queue handler failed for %s |%s|", entry_id, e)
+        finally:
+            self.concurrency.release()
+
+    async def _dead_letter(self, entry_id: str, fields: dict):
+        pipe = self.get_client().pipeline(transaction=True)
+        pipe.xadd(f"{self.stream}:dead", fields, maxlen=self.maxlen, approximate=True)
+        pipe.xack(self.stream, self.group, entry_id)
+        await pipe.execute()
+        self.dead_lettered += 1
+        logger.warning("Work queue entry %s exceeded its attempts", entry_id)
+
+
+def _text(value: str | bytes) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
@@ -0,0 +1,124 @@
+from asyncio import gather, sleep
+from pytest import mark
+from fastapi import status
+from sqlalchemy.sql import update
+from fastapi_cruddy_framework import (
+    BrowserTestClient,
+    CruddyCache,
+    CruddyResourceRegistry,
+    RepositoryCache,
+    UUID,
+)
+
+group_id = None
+
+
+def _group_cache() -> RepositoryCache:
+    cache = CruddyResourceRegistry.get_repository_by_name("Group").cache
+    assert cache is not None
+    return cache
+
+
+async def _rename_behind_the_cache(name: str):
+    # Writes straight through the adapter never touch the repository cache
+    repository = CruddyResourceRegistry.get_repository_by_name("Group")
+    async with repository.adapter.getSession() as session:
+        await session.execute(
+            update(repository.model)
+            .where(repository.model.id == UUID(group_id))  # type: ignore
+            .values(name=name)
+        )
+
+
+@mark.dependency()
+async def test_create_group(authenticated_client: BrowserTestClient):
+    global group_id
+    response = await authenticated_client.post(
+        f"/groups",
+        json={"group": {"name": "Bree Regulars"}},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    group_id = response.json()["group"]["id"]
+
+
+@mark.dependency(depends=["test_create_group"])
+async def test_reads_are_cached(authenticated_client: BrowserTestClient):
+    global group_id
+    cache = _group_cache()
+    hits = cache.hits
+    response = await authenticated_client.get(f"/groups/{group_id}")
+    assert response.json()["group"]["name"] == "Bree Regulars"
+    where = f'{{"id":"{group_id}"}}'
+    response = await authenticated_client.get(f"/groups?where={where}")
+    assert response.json()["groups"][0]["name"] == "Bree Regulars"
+
+    await _rename_behind_the_cache("Prancing Pony Regulars")
+
+    response = await authenticated_client.get(f"/groups/{group_id}")
+    assert response.json()["group"]["name"] == "Bree Regulars"
+    response = await authenticated_client.get(f"/groups?where={where}")
+    assert response.json()["groups"][0]["name"] == "Bree Regulars"
+    assert cache.hits >= hits + 2
+
+
+@mark.dependency(depends=["test_reads_are_cached"])
+async def test_writes_invalidate(authenticated_client: BrowserTestClient):
+    global group_id
+    response = await authenticated_client.patch(
+        f"/groups/{group_id}", json={"group": {"name": "Green Dragon Regulars"}}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    response = await authenticated_client.get(f"/groups/{group_id}")
+    assert response.json()["group"]["name"] == "Green Dragon Regulars"
+    where = f'{{"id":"{group_id}"}}'
+    response = await authenticated_client.get(f"/groups?where={where}")
+    assert response.json()["groups"][0]["name"] == "Green Dragon Regulars"
+
+
+@mark.dependency(depends=["test_writes_invalidate"])
+async def test_remote_invalidation(authenticated_client: BrowserTestClient):
+    global group_id
+    cache = _group_cache()
+    assert cache.policy.cache is not None
+    await _rename_behind_the_cache("Golden Perch Regulars")
+    response = await authenticated_client.get(f"/groups/{group_id}")
+    assert response.json()["group"]["name"] == "Green Dragon Regulars"
+
+    # Another worker, sharing redis, wrote to this resource
+    shared = cache.policy.cache
+    other_worker = CruddyCache(
+        redis_adapter=shared.redis_adapter,
+        redis_channel=shared.pubsub_instance.channel,
+    )
+    await other_worker.invalidate(cache.namespace)
+    for _ in range(100):
+        if len(cache.entries) == 0:
+            break
+        await sleep(0.05)
+    response = await authenticated_client.get(f"/groups/{group_id}")
+    assert response.json()["group"]["name"] == "Golden Perch Regulars"
+
+
+@mark.dependency(depends=["test_remote_invalidation"])
+async def test_concurrent_reads_coalesce():
+    global group_id
+    repository = CruddyResourceRegistry.get_repository_by_name("Group")
+    single_flight = repository.single_flight
+    assert single_flight is not None
+    executed = single_flight.stats["executed"]
+    coalesced = single_flight.stats["coalesced"]
+    # A query shape nobody has cached yet
+    where = {"id": group_id, "name": {"*neq": "Bag End"}}
+    results = await gather(*[repository.get_all(where=where) for _ in range(10)])
+    assert all(result.data == results[0].data for result in results)
+    assert single_flight.stats["executed"] == executed + 1
+    assert single_flight.stats["coalesced"] == coalesced + 9
+
+
+@mark.dependency(depends=["test_concurrent_reads_coalesce"])
+async def test_cleanup(authenticated_client: BrowserTestClient):
+    global group_id
+    response = await authenticated_client.delete(f"/groups/{group_id}")
+    assert response.status_code == status.HTTP_200_OK
+    response = await authenticated_client.get(f"/groups/{group_id}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
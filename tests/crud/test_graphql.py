@@ -1,6 +1,6 @@
 from pytest import mark
 from fastapi import status
-from fastapi_cruddy_framework import BrowserTestClient, uuid7
+from fastapi_cruddy_framework import BrowserTestClient, uuid7, encode_cursor
 
 elves_group_id = None
 orcs_group_id = None
@@ -298,6 +298,185 @@ async def test_graphql_read(authenticated_client: BrowserTestClient):
 
 
 @mark.dependency(depends=["test_graphql_read"])
+async def test_graphql_batched_read(authenticated_client: BrowserTestClient):
+    global user_id
+    global orcs_group_id
+
+    response = await authenticated_client.post(
+        f"/graphql",
+        json=[
+            {"query": f"""query BatchUser {{
+                users(id: "{user_id}") {{
+                    id
+                    groups {{
+                        id
+                    }}
+                }}
+            }}"""},
+            {"query": f"""query BatchGroup {{
+                groups(id: "{orcs_group_id}") {{
+                    id
+                    users {{
+                        id
+                    }}
+                }}
+            }}"""},
+        ],
+    )
+    assert response.status_code == status.HTTP_200_OK
+    result = response.json()
+    assert isinstance(result, list)
+    assert len(result) == 2
+    assert result[0]["data"]["users"][0]["id"] == user_id
+    assert result[1]["data"]["groups"][0]["id"] == orcs_group_id
+    assert user_id in [x["id"] for x in result[1]["data"]["groups"][0]["users"]]
+
+
+@mark.dependency(depends=["test_graphql_batched_read"])
+async def test_graphql_connection(authenticated_client: BrowserTestClient):
+    global user_id
+    global post_id
+
+    extra_user_ids = []
+    for name in ["Elf", "Dwarf"]:
+        response = await authenticated_client.post(
+            f"/users",
+            json={
+                "user": {
+                    "first_name": name,
+                    "last_name": "Pager",
+                    "email": f"{name.lower()}.pager@cruddy-framework.com",
+                    "is_active": True,
+                    "is_superuser": False,
+                    "birthdate": "2023-07-22T14:43:31.038Z",
+                    "phone": "888-555-5555",
+                    "state": "Rivendell",
+                    "country": "Middle Earth",
+                    "address": "1 Paging Way",
+                    "password": "pagingisfun",
+                }
+            },
+        )
+        assert response.status_code == status.HTTP_200_OK
+        extra_user_ids.append(response.json()["user"]["id"])
+
+    response = await authenticated_client.get(
+        "/users?limit=100&sort=email asc&sort=id asc"
+    )
+    assert response.status_code == status.HTTP_200_OK
+    ordered_ids = [x["id"] for x in response.json()["users"]]
+    assert len(ordered_ids) >= 2
+
+    async def get_connection(arguments: str):
+        response = await authenticated_client.post(
+            f"/graphql",
+            json={"query": f"""query TestConnection {{
+                users_connection({arguments}) {{
+                    totalCount
+                    edges {{
+                        cursor
+                        node {{
+                            id
+                        }}
+                    }}
+                    pageInfo {{
+                        hasNextPage
+                        hasPreviousPage
+                        startCursor
+                        endCursor
+                    }}
+                }}
+            }}"""},
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return response.json()["data"]["users_connection"]
+
+    first_page = await get_connection('first: 1, sort: ["email asc"]')
+    assert first_page["totalCount"] == len(ordered_ids)
+    assert [x["node"]["id"] for x in first_page["edges"]] == ordered_ids[:1]
+    assert first_page["pageInfo"]["hasNextPage"] == True
+    assert first_page["pageInfo"]["hasPreviousPage"] == False
+
+    end_cursor = first_page["pageInfo"]["endCursor"]
+    second_page = await get_connection(
+        f'first: 100, after: "{end_cursor}", sort: ["email asc"]'
+    )
+    assert [x["node"]["id"] for x in second_page["edges"]] == ordered_ids[1:]
+    assert second_page["pageInfo"]["hasNextPage"] == False
+    assert second_page["pageInfo"]["hasPreviousPage"] == True
+
+    last_page = await get_connection('last: 1, sort: ["email asc"]')
+    assert [x["node"]["id"] for x in last_page["edges"]] == ordered_ids[-1:]
+    assert last_page["pageInfo"]["hasPreviousPage"] == True
+
+    start_cursor = second_page["pageInfo"]["startCursor"]
+    previous_page = await get_connection(
+        f'last: 1, before: "{start_cursor}", sort: ["email asc"]'
+    )
+    assert [x["node"]["id"] for x in previous_page["edges"]] == ordered_ids[:1]
+    assert previous_page["pageInfo"]["hasPreviousPage"] == False
+    assert previous_page["pageInfo"]["hasNextPage"] == True
+
+    response = await authenticated_client.post(
+        f"/graphql",
+        json={"query": f"""query TestRelationConnection {{
+            users(id: "{user_id}") {{
+                posts_connection(first: 1) {{
+                    edges {{
+                        node {{
+                            id
+                        }}
+                    }}
+                }}
+            }}
+        }}"""},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    result = response.json()
+    edges = result["data"]["users"][0]["posts_connection"]["edges"]
+    assert [x["node"]["id"] for x in edges] == [post_id]
+
+    response = await authenticated_client.get("/users?after=not-a-cursor")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # An empty "after" cursor is the end of the set, not the start
+    response = await authenticated_client.get(
+        f"/users?sort=email asc&after={encode_cursor({})}"
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["users"] == []
+
+    for bad_cursor in (
+        {"email": "a@b.c", "id": ordered_ids[0], "password": "x"},
+        {"email": "a@b.c", "id": {"$gt": 1}},
+        {"email": "a@b.c"},
+        {"email": "a@b.c", "id": "not-a-uuid"},
+    ):
+        response = await authenticated_client.get(
+            f"/users?sort=email asc&after={encode_cursor(bad_cursor)}"
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = await authenticated_client.post(
+        f"/graphql",
+        json={"query": """query TestConnection {
+            users_connection(first: 1, last: 1) {
+                totalCount
+            }
+        }"""},
+    )
+    assert (
+        "first and last cannot be combined" in response.json()["errors"][0]["message"]
+    )
+
+    for extra_user_id in extra_user_ids:
+        response = await authenticated_client.delete(
+            f"/users/purge/{extra_user_id}?confirm=Y"
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+
+@mark.dependency(depends=["test_graphql_connection"])
 async def test_cleanup(authenticated_client: BrowserTestClient):
     global elves_group_id
     global orcs_group_id
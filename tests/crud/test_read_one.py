@@ -113,10 +113,72 @@ async def test_get_post_by_id(authenticated_client: BrowserTestClient):
     assert result["post"]["content"] == "Has anyone seen Frodo lately?"
 
 
+@mark.dependency(depends=["test_get_post_by_id"])
+async def test_conditional_get(authenticated_client: BrowserTestClient):
+    global group_id
+    global user_id
+    response = await authenticated_client.get(f"/groups/{group_id}")
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+    assert etag.startswith('"')
+
+    response = await authenticated_client.get(
+        f"/groups/{group_id}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    # Answered by the light version lookup
+    response = await authenticated_client.get(
+        f"/groups/{group_id}", headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers["last-modified"] == last_modified
+
+    response = await authenticated_client.get(
+        f"/groups/{group_id}",
+        headers={"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["group"]["id"] == group_id
+
+    response = await authenticated_client.get(f"/users/{user_id}/posts")
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers["etag"]
+    response = await authenticated_client.get(
+        f"/users/{user_id}/posts", headers={"If-None-Match": f'"stale", W/{etag}'}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    response = await authenticated_client.get(f"/groups")
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers["etag"]
+    response = await authenticated_client.get(
+        f"/groups", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    response = await authenticated_client.patch(
+        f"/groups/{group_id}", json={"group": {"name": "Followers Anonymous II"}}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    # The list changed, so its old ETag no longer matches
+    response = await authenticated_client.get(
+        f"/groups", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+    response = await authenticated_client.patch(
+        f"/groups/{group_id}", json={"group": {"name": "Followers Anonymous"}}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+
 # The below functions are mainly cleanup based on the create functions above
 
 
-@mark.dependency(depends=["test_get_post_by_id"])
+@mark.dependency(depends=["test_conditional_get"])
 async def test_cleanup(authenticated_client: BrowserTestClient):
     global user_id
     global post_id
@@ -0,0 +1,93 @@
+from asyncio import Event, gather, sleep
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from uuid import UUID
+from pytest import mark, raises
+from sqlalchemy.engine.result import result_tuple
+from fastapi_cruddy_framework import JsonCacheCodec, PickleCacheCodec, SingleFlight
+
+
+@mark.dependency()
+async def test_single_flight_shares_one_load():
+    single_flight = SingleFlight()
+    release = Event()
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return {"id": 1}
+
+    async def open_gate():
+        await sleep(0.01)
+        release.set()
+
+    results = await gather(
+        *[single_flight.do("key", loader) for _ in range(5)], open_gate()
+    )
+    assert calls == 1
+    assert results[:5] == [{"id": 1}] * 5
+    assert single_flight.stats == {
+        "executed": 1,
+        "coalesced": 4,
+        "timeouts": 0,
+        "in_flight": 0,
+    }
+
+
+@mark.dependency()
+async def test_single_flight_shares_failures():
+    single_flight = SingleFlight()
+
+    async def loader():
+        await sleep(0.01)
+        raise ValueError("database exploded")
+
+    results = await gather(
+        *[single_flight.do("key", loader) for _ in range(3)], return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    assert single_flight.stats["executed"] == 1
+    with raises(ValueError):
+        await single_flight.do("key", loader)
+
+
+@mark.dependency()
+async def test_single_flight_max_wait():
+    single_flight = SingleFlight(max_wait=0.01)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        call = calls
+        await sleep(0.1 if call == 1 else 0)
+        return call
+
+    results = await gather(
+        single_flight.do("key", loader), single_flight.do("key", loader)
+    )
+    # The follower gave up waiting and ran its own query
+    assert results == [1, 2]
+    assert single_flight.stats["timeouts"] == 1
+
+
+def test_json_cache_codec_round_trips_rows():
+    codec = JsonCacheCodec()
+    row = result_tuple(["id", "created_at", "born", "price", "settings"])(
+        (
+            UUID("06ad56f3-ec3a-7f9e-8000-d8c7154334af"),
+            datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc),
+            date(1990, 9, 22),
+            Decimal("10.50"),
+            {"theme": "dark", "$row": 1, 2: ["x"]},
+        )
+    )
+    value = codec.decode(codec.encode((1, [row])))
+    assert value == (1, [row])
+    assert value[1][0].created_at == row.created_at
+    assert value[1][0]._mapping == row._mapping
+    # A pickled entry is rejected, never executed
+    with raises(Exception):
+        codec.decode(PickleCacheCodec().encode((1, [row])))
@@ -0,0 +1,61 @@
+from pytest import raises
+from fastapi_cruddy_framework import compile_where
+
+ROWS = [
+    {
+        "id": "1",
+        "name": "Bilbo Baggins",
+        "age": 111,
+        "home": None,
+        "born": "2890-09-22T00:00:00+00:00",
+        "tags": ["ring", "burglar"],
+        "data": {"pipe": {"weed": "Old Toby"}},
+    },
+    {
+        "id": "2",
+        "name": "Frodo Baggins",
+        "age": 33,
+        "home": "Bag End",
+        "born": "2968-09-22T00:00:00+00:00",
+        "tags": ["ring"],
+        "data": {},
+    },
+    {
+        "id": "3",
+        "name": "Samwise Gamgee",
+        "age": 38,
+        "home": "Bagshot Row",
+        "born": "2980-04-06T00:00:00+00:00",
+        "tags": [],
+        "data": {"pipe": {"weed": "Longbottom Leaf"}},
+    },
+]
+
+
+def _matches(where) -> list[str]:
+    predicate = compile_where(where)
+    return [row["id"] for row in ROWS if predicate(row)]
+
+
+def test_compile_where():
+    assert _matches(None) == ["1", "2", "3"]
+    assert _matches({"name": "% Baggins"}) == ["1", "2"]
+    assert _matches({"name": "% baggins"}) == []
+    assert _matches({"name": {"*ilike": "% baggins"}}) == ["1", "2"]
+    assert _matches({"age": 33}) == ["2"]
+    assert _matches({"age": {"*gte": 38}}) == ["1", "3"]
+    assert _matches([{"age": {"*gt": 30}}, {"age": {"*lt": 100}}]) == ["2", "3"]
+    assert _matches({"*or": [{"age": 33}, {"name": "Sam%"}]}) == ["2", "3"]
+    assert _matches({"*not": {"age": 33}}) == ["1", "3"]
+    assert _matches({"id": {"*in_": [1, 3]}}) == ["1", "3"]
+    # NULL only matches IS / IS NOT, like SQL
+    assert _matches({"home": {"*neq": "Bag End"}}) == ["3"]
+    assert _matches({"home": {"*eq": None}}) == ["1"]
+    assert _matches({"home": {"*startswith": "Bag"}}) == ["2", "3"]
+    assert _matches({"tags": {"*contains": "burglar"}}) == ["1"]
+    assert _matches({"born": {"*lt": {"*datetime": "2900-01-01T00:00:00Z"}}}) == ["1"]
+    assert _matches({"data.pipe.weed": {"*eq": "Old Toby"}}) == ["1"]
+    with raises(ValueError):
+        compile_where({"name:VARCHAR": "x"})
+    with raises(ValueError):
+        compile_where({"name": {"*websearch_to_tsquery": "x"}})
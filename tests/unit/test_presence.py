@@ -0,0 +1,126 @@
+from fastapi_cruddy_framework import PresenceRegistry, RedisAdapter
+
+
+async def test_presence_queries_span_nodes():
+    redis_adapter = RedisAdapter(mode="memory")
+    namespace = "test:presence:queries"
+    rivendell = PresenceRegistry(redis_adapter=redis_adapter, namespace=namespace)
+    lorien = PresenceRegistry(redis_adapter=redis_adapter, namespace=namespace)
+    await rivendell.startup()
+    await lorien.startup()
+
+    rivendell.socket_connected("s1", "elrond")
+    rivendell.socket_connected("s2", "arwen")
+    lorien.socket_connected("s3", "arwen")
+    rivendell.room_joined("council", "s1")
+    rivendell.room_hosted("council", True)
+    lorien.room_joined("council", "s3")
+    lorien.room_hosted("council", True)
+    lorien.room_joined("mirror", "s3")
+    lorien.room_hosted("mirror", True)
+    await lorien.flush()
+
+    assert await rivendell.count_online() == 3
+    assert sorted(await rivendell.get_room_members("council")) == ["s1", "s3"]
+    assert await rivendell.find_nodes_for_client("arwen") == {
+        rivendell.node_id,
+        lorien.node_id,
+    }
+    assert await rivendell.find_nodes_for_socket("s3") == {lorien.node_id}
+    assert await rivendell.get_room_list() == {"council", "mirror"}
+
+    rivendell.socket_disconnected("s2", "arwen")
+    await rivendell.flush()
+    assert await lorien.find_nodes_for_client("arwen") == {lorien.node_id}
+    assert await lorien.count_online() == 2
+
+    await rivendell.dispose()
+    await lorien.dispose()
+    assert await rivendell.count_online() == 0
+    assert await rivendell.get_room_members("council") == []
+
+
+async def test_dead_nodes_are_reaped():
+    redis_adapter = RedisAdapter(mode="memory")
+    namespace = "test:presence:reap"
+    survivor = PresenceRegistry(
+        redis_adapter=redis_adapter, namespace=namespace, node_ttl=15
+    )
+    crashed = PresenceRegistry(redis_adapter=redis_adapter, namespace=namespace)
+    await survivor.heartbeat()
+    crashed.socket_connected("s1", "boromir")
+    crashed.room_joined("fellowship", "s1")
+    crashed.room_hosted("fellowship", True)
+    await crashed.flush()
+    # Its last heartbeat was long ago
+    await redis_adapter.get_client().zadd(crashed.key("nodes"), {crashed.node_id: 0})
+    assert await survivor.count_online() == 1
+
+    assert await survivor.reap_dead_nodes() == [crashed.node_id]
+    assert await survivor.count_online() == 0
+    assert await survivor.get_room_members("fellowship") == []
+    assert await survivor.find_nodes_for_client("boromir") == set()
+    assert await survivor.get_room_list() == set()
+    assert await survivor.get_nodes() == [survivor.node_id]
+
+
+async def test_reused_socket_ids_map_to_every_node():
+    redis_adapter = RedisAdapter(mode="memory")
+    namespace = "test:presence:reused"
+    rivendell = PresenceRegistry(redis_adapter=redis_adapter, namespace=namespace)
+    lorien = PresenceRegistry(redis_adapter=redis_adapter, namespace=namespace)
+
+    # An app-supplied socket id, open in two tabs on one node and one on another
+    rivendell.socket_connected("gandalf", "mithrandir")
+    rivendell.socket_connected("gandalf", "mithrandir")
+    lorien.socket_connected("gandalf", "mithrandir")
+    await lorien.flush()
+    assert await rivendell.find_nodes_for_socket("gandalf") == {
+        rivendell.node_id,
+        lorien.node_id,
+    }
+
+    # Closing one of the two local tabs keeps the node's entries
+    rivendell.socket_disconnected("gandalf", "mithrandir")
+    assert await rivendell.find_nodes_for_socket("gandalf") == {
+        rivendell.node_id,
+        lorien.node_id,
+    }
+    assert await rivendell.find_nodes_for_client("mithrandir") == {
+        rivendell.node_id,
+        lorien.node_id,
+    }
+    rivendell.socket_disconnected("gandalf", "mithrandir")
+    assert await rivendell.find_nodes_for_socket("gandalf") == {lorien.node_id}
+
+    await lorien.reap(lorien.node_id)
+    assert await rivendell.find_nodes_for_socket("gandalf") == set()
+
+
+async def test_routing_lookups_read_node_sets():
+    redis_adapter = RedisAdapter(mode="memory")
+    namespace = "test:presence:nodes"
+    shire = PresenceRegistry(redis_adapter=redis_adapter, namespace=namespace)
+    bree = PresenceRegistry(redis_adapter=redis_adapter, namespace=namespace)
+    for n in range(50):
+        shire.socket_connected(f"hobbit{n}", "hobbits")
+        shire.room_joined("party", f"hobbit{n}")
+    bree.socket_connected("strider", "rangers")
+    bree.room_joined("party", "strider")
+    await shire.flush()
+    await bree.flush()
+
+    client = redis_adapter.get_client()
+    # One entry per node, however many sockets it holds
+    assert await client.scard(shire.key("room_nodes", "party")) == 2
+    assert await client.scard(shire.key("client", "hobbits")) == 1
+    assert await bree.find_nodes_for_room("party") == {shire.node_id, bree.node_id}
+    assert len(await bree.get_room_members("party")) == 51
+
+    for n in range(49):
+        shire.room_left("party", f"hobbit{n}")
+    await shire.flush()
+    assert await bree.find_nodes_for_room("party") == {shire.node_id, bree.node_id}
+    shire.room_left("party", "hobbit49")
+    await shire.flush()
+    assert await bree.find_nodes_for_room("party") == {bree.node_id}
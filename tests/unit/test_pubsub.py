@@ -0,0 +1,232 @@
+from asyncio import Event, Queue, create_task, sleep
+from datetime import date, datetime
+from json import dumps, loads
+from time import monotonic
+from pytest import mark, raises
+from fastapi_cruddy_framework import (
+    InProcessBroker,
+    JsonCodec,
+    PickleCodec,
+    PubSub,
+    PubSubCodec,
+    RedisAdapter,
+    SocketMessage,
+    BROADCAST_EVENT,
+    ROOM_EVENT,
+    json_serial,
+)
+
+
+async def _wait_for(condition, attempts: int = 200):
+    for _ in range(attempts):
+        if condition():
+            return
+        await sleep(0.01)
+
+
+@mark.dependency()
+async def test_pubsub_routes_in_batches():
+    pubsub = PubSub(
+        channel="test_pubsub_batches", redis_client=RedisAdapter(mode="memory")
+    )
+    received = []
+
+    async def on_broadcast(message: SocketMessage):
+        received.append(message.data)
+
+    pubsub.on(BROADCAST_EVENT, on_broadcast)
+    await pubsub.startup()
+    await _wait_for(lambda: pubsub.p is not None)
+    for i in range(200):
+        await pubsub.publish(SocketMessage(route=BROADCAST_EVENT, data={"i": i}))
+    await _wait_for(lambda: len(received) == 200)
+    await pubsub.dispose()
+
+    assert received == [{"i": i} for i in range(200)]
+    metrics = pubsub.metrics
+    assert metrics["received"] == 200
+    assert metrics["routed"] == 200
+    assert metrics["failed"] == 0
+    assert metrics["pending"] == 0
+    assert 0 < metrics["batches"] <= 200
+    assert 0 < metrics["latency_p50"] <= metrics["latency_p99"]
+
+
+async def test_pubsub_routes_targets_concurrently_and_drains_with_a_deadline():
+    pubsub = PubSub(
+        channel="test_pubsub_lanes",
+        redis_client=RedisAdapter(mode="memory"),
+        drain_timeout=0.1,
+    )
+    received = []
+    never = Event()
+
+    async def on_room(message: SocketMessage):
+        if message.target == "stuck":
+            await never.wait()
+        received.append((message.target, message.data["i"]))
+
+    pubsub.on(ROOM_EVENT, on_room)
+    # One batch, already read off redis
+    pubsub.queue = Queue()
+    for target, i in [("stuck", 0), ("shire", 0), ("bree", 0), ("shire", 1)]:
+        message = SocketMessage(route=ROOM_EVENT, target=target, data={"i": i})
+        pubsub.queue.put_nowait((monotonic(), pubsub.codec.encode(message)))
+    pubsub.dispatch_task = create_task(pubsub.dispatch())
+    # A slow target doesn't hold up the others, and each target keeps its order
+    await _wait_for(lambda: len(received) == 3)
+    assert received == [("shire", 0), ("bree", 0), ("shire", 1)]
+    started = monotonic()
+    await pubsub.dispose()
+    assert monotonic() - started < 1
+    assert pubsub.dispatch_task.done()
+
+
+@mark.dependency()
+async def test_pubsub_backpressure():
+    pubsub = PubSub(
+        channel="test_pubsub_backpressure",
+        redis_client=RedisAdapter(mode="memory"),
+        max_pending=2,
+    )
+    received = []
+
+    async def slow_handler(message: SocketMessage):
+        await sleep(0.01)
+        received.append(message.data)
+
+    pubsub.on(BROADCAST_EVENT, slow_handler)
+    await pubsub.startup()
+    await _wait_for(lambda: pubsub.p is not None)
+    for i in range(20):
+        await pubsub.publish(SocketMessage(route=BROADCAST_EVENT, data={"i": i}))
+    await _wait_for(lambda: len(received) == 20)
+    await pubsub.dispose()
+
+    assert len(received) == 20
+    assert pubsub.metrics["backpressure_waits"] > 0
+
+
+def _codec_message() -> SocketMessage:
+    return SocketMessage(
+        route=BROADCAST_EVENT,
+        target="group:1",
+        type="record_updated",
+        sender="node",
+        data={"id": 1, "name": "Bree", "tags": ["inn"], "nested": {"ok": True}},
+    )
+
+
+@mark.parametrize("codec", [JsonCodec(), PickleCodec()])
+def test_codec_round_trip(codec: PubSubCodec):
+    message = _codec_message()
+    assert codec.decode(codec.encode(message)) == message
+    message.targets = ["a", "b"]
+    assert codec.decode(codec.encode(message)) == message
+
+
+def test_json_codec_is_compact_and_safe():
+    message = _codec_message()
+    codec = JsonCodec()
+    payload = codec.encode(message)
+    assert len(payload) < len(PickleCodec().encode(message))
+    # Values JSON can't carry are stringified instead of pickled
+    odd = codec.decode(codec.encode(SocketMessage(data={"when": date(2024, 5, 1)})))
+    assert odd.data == {"when": "2024-05-01"}
+    # Same output as the stdlib encoder, including non-str keys
+    data = {1: "x", None: "y", "at": datetime(2024, 5, 1, 12, 30)}
+    payload = codec.encode(SocketMessage(data=data))
+    assert loads(payload)[4] == loads(dumps(data, default=json_serial))
+    assert codec.decode(payload).data == {
+        "1": "x",
+        "null": "y",
+        "at": "2024-05-01T12:30:00",
+    }
+    # A pickle payload from a hostile publisher is rejected, never executed
+    with raises(Exception):
+        codec.decode(PickleCodec().encode(message))
+
+
+async def test_pubsub_uses_codec():
+    pubsub = PubSub(
+        channel="test_pubsub_codec",
+        redis_client=RedisAdapter(mode="memory"),
+        codec=JsonCodec(),
+    )
+    received = []
+
+    async def on_broadcast(message: SocketMessage):
+        received.append(message)
+
+    pubsub.on(BROADCAST_EVENT, on_broadcast)
+    await pubsub.startup()
+    await _wait_for(lambda: pubsub.p is not None)
+    await pubsub.publish(_codec_message())
+    await _wait_for(lambda: len(received) == 1)
+    await pubsub.dispose()
+    assert received == [_codec_message()]
+
+
+async def test_in_process_broker():
+    first = InProcessBroker(channel="test_in_process")
+    second = InProcessBroker(channel="test_in_process")
+    received = []
+
+    async def on_broadcast(message: SocketMessage):
+        received.append(message.data)
+
+    async def on_room(message: SocketMessage):
+        received.append(message.target)
+
+    second.on(BROADCAST_EVENT, on_broadcast)
+    second.on(ROOM_EVENT, on_room)
+    await first.startup()
+    await second.startup()
+    await second.subscribe("test_in_process:room:shire")
+    await first.publish(SocketMessage(route=BROADCAST_EVENT, data={"n": 1}))
+    await first.publish(
+        SocketMessage(route=ROOM_EVENT, target="shire"),
+        channel="test_in_process:room:shire",
+    )
+    await _wait_for(lambda: len(received) == 2)
+    assert received == [{"n": 1}, "shire"]
+
+    await second.unsubscribe("test_in_process:room:shire")
+    await first.publish(
+        SocketMessage(route=ROOM_EVENT, target="shire"),
+        channel="test_in_process:room:shire",
+    )
+    await first.dispose()
+    await second.dispose()
+    assert received == [{"n": 1}, "shire"]
+    assert second.redis_client is None
+
+
+async def test_publish_batching():
+    pubsub = PubSub(
+        channel="test_publish_batching",
+        redis_client=RedisAdapter(mode="memory"),
+        publish_window=0.05,
+        publish_batch_size=10,
+    )
+    received = []
+
+    async def on_broadcast(message: SocketMessage):
+        received.append(message.data["n"])  # type: ignore
+
+    pubsub.on(BROADCAST_EVENT, on_broadcast)
+    await pubsub.startup()
+    await _wait_for(lambda: pubsub.p is not None)
+    for index in range(25):
+        await pubsub.publish(SocketMessage(route=BROADCAST_EVENT, data={"n": index}))
+    # Queued without a round trip each, then sent as pipelines of at most 10
+    await _wait_for(lambda: len(received) == 25)
+    assert received == list(range(25))
+    metrics = pubsub.metrics
+    assert metrics["published"] == 25
+    assert metrics["publish_batches"] == 3
+    assert metrics["publish_batch_max"] == 10
+
+    await pubsub.publish(SocketMessage(route=BROADCAST_EVENT, data={"n": 25}))
+    await pubsub.dispose()
+    assert pubsub.metrics["published"] == 26
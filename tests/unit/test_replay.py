@@ -0,0 +1,60 @@
+from fastapi_cruddy_framework import MemoryReplayLog, RedisAdapter, RedisReplayLog
+
+
+def _envelope(n: int) -> dict:
+    return {"route": "room", "target": "shire", "type": "party", "data": n}
+
+
+async def test_memory_replay_log():
+    log = MemoryReplayLog(max_entries=3, max_streams=2)
+    ids = [await log.append("room:shire", _envelope(n)) for n in range(5)]
+    other = await log.append("room:bree", _envelope(9))
+
+    envelopes, complete = await log.read_since("room:shire", ids[2])
+    assert [envelope["data"] for envelope in envelopes] == [3, 4]
+    assert envelopes[0]["id"] == ids[3]
+    assert complete
+    # Entries 1 and 2 were trimmed, so the gap after 0 can't be filled
+    envelopes, complete = await log.read_since("room:shire", ids[0])
+    assert [envelope["data"] for envelope in envelopes] == [2, 3, 4]
+    assert not complete
+    assert await log.read_since("room:bree", other) == ([], True)
+
+    # Evicting the least recently written stream loses its history too
+    await log.append("client:frodo", _envelope(10))
+    assert await log.read_since("room:shire", ids[3]) == ([], False)
+    assert await log.read_since("room:shire", other) == ([], True)
+    assert await log.read_since("room:shire", "not-an-id") == ([], False)
+
+
+async def test_redis_replay_log():
+    log = RedisReplayLog(
+        redis_adapter=RedisAdapter(mode="memory"),
+        max_entries=3,
+        key_prefix="test:replay",
+    )
+    ids = [await log.append("room:shire", _envelope(n)) for n in range(5)]
+    assert ids == sorted(ids, key=lambda value: tuple(map(int, value.split("-"))))
+
+    envelopes, complete = await log.read_since("room:shire", ids[2])
+    assert [envelope["data"] for envelope in envelopes] == [3, 4]
+    assert envelopes[1]["id"] == ids[4]
+    assert complete
+    envelopes, complete = await log.read_since("room:shire", ids[0])
+    assert [envelope["data"] for envelope in envelopes] == [2, 3, 4]
+    assert not complete
+    assert await log.read_since("room:empty", ids[4]) == ([], True)
+    assert await log.read_since("room:shire", "not-an-id") == ([], False)
+
+
+async def test_expired_redis_streams_are_incomplete():
+    redis_adapter = RedisAdapter(mode="memory")
+    log = RedisReplayLog(
+        redis_adapter=redis_adapter, retention=60, key_prefix="test:expired"
+    )
+    last_seen_id = await log.append("room:shire", _envelope(0))
+    # The retention window passed with no writes, and redis dropped the stream
+    await redis_adapter.get_client().delete(log.key("room:shire"))
+    assert await log.read_since("room:shire", "1-0") == ([], False)
+    # Nothing written since a recent id can have expired yet
+    assert await log.read_since("room:shire", last_seen_id) == ([], True)
@@ -0,0 +1,1074 @@
+from asyncio import Event, Queue, create_task, gather, sleep
+from datetime import date
+from json import loads
+from time import monotonic
+from types import SimpleNamespace
+from pytest import importorskip, raises
+from fastapi import WebSocketDisconnect
+from fastapi_cruddy_framework import (
+    AdmissionControl,
+    CruddyAdmissionRejectedException,
+    CoalescePolicy,
+    DrainPolicy,
+    InboundDispatcher,
+    InProcessBroker,
+    StreamWorkQueue,
+    WorkItem,
+    LiveQueryHub,
+    MemoryReplayLog,
+    RedisAdapter,
+    TimerWheel,
+    WebsocketConnectionManager,
+    SocketMessage,
+    SocketRoomConfiguration,
+    ROOM_EVENT,
+    CLIENT_MESSAGE_EVENT,
+    DISCONNECT_EVENT,
+    HEARTBEAT_EVENT,
+    REPLAY_EVENT,
+    DRAIN_EVENT,
+    to_json_string,
+)
+
+
+class FakeSocket:
+    def __init__(
+        self,
+        stalled: bool = False,
+        subprotocols: list[str] | None = None,
+        query_params: dict | None = None,
+    ):
+        self.frames = []
+        self.state = SimpleNamespace(
+            is_connected=True, rooms=SocketRoomConfiguration(room_list=set())
+        )
+        self.closed = False
+        self.scope = {"subprotocols": subprotocols or []}
+        self.query_params = query_params or {}
+        self.inbound = Queue()
+        self.release = Event()
+        if not stalled:
+            self.release.set()
+
+    async def send_text(self, data: str):
+        await self.release.wait()
+        self.frames.append(data)
+
+    async def send_bytes(self, data: bytes):
+        await self.release.wait()
+        self.frames.append(data)
+
+    # Frames a test pushes in, then a disconnect once it puts None
+    async def _receive(self):
+        data = await self.inbound.get()
+        if data is None:
+            raise WebSocketDisconnect()
+        return data
+
+    async def receive_json(self):
+        return await self._receive()
+
+    async def receive_bytes(self):
+        return await self._receive()
+
+    async def accept(self, subprotocol: str | None = None):
+        self.subprotocol = subprotocol
+
+    async def close(self, code: int = 1000, reason: str | None = None):
+        self.closed = True
+        self.close_code = code
+        self.close_reason = reason
+
+
+async def _link(manager: WebsocketConnectionManager, socket: FakeSocket, room: str):
+    socket.state.socket_id = f"{id(socket)}"
+    manager._link_socket(socket, socket.state.socket_id)  # type: ignore
+    await manager._join_sockets([socket], room)  # type: ignore
+
+
+async def _settle():
+    for _ in range(20):
+        await sleep(0)
+
+
+async def test_frames_are_encoded_once():
+    calls = []
+
+    def serializer(envelope: dict):
+        calls.append(envelope)
+        return f"{envelope['type']}:{envelope['data']['when']}".encode()
+
+    manager = WebsocketConnectionManager(
+        redis_mode="memory", custom_json_serializer=serializer
+    )
+    sockets = [FakeSocket() for _ in range(5)]
+    for socket in sockets:
+        await _link(manager, socket, "shire")
+    await manager._route_to_room(
+        SocketMessage(
+            route=ROOM_EVENT, target="shire", type="party", data={"when": "today"}
+        )
+    )
+    await _settle()
+    assert len(calls) == 1
+    assert all(socket.frames == [b"party:today"] for socket in sockets)
+    # The same buffer is shared by every socket
+    assert all(socket.frames[0] is sockets[0].frames[0] for socket in sockets)
+    await manager.dispose()
+
+
+def test_default_serializer_produces_json_text():
+    manager = WebsocketConnectionManager(redis_mode="memory")
+    frame = manager.generate_client_message(
+        ROOM_EVENT, "shire", None, "party", {"when": date(2024, 9, 22)}
+    )
+    assert isinstance(frame, str)
+    assert loads(frame) == {
+        "route": ROOM_EVENT,
+        "target": "shire",
+        "sender": None,
+        "type": "party",
+        "data": {"when": "2024-09-22"},
+    }
+
+
+async def test_slow_consumer_does_not_stall_broadcast():
+    manager = WebsocketConnectionManager(
+        redis_mode="memory", send_queue_size=2, send_overflow="drop_oldest"
+    )
+    fast = FakeSocket()
+    slow = FakeSocket(stalled=True)
+    await _link(manager, fast, "shire")
+    await _link(manager, slow, "shire")
+    for index in range(5):
+        await manager._route_to_room(
+            SocketMessage(route=ROOM_EVENT, target="shire", data={"n": index})
+        )
+        await _settle()
+    assert len(fast.frames) == 5
+    assert manager.metrics["dropped_frames"] >= 2
+    slow.release.set()
+    await _settle()
+    # The slow socket keeps the newest frames
+    assert [loads(frame)["data"]["n"] for frame in slow.frames][-2:] == [3, 4]
+    await manager.dispose()
+
+
+async def test_slow_consumer_eviction():
+    manager = WebsocketConnectionManager(
+        redis_mode="memory", send_queue_size=1, send_overflow="disconnect"
+    )
+    slow = FakeSocket(stalled=True)
+    await _link(manager, slow, "shire")
+    for index in range(3):
+        await manager._route_to_room(
+            SocketMessage(route=ROOM_EVENT, target="shire", data={"n": index})
+        )
+    # The close runs in the background, but stays referenced until it finishes
+    assert len(manager.background_tasks) == 1
+    await _settle()
+    assert slow.closed
+    assert slow.state.is_connected is False
+    assert manager.metrics["evicted_slow_consumers"] == 1
+    assert len(manager.background_tasks) == 0
+
+    manager = WebsocketConnectionManager(redis_mode="memory", send_timeout=0.01)
+    slow = FakeSocket(stalled=True)
+    await _link(manager, slow, "shire")
+    await manager._route_to_room(
+        SocketMessage(route=ROOM_EVENT, target="shire", data={"n": 0})
+    )
+    await sleep(0.05)
+    assert slow.closed
+    assert manager.metrics["evicted_slow_consumers"] == 1
+
+
+async def test_leaving_a_room_twice_is_a_no_op():
+    manager = WebsocketConnectionManager(redis_mode="memory", room_channels=True)
+    member = FakeSocket()
+    stranger = FakeSocket()
+    await _link(manager, member, "shire")
+    await _link(manager, stranger, "bree")
+    await manager._leave_sockets([member, stranger], "shire")  # type: ignore
+    await manager._leave_sockets([member], "shire")  # type: ignore
+    assert member.state.rooms.room_list == set()
+    assert stranger.state.rooms.room_list == {"bree"}
+    assert manager.get_sockets_by_room("shire") == []
+    assert manager.get_sockets_by_room("bree") == [stranger]
+    assert manager.pubsub_instance.channels == {manager.get_room_channel("bree")}
+    await manager.dispose()
+
+
+class BrokenSocket(FakeSocket):
+    async def send_text(self, data: str):
+        raise RuntimeError("connection reset")
+
+
+async def test_failed_send_unlinks_the_socket():
+    manager = WebsocketConnectionManager(redis_mode="memory")
+    broken = BrokenSocket()
+    await _link(manager, broken, "shire")
+    await manager._route_to_room(
+        SocketMessage(route=ROOM_EVENT, target="shire", data={"n": 0})
+    )
+    await _settle()
+    assert broken.state.is_connected is False
+    assert broken not in manager.writers
+    assert manager.get_sockets_by_room("shire") == []
+    assert manager.metrics["connections"] == 0
+    await manager.dispose()
+
+
+async def test_room_channels_only_reach_hosting_nodes():
+    redis_adapter = RedisAdapter(mode="memory")
+    hosting = WebsocketConnectionManager(
+        redis_adapter=redis_adapter, redis_channel="test_shards", room_channels=True
+    )
+    idle = WebsocketConnectionManager(
+        redis_adapter=redis_adapter, redis_channel="test_shards", room_channels=True
+    )
+    await hosting.startup()
+    await idle.startup()
+    for _ in range(100):
+        if hosting.pubsub_instance.p is not None and idle.pubsub_instance.p:
+            break
+        await sleep(0.01)
+    socket = FakeSocket()
+    await _link(hosting, socket, "shire")
+    assert hosting.pubsub_instance.channels == {"test_shards:room:shire"}
+    assert idle.pubsub_instance.channels == set()
+    await sleep(0.05)
+
+    await idle.room_message(target="shire", type="party", data={"n": 1})
+    for _ in range(100):
+        if len(socket.frames) > 0:
+            break
+        await sleep(0.01)
+    assert loads(socket.frames[0])["data"] == {"n": 1}
+    assert idle.pubsub_instance.metrics["received"] == 0
+
+    await hosting._leave_sockets([socket], "shire")  # type: ignore
+    assert hosting.pubsub_instance.channels == set()
+    await hosting.dispose()
+    await idle.dispose()
+
+
+async def test_manager_presence():
+    manager = WebsocketConnectionManager(
+        redis_mode="memory", redis_channel="test_presence", presence=True
+    )
+    await manager.startup()
+    socket = FakeSocket()
+    await _link(manager, socket, "shire")
+    assert await manager.count_online() == 1
+    assert await manager.get_room_members("shire") == [f"{id(socket)}"]
+    assert await manager.get_cluster_room_list() == {"shire"}
+    await manager._unlink_socket(socket)  # type: ignore
+    assert await manager.count_online() == 0
+    assert await manager.get_cluster_room_list() == set()
+    await manager.dispose()
+
+    without = WebsocketConnectionManager(redis_mode="memory")
+    with raises(RuntimeError):
+        await without.count_online()
+
+
+async def test_control_messages_are_node_addressed():
+    redis_adapter = RedisAdapter(mode="memory")
+    owner = WebsocketConnectionManager(
+        redis_adapter=redis_adapter, redis_channel="test_control", presence=True
+    )
+    other = WebsocketConnectionManager(
+        redis_adapter=redis_adapter, redis_channel="test_control", presence=True
+    )
+    await owner.startup()
+    await other.startup()
+    for _ in range(100):
+        if owner.pubsub_instance.p is not None and other.pubsub_instance.p:
+            break
+        await sleep(0.01)
+    socket = FakeSocket()
+    await _link(owner, socket, "shire")
+    assert owner.presence is not None
+    await owner.presence.flush()
+
+    await other.kill_sockets_by_socket_id(socket.state.socket_id)
+    for _ in range(100):
+        if socket.closed:
+            break
+        await sleep(0.01)
+    assert socket.closed
+    assert other.metrics["control_addressed"] == 1
+    # Only the owning node heard about it
+    assert other.pubsub_instance.metrics["received"] == 0
+
+    # Targets nobody owns fall back to a broadcast
+    await other.kill_sockets_by_socket_id("nobody")
+    assert other.metrics["control_broadcast"] == 1
+    await owner.dispose()
+    await other.dispose()
+
+
+async def test_local_targets_skip_the_broker():
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_local")
+    )
+    await manager.startup()
+    socket = FakeSocket()
+    await _link(manager, socket, "shire")
+    await manager.direct_message(target=socket.state.socket_id, data={"n": 1})
+    await manager.room_message(target="shire", data={"n": 2})
+    await manager.broadcast(data={"n": 3})
+    for _ in range(100):
+        if len(socket.frames) == 3:
+            break
+        await sleep(0.01)
+    assert sorted(loads(frame)["data"]["n"] for frame in socket.frames) == [1, 2, 3]
+    assert manager.metrics["local_deliveries"] == 1
+    # Only the room message and the broadcast went through the broker
+    assert manager.pubsub_instance.metrics["received"] == 2
+    await manager.dispose()
+    with raises(ValueError):
+        WebsocketConnectionManager(
+            pubsub_instance=InProcessBroker(channel="test_local"), presence=True
+        )
+
+
+async def test_overridden_socket_ids_reach_every_node():
+    redis_adapter = RedisAdapter(mode="memory")
+    here = WebsocketConnectionManager(
+        redis_adapter=redis_adapter, redis_channel="test_override"
+    )
+    there = WebsocketConnectionManager(
+        redis_adapter=redis_adapter, redis_channel="test_override"
+    )
+    await here.startup()
+    await there.startup()
+    for _ in range(100):
+        if here.pubsub_instance.p is not None and there.pubsub_instance.p:
+            break
+        await sleep(0.01)
+
+    async def hold(manager: WebsocketConnectionManager, socket: FakeSocket):
+        async with manager.connect(socket, override_socket_id="frodo"):  # type: ignore
+            pass
+
+    # The same app-supplied id is open in two tabs, one on each node
+    tabs = [FakeSocket(), FakeSocket()]
+    tasks = [create_task(hold(here, tabs[0])), create_task(hold(there, tabs[1]))]
+    await _settle()
+
+    await here.direct_message(target="frodo", data={"n": 1})
+    for _ in range(100):
+        if all(len(tab.frames) == 1 for tab in tabs):
+            break
+        await sleep(0.01)
+    assert [loads(tab.frames[0])["data"] for tab in tabs] == [{"n": 1}, {"n": 1}]
+    assert here.metrics["local_deliveries"] == 0
+    for tab in tabs:
+        tab.inbound.put_nowait(None)
+    await gather(*tasks)
+    await here.dispose()
+    await there.dispose()
+
+
+async def test_presence_splits_local_and_remote_members():
+    redis_adapter = RedisAdapter(mode="memory")
+    here = WebsocketConnectionManager(
+        redis_adapter=redis_adapter, redis_channel="test_split", presence=True
+    )
+    there = WebsocketConnectionManager(
+        redis_adapter=redis_adapter, redis_channel="test_split", presence=True
+    )
+    await here.startup()
+    await there.startup()
+    for _ in range(100):
+        if here.pubsub_instance.p is not None and there.pubsub_instance.p:
+            break
+        await sleep(0.01)
+    local = FakeSocket()
+    remote = FakeSocket()
+    await _link(here, local, "shire")
+    await _link(there, remote, "shire")
+    assert there.presence is not None
+    await there.presence.flush()
+
+    await here.room_message(target="shire", data={"n": 1})
+    for _ in range(100):
+        if len(local.frames) == 1 and len(remote.frames) == 1:
+            break
+        await sleep(0.01)
+    assert loads(local.frames[0])["data"] == {"n": 1}
+    assert loads(remote.frames[0])["data"] == {"n": 1}
+    assert here.metrics["local_deliveries"] == 1
+    # The sending node didn't receive its own message back
+    assert here.pubsub_instance.metrics["received"] == 0
+    await here.dispose()
+    await there.dispose()
+
+
+async def test_multicast():
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_multicast")
+    )
+    await manager.startup()
+    sockets = [FakeSocket() for _ in range(3)]
+    await _link(manager, sockets[0], "shire")
+    await _link(manager, sockets[1], "bree")
+    await _link(manager, sockets[2], "shire")
+    await manager._join_sockets([sockets[2]], "bree")  # type: ignore
+
+    ids = [socket.state.socket_id for socket in sockets]
+    await manager.multicast(
+        targets=[ids[0], ids[2], "gone"], route="socket", data={"n": 1}
+    )
+    await manager.multicast(
+        targets=["shire", "bree", "mordor"], route="room", data={"n": 2}
+    )
+    for _ in range(100):
+        if sum(len(socket.frames) for socket in sockets) == 5:
+            break
+        await sleep(0.01)
+    frames = [[loads(frame) for frame in socket.frames] for socket in sockets]
+    assert [frame["data"]["n"] for frame in frames[0]] == [1, 2]
+    assert [frame["data"]["n"] for frame in frames[1]] == [2]
+    # In both targeted rooms, but only delivered once
+    assert [frame["data"]["n"] for frame in frames[2]] == [1, 2]
+    assert frames[0][0]["target"] == ids[0]
+    assert frames[1][0] == {
+        "route": ROOM_EVENT,
+        "target": "bree",
+        "sender": None,
+        "type": "",
+        "data": {"n": 2},
+    }
+    # One message through the broker per multicast
+    assert manager.pubsub_instance.metrics["received"] == 2
+    await manager.dispose()
+
+
+async def test_room_coalescing():
+    policies = {"telemetry": CoalescePolicy(window=0.05, dedupe_by_type=True)}
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_coalescing"),
+        room_coalescing=policies.get,
+    )
+    await manager.startup()
+    watcher = FakeSocket()
+    await _link(manager, watcher, "telemetry")
+    await manager._join_sockets([watcher], "chat")  # type: ignore
+    for index in range(5):
+        await manager.room_message(target="telemetry", type="speed", data={"n": index})
+        await manager.room_message(target="telemetry", type="fuel", data={"n": index})
+    await manager.room_message(target="chat", type="say", data={"n": 0})
+    for _ in range(100):
+        if len(watcher.frames) == 2:
+            break
+        await sleep(0.01)
+    frames = [loads(frame) for frame in watcher.frames]
+    # Uncoalesced rooms are delivered as they arrive
+    assert frames[0]["type"] == "say"
+    assert [(message["type"], message["data"]["n"]) for message in frames[1]] == [
+        ("speed", 4),
+        ("fuel", 4),
+    ]
+    await manager.dispose()
+
+
+async def test_socket_coalescing():
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_socket_coalescing"),
+        socket_coalescing=lambda socket: (
+            CoalescePolicy(window=0.2, dedupe_by_type=True)
+            if socket.query_params.get("batch") == "1"
+            else None
+        ),
+    )
+    await manager.startup()
+    batched = FakeSocket(query_params={"batch": "1"})
+    plain = FakeSocket()
+    await _link(manager, batched, "telemetry")
+    await _link(manager, plain, "telemetry")
+    for index in range(3):
+        await manager.room_message(target="telemetry", type="speed", data={"n": index})
+    await manager.direct_message(
+        target=batched.state.socket_id, type="note", data={"n": 9}
+    )
+    await manager.broadcast(type="news", data={"n": 5})
+    for _ in range(100):
+        if len(batched.frames) == 1:
+            break
+        await sleep(0.01)
+    # Messages from every route share one window, and the latest of each type is kept
+    assert len(batched.frames) == 1
+    assert sorted(
+        (message["type"], message["data"]["n"]) for message in loads(batched.frames[0])
+    ) == [("news", 5), ("note", 9), ("speed", 2)]
+    assert sorted(loads(frame)["data"]["n"] for frame in plain.frames) == [0, 1, 2, 5]
+    await manager.dispose()
+
+
+async def test_inbound_dispatch_modes():
+    log = []
+
+    async def handler(websocket, data: dict):
+        log.append(("start", data["n"]))
+        await sleep(data["delay"])
+        log.append(("end", data["n"]))
+
+    manager = WebsocketConnectionManager(redis_mode="memory", inbound_mode="concurrent")
+    manager.on(CLIENT_MESSAGE_EVENT, handler)
+    dispatcher = InboundDispatcher(manager, FakeSocket())  # type: ignore
+    await dispatcher.dispatch({"n": 1, "delay": 0.05})
+    await dispatcher.dispatch({"n": 2, "delay": 0})
+    await sleep(0.1)
+    # The slow message didn't hold up the next one
+    assert log.index(("end", 2)) < log.index(("end", 1))
+
+    log.clear()
+    manager = WebsocketConnectionManager(redis_mode="memory", inbound_mode="ordered")
+    manager.on(CLIENT_MESSAGE_EVENT, handler)
+    dispatcher = InboundDispatcher(manager, FakeSocket())  # type: ignore
+    await dispatcher.dispatch({"n": 1, "type": "a", "delay": 0.05})
+    await dispatcher.dispatch({"n": 2, "type": "a", "delay": 0})
+    await dispatcher.dispatch({"n": 3, "type": "b", "delay": 0})
+    await sleep(0.1)
+    # Same key waits its turn, other keys don't
+    assert log.index(("end", 1)) < log.index(("start", 2))
+    assert log.index(("end", 3)) < log.index(("end", 1))
+    assert dispatcher.tails == {}
+
+
+async def test_inbound_limits():
+    running = []
+    peak = []
+    release = Event()
+
+    async def handler(websocket, data: dict):
+        running.append(data)
+        peak.append(len(running))
+        await release.wait()
+        running.remove(data)
+
+    manager = WebsocketConnectionManager(
+        redis_mode="memory",
+        inbound_mode="concurrent",
+        inbound_concurrency=2,
+        inbound_workers=3,
+    )
+    manager.on(CLIENT_MESSAGE_EVENT, handler)
+    chatty = InboundDispatcher(manager, FakeSocket())  # type: ignore
+    other = InboundDispatcher(manager, FakeSocket())  # type: ignore
+    await chatty.dispatch({"n": 1})
+    await chatty.dispatch({"n": 2})
+    # A third message from the same socket waits for a free slot
+    blocked = create_task(chatty.dispatch({"n": 3}))
+    await other.dispatch({"n": 4})
+    await other.dispatch({"n": 5})
+    await sleep(0.01)
+    assert not blocked.done()
+    assert max(peak) == 3
+    assert manager.metrics["inbound_in_flight"] == 3
+    release.set()
+    await blocked
+    await sleep(0.01)
+    assert manager.metrics["inbound_in_flight"] == 0
+
+
+def test_timer_wheel():
+    wheel = TimerWheel(tick=1, size=8)
+    wheel.schedule("soon", 2)
+    wheel.schedule("later", 20)
+    wheel.schedule("cancelled", 2)
+    wheel.cancel("cancelled")
+    expired = {}
+    for tick in range(1, 25):
+        for item in wheel.advance():
+            expired[item] = tick
+    assert expired == {"soon": 2, "later": 20}
+    assert len(wheel) == 0
+
+
+async def test_heartbeat_reaps_dead_and_idle_sockets():
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_heartbeat"),
+        ping_interval=0.03,
+        pong_timeout=0.05,
+        idle_timeout=0.5,
+        heartbeat_tick=0.01,
+    )
+    disconnected = []
+
+    async def on_disconnect(websocket):
+        disconnected.append(websocket)
+
+    manager.on(DISCONNECT_EVENT, on_disconnect)
+    await manager.startup()
+    dead = FakeSocket()
+    alive = FakeSocket()
+    await _link(manager, dead, "shire")
+    await _link(manager, alive, "shire")
+    for _ in range(30):
+        await sleep(0.01)
+        # The live client answers pings, the dead one never does
+        if len(alive.frames) > 0:
+            manager.last_seen[alive] = monotonic()  # type: ignore
+    assert loads(dead.frames[0]) == {
+        "route": HEARTBEAT_EVENT,
+        "target": None,
+        "sender": None,
+        "type": "ping",
+        "data": None,
+    }
+    assert dead.closed and disconnected == [dead]
+    assert not alive.closed
+    assert manager.get_sockets_by_room("shire") == [alive]
+    assert manager.metrics["reaped_connections"] == 1
+
+    # Pongs keep it connected, but it never says anything, so idle timeout applies
+    for _ in range(50):
+        await sleep(0.01)
+        manager.last_seen[alive] = monotonic()  # type: ignore
+        if alive.closed:
+            break
+    assert alive.closed
+    assert manager.metrics["reaped_connections"] == 2
+    assert len(manager.heartbeat_wheel) == 0
+    await manager.dispose()
+
+
+async def test_heartbeat_reaps_each_socket_once():
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_reap_once"),
+        idle_timeout=0.01,
+    )
+    await manager.startup()
+    idle = FakeSocket()
+    await _link(manager, idle, "shire")
+    await sleep(0.02)
+    # A second check before the first reap has run must not start another
+    manager._check_heartbeat(idle)  # type: ignore
+    manager._check_heartbeat(idle)  # type: ignore
+    assert manager.reaping == {idle}
+    assert len(manager.background_tasks) == 1
+    await _settle()
+    assert idle.closed
+    assert manager.metrics["reaped_connections"] == 1
+    assert manager.reaping == set()
+    assert len(manager.background_tasks) == 0
+    await manager.dispose()
+
+
+async def test_resume_replays_missed_messages():
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_replay"),
+        replay_log=MemoryReplayLog(max_entries=3),
+    )
+    await manager.startup()
+    tasks = []
+    sockets = []
+
+    async def hold(socket: FakeSocket, **kwargs):
+        async with manager.connect(socket, **kwargs):  # type: ignore
+            pass
+
+    async def connect(**kwargs) -> FakeSocket:
+        socket = FakeSocket()
+        sockets.append(socket)
+        tasks.append(create_task(hold(socket, **kwargs)))
+        await _settle()
+        return socket
+
+    async def join(socket_id: str):
+        await manager.join_room_by_socket_id(socket_id, "shire")
+        await _settle()
+
+    listener = await connect(override_socket_id="listener")
+    await join("listener")
+    await manager.room_message("shire", type="party", data={"n": 1})
+    await manager.broadcast(type="news", data={"n": 2})
+    await manager.direct_message(target="returning", type="note", data={"n": 3})
+    await manager.room_message("shire", type="party", data={"n": 4})
+    await _settle()
+    frames = [loads(frame) for frame in listener.frames]
+    assert [frame["data"]["n"] for frame in frames] == [1, 2, 4]
+    assert all("id" in frame for frame in frames)
+    last_seen_id = frames[0]["id"]
+
+    # A client that saw the first message reconnects under its old socket id
+    returning = await connect(override_socket_id="returning", last_seen_id=last_seen_id)
+    await join("returning")
+    assert [loads(frame)["data"]["n"] for frame in returning.frames] == [2, 3, 4]
+    assert manager.metrics["replayed_messages"] == 3
+    # Leaving and rejoining a room doesn't replay it again
+    await manager.leave_room_by_socket_id("returning", "shire")
+    await _settle()
+    await join("returning")
+    assert len(returning.frames) == 3
+
+    # Without a stable id, missed direct messages can't be found, so it must refresh
+    anonymous = await connect(last_seen_id=last_seen_id)
+    hint = loads(anonymous.frames[0])
+    assert (hint["route"], hint["target"], hint["type"]) == (
+        REPLAY_EVENT,
+        "client",
+        "refresh",
+    )
+    assert loads(anonymous.frames[1])["data"] == {"n": 2}
+
+    # Too far behind: the room's log was trimmed past its last seen id
+    for n in range(3):
+        await manager.room_message("shire", type="party", data={"n": n})
+    await _settle()
+    late = await connect(override_socket_id="late", last_seen_id=last_seen_id)
+    replayed = len(late.frames)
+    await join("late")
+    hint = loads(late.frames[replayed])
+    assert (hint["route"], hint["target"], hint["type"]) == (
+        REPLAY_EVENT,
+        "room:shire",
+        "refresh",
+    )
+    assert [loads(frame)["data"]["n"] for frame in late.frames[replayed + 1 :]] == [
+        0,
+        1,
+        2,
+    ]
+    for socket in sockets:
+        socket.inbound.put_nowait(None)
+    await gather(*tasks)
+    await manager.dispose()
+
+
+async def test_admission_control():
+    admission = AdmissionControl(rate=20, burst=2, max_handshakes=None, max_wait=0.1)
+    start = monotonic()
+    results = await gather(*[admission.acquire() for _ in range(5)])
+    # Two from the burst, two more at 20/s within the wait, the last would wait too long
+    assert results == [True, True, True, True, False]
+    assert monotonic() - start >= 0.09
+    assert admission.stats["rejected"] == 1
+
+    # A connection that times out waiting for a handshake slot returns its token
+    admission = AdmissionControl(rate=1, burst=2, max_handshakes=1, max_wait=0.05)
+    assert await admission.acquire()
+    assert not await admission.acquire()
+    assert admission.tokens >= 1
+
+    admission = AdmissionControl(rate=None, max_handshakes=1, max_wait=0.05)
+    assert await admission.acquire()
+    assert not await admission.acquire()
+    admission.release()
+    assert await admission.acquire()
+    assert admission.stats == {
+        "admitted": 2,
+        "rejected": 1,
+        "waiting": 0,
+        "in_flight": 1,
+    }
+
+
+async def test_connect_rejects_with_a_retry_hint():
+    admission = AdmissionControl(rate=None, max_handshakes=1, max_wait=0.01)
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_admission"), admission=admission
+    )
+    await admission.acquire()
+    socket = FakeSocket()
+    with raises(CruddyAdmissionRejectedException) as error:
+        async with manager.connect(socket):  # type: ignore
+            pass
+    assert socket.closed and socket.close_code == 1013
+    retry_after = loads(socket.close_reason)["retry_after"]
+    assert retry_after == error.value.retry_after
+    assert 2.5 <= retry_after <= 7.5
+    assert manager.metrics["admission_rejected"] == 1
+    assert len(manager.active_connections) == 0
+
+    # The slot is held until the app's setup inside the block is done
+    admission.release()
+    setup_done = Event()
+    socket = FakeSocket()
+
+    async def hold():
+        async with manager.connect(socket, override_socket_id="slow"):  # type: ignore
+            await setup_done.wait()
+
+    task = create_task(hold())
+    await _settle()
+    assert admission.stats["in_flight"] == 1
+    setup_done.set()
+    await _settle()
+    assert admission.stats["in_flight"] == 0
+    assert manager.get_sockets_by_id("slow") == [socket]
+    socket.inbound.put_nowait(None)
+    await task
+
+
+async def test_live_query_hub():
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_live_query")
+    )
+
+    async def authorize(websocket, resource: str, where) -> bool:
+        return resource == "Hobbit"
+
+    hub = LiveQueryHub(manager, authorize=authorize, max_subscriptions=1)
+    await manager.startup()
+    socket = FakeSocket()
+    socket.state.socket_id = "watcher"
+    manager._link_socket(socket, "watcher")  # type: ignore
+    # Subscriptions the hook doesn't approve are refused
+    await hub._handle_client_message(  # type: ignore
+        socket,
+        {
+            "route": "live_query",
+            "type": "subscribe",
+            "target": "elves",
+            "data": {"resource": "Elf"},
+        },
+    )
+    await _settle()
+    denied = loads(socket.frames.pop())
+    assert (denied["target"], denied["type"]) == ("elves", "error")
+    assert hub.stats["subscriptions"] == 0
+    hub.subscribe(socket, "young", "Hobbit", {"age": {"*lt": 50}}, ids=[1])  # type: ignore
+    with raises(ValueError):
+        hub.subscribe(socket, "old", "Hobbit", None)  # type: ignore
+
+    bilbo = {"id": "1", "age": 111}
+    frodo = {"id": "2", "age": 33}
+    sam = {"id": "3", "age": 38}
+    await hub.publish_change("Hobbit", "update", "1", bilbo)
+    await hub.publish_change("Hobbit", "create", "2", frodo)
+    await hub.publish_change("Elf", "create", "3", sam)
+    await hub.publish_change("Hobbit", "update", "1", bilbo)
+    await hub.publish_change("Hobbit", "delete", "2", frodo)
+    await _settle()
+    frames = [loads(frame) for frame in socket.frames]
+    assert [(frame["type"], frame["data"]["id"]) for frame in frames] == [
+        ("remove", "1"),
+        ("upsert", "2"),
+        ("remove", "2"),
+    ]
+    assert all(frame["target"] == "young" for frame in frames)
+    assert hub.stats == {"subscriptions": 1, "changes": 5, "pushed": 3}
+
+    await manager._unlink_socket(socket)  # type: ignore
+    assert hub.stats["subscriptions"] == 0
+    assert hub.by_resource == {}
+    await manager.dispose()
+
+
+async def test_work_queue_spreads_and_retries_client_messages():
+    attempts = []
+
+    async def handler(item: WorkItem):
+        attempts.append(item.attempts)
+        if item.data["type"] == "flaky" and item.attempts == 1:
+            raise ValueError("try again")
+        if item.data["type"] == "broken":
+            raise ValueError("never works")
+        return {"n": item.data["data"]["n"] * 2}
+
+    work_queue = StreamWorkQueue(
+        handler,
+        stream="test:work",
+        types=["crunch", "flaky", "broken"],
+        block=0.01,
+        claim_idle=0.05,
+        max_attempts=2,
+    )
+    manager = WebsocketConnectionManager(redis_mode="memory", work_queue=work_queue)
+    await manager.startup()
+    socket = FakeSocket()
+    await _link(manager, socket, "shire")
+    dispatcher = InboundDispatcher(manager, socket)  # type: ignore
+    emitted = []
+
+    async def on_message(websocket, data):
+        emitted.append(data)
+
+    manager.on(CLIENT_MESSAGE_EVENT, on_message)
+    await dispatcher.dispatch({"type": "chat", "data": {}})
+    await dispatcher.dispatch({"type": "crunch", "data": {"n": 2}})
+    await dispatcher.dispatch({"type": "flaky", "data": {"n": 5}})
+    await dispatcher.dispatch({"type": "broken", "data": {"n": 0}})
+    # Untyped messages are still handled locally
+    assert emitted == [{"type": "chat", "data": {}}]
+    for _ in range(100):
+        await sleep(0.01)
+        if work_queue.stats["dead_lettered"] == 1 and len(socket.frames) == 2:
+            break
+    results = sorted(
+        (loads(frame)["type"], loads(frame)["data"]["n"]) for frame in socket.frames
+    )
+    assert results == [("crunch", 4), ("flaky", 10)]
+    assert work_queue.stats["processed"] == 2
+    assert work_queue.stats["dead_lettered"] == 1
+    dead = await work_queue.get_client().xrange("test:work:dead")
+    assert loads(dead[0][1][b"m"])["data"]["type"] == "broken"
+    await manager.dispose()
+
+
+async def test_work_queue_leaves_framework_routes_local():
+    handled = []
+
+    async def handler(item: WorkItem):
+        handled.append(item.data)
+
+    async def authorize(websocket, resource: str, where) -> bool:
+        return True
+
+    work_queue = StreamWorkQueue(handler, stream="test:work:framework", block=0.01)
+    manager = WebsocketConnectionManager(redis_mode="memory", work_queue=work_queue)
+    hub = LiveQueryHub(manager, authorize=authorize)
+    await manager.startup()
+    socket = FakeSocket()
+    await _link(manager, socket, "shire")
+    dispatcher = InboundDispatcher(manager, socket)  # type: ignore
+
+    # With types=None, everything but the framework's own routes is queued
+    await dispatcher.dispatch(
+        {
+            "route": "live_query",
+            "type": "subscribe",
+            "target": "hobbits",
+            "data": {"resource": "Hobbit"},
+        }
+    )
+    await dispatcher.dispatch({"route": "heartbeat", "type": "pong"})
+    await dispatcher.dispatch({"route": "room", "type": "crunch", "data": {}})
+    await _settle()
+    assert hub.stats["subscriptions"] == 1
+    assert loads(socket.frames[0])["type"] == "subscribed"
+    for _ in range(100):
+        await sleep(0.01)
+        if work_queue.stats["processed"] == 1:
+            break
+    assert work_queue.stats["enqueued"] == 1
+    assert handled == [{"route": "room", "type": "crunch", "data": {}}]
+    await manager.dispose()
+
+
+async def test_msgpack_protocol_is_negotiated_per_connection():
+    msgpack = importorskip("msgpack")
+    calls = []
+
+    def serializer(envelope):
+        calls.append(envelope)
+        return to_json_string(envelope)
+
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_protocols"),
+        protocols=["json", "msgpack"],
+        custom_json_serializer=serializer,
+    )
+    received = []
+
+    async def on_message(websocket, data):
+        received.append(data)
+
+    manager.on(CLIENT_MESSAGE_EVENT, on_message)
+    await manager.startup()
+    by_subprotocol = FakeSocket(subprotocols=["cruddy.msgpack"])
+    by_query = FakeSocket(query_params={"protocol": "msgpack"})
+    plain = [FakeSocket(), FakeSocket()]
+    sockets = [by_subprotocol, by_query, *plain]
+
+    async def hold(socket: FakeSocket):
+        async with manager.connect(socket):  # type: ignore
+            pass
+
+    tasks = [create_task(hold(socket)) for socket in sockets]
+    await _settle()
+    assert by_subprotocol.subprotocol == "cruddy.msgpack"
+    assert by_query.subprotocol is None
+    await manager.broadcast(type="tick", data={"values": [1.5, 2.5]})
+    await _settle()
+    # One JSON encoding and one msgpack encoding, each shared by its audience
+    assert len(calls) == 1
+    assert by_subprotocol.frames[0] is by_query.frames[0]
+    assert plain[0].frames[0] is plain[1].frames[0]
+    assert msgpack.unpackb(by_subprotocol.frames[0])["data"] == {"values": [1.5, 2.5]}
+    assert loads(plain[0].frames[0])["type"] == "tick"
+
+    by_subprotocol.inbound.put_nowait(msgpack.packb({"type": "move", "data": {"x": 1}}))
+    plain[0].inbound.put_nowait({"type": "chat", "data": {}})
+    await _settle()
+    assert received == [
+        {"type": "move", "data": {"x": 1}},
+        {"type": "chat", "data": {}},
+    ]
+    for socket in sockets:
+        socket.inbound.put_nowait(None)
+    await gather(*tasks)
+    await manager.dispose()
+
+
+class SlowCloseSocket(FakeSocket):
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    async def close(self, code: int = 1000, reason: str | None = None):
+        await sleep(self.delay)
+        await super().close(code, reason)
+
+
+async def test_drain_closes_sockets_in_concurrent_spread_batches():
+    manager = WebsocketConnectionManager(
+        pubsub_instance=InProcessBroker(channel="test_drain"),
+        drain_policy=DrainPolicy(
+            batch_size=4,
+            close_timeout=0.2,
+            window=0.3,
+            reconnect=True,
+            reconnect_data={"retry_after": 1},
+        ),
+    )
+    await manager.startup()
+    slow = [SlowCloseSocket(0.1) for _ in range(8)]
+    hung = SlowCloseSocket(60)
+    sockets = [*slow, hung]
+
+    async def hold(socket: FakeSocket):
+        async with manager.connect(socket):  # type: ignore
+            pass
+
+    tasks = [create_task(hold(socket)) for socket in sockets]
+    await _settle()
+    started = monotonic()
+    drain = create_task(manager.drain())
+    await sleep(0.05)
+    progress = manager.drain_progress
+    assert progress["draining"] and progress["total"] == 9
+    assert progress["remaining"] > 0
+    with raises(RuntimeError):
+        async with manager.connect(FakeSocket()):  # type: ignore
+            pass
+    await drain
+    elapsed = monotonic() - started
+    # Three batches spread over 0.3s; one at a time would need over a second
+    assert 0.2 <= elapsed < 0.8
+    assert manager.drain_progress == {
+        "draining": False,
+        "total": 9,
+        "closed": 9,
+        "remaining": 0,
+    }
+    for socket in slow:
+        assert socket.close_code == 1001
+        assert loads(socket.frames[-1]) == {
+            "route": DRAIN_EVENT,
+            "target": None,
+            "sender": None,
+            "type": "reconnect",
+            "data": {"retry_after": 1},
+        }
+    # A socket that won't close doesn't hold up the drain
+    assert not hung.closed
+    for socket in sockets:
+        socket.inbound.put_nowait(None)
+    await gather(*tasks)
+    await manager.dispose()
@@ -0,0 +1,80 @@
+from asyncio import wait_for
+from fastapi import status
+from fastapi_cruddy_framework import (
+    BrowserTestClient,
+    WebSocketSession,
+    LIVE_QUERY_EVENT,
+)
+
+
+# Bounded, so a missing delta fails the test instead of hanging the suite
+async def _next_live_query(websocket: WebSocketSession) -> dict:
+    message = await wait_for(websocket.receive_json(), 5)
+    while message["route"] != LIVE_QUERY_EVENT:
+        message = await wait_for(websocket.receive_json(), 5)
+    return message
+
+
+async def test_live_query_pushes_deltas(
+    authenticated_client: BrowserTestClient,
+    authenticated_websocket_by_id: WebSocketSession,
+):
+    websocket = authenticated_websocket_by_id
+    await websocket.send_json(
+        data={
+            "route": LIVE_QUERY_EVENT,
+            "type": "subscribe",
+            "target": "councils",
+            "data": {"resource": "Group", "where": {"name": "Council of %"}},
+        }
+    )
+    message = await _next_live_query(websocket)
+    assert (message["target"], message["type"]) == ("councils", "subscribed")
+
+    # Outside the where, so only the matching create is pushed
+    response = await authenticated_client.post(
+        "/groups", json={"group": {"name": "Fellowship"}}
+    )
+    fellowship_id = response.json()["group"]["id"]
+    response = await authenticated_client.post(
+        "/groups", json={"group": {"name": "Council of Elrond"}}
+    )
+    council_id = response.json()["group"]["id"]
+    message = await _next_live_query(websocket)
+    assert message["type"] == "upsert"
+    assert message["data"]["id"] == council_id
+    assert message["data"]["name"] == "Council of Elrond"
+
+    # Updated out of the result set
+    response = await authenticated_client.patch(
+        f"/groups/{council_id}", json={"group": {"name": "White Council"}}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    message = await _next_live_query(websocket)
+    assert (message["type"], message["data"]["id"]) == ("remove", council_id)
+
+    # Updated into it
+    await authenticated_client.patch(
+        f"/groups/{fellowship_id}", json={"group": {"name": "Council of the Wise"}}
+    )
+    message = await _next_live_query(websocket)
+    assert (message["type"], message["data"]["id"]) == ("upsert", fellowship_id)
+
+    await authenticated_client.delete(f"/groups/{council_id}")
+    await authenticated_client.delete(f"/groups/{fellowship_id}")
+    message = await _next_live_query(websocket)
+    assert (message["type"], message["data"]["id"]) == ("remove", fellowship_id)
+
+    await websocket.send_json(
+        data={
+            "route": LIVE_QUERY_EVENT,
+            "type": "subscribe",
+            "target": "casts",
+            "data": {"resource": "Group", "where": {"name:VARCHAR": "x"}},
+        }
+    )
+    message = await _next_live_query(websocket)
+    assert (message["target"], message["type"]) == ("casts", "error")
+    await websocket.send_json(
+        data={"route": LIVE_QUERY_EVENT, "type": "unsubscribe", "target": "councils"}
+    )
@@ -1,3 +1,4 @@
+from asyncio import sleep
 from pytest import mark
 from fastapi_cruddy_framework import (
     WebSocketSession,
@@ -133,3 +134,39 @@ async def test_room_join_leave_message_client(
     assert message["sender"] == client_id
     assert message["type"] == "direct_message"
     assert message["data"] == datagram
+
+
+@mark.dependency()
+async def test_room_indexes(authenticated_websocket_by_id: WebSocketSession):
+    from examples.fastapi_cruddy_sqlite.services.websocket_1 import (
+        websocket_manager_1,
+    )
+
+    room_name = "The Mines of Moria"
+
+    await authenticated_websocket_by_id.send_json(
+        data={"route": CONTROL_EVENT, "type": "client_get_id", "target": "self"}
+    )
+    message = await authenticated_websocket_by_id.receive_json()
+    socket_id = message["data"]["id"]
+    assert len(websocket_manager_1.get_sockets_by_id(socket_id)) == 1
+
+    await authenticated_websocket_by_id.send_json(
+        data={"route": CONTROL_EVENT, "type": "client_join_room", "target": room_name}
+    )
+    for _ in range(100):
+        if room_name in websocket_manager_1.get_room_list():
+            break
+        await sleep(0.05)
+    assert websocket_manager_1.get_sockets_by_room(
+        room_name
+    ) == websocket_manager_1.get_sockets_by_id(socket_id)
+
+    await authenticated_websocket_by_id.send_json(
+        data={"route": CONTROL_EVENT, "type": "client_leave_room", "target": room_name}
+    )
+    for _ in range(100):
+        if room_name not in websocket_manager_1.get_room_list():
+            break
+        await sleep(0.05)
+    assert websocket_manager_1.get_sockets_by_room(room_name) == []